@@ -13,7 +13,36 @@ import logging
 import traceback
 import json as _json
 import time
-import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from cusdec_batch import BatchClient, BatchJobStore, mark_ingested, poll_batch_run, submit_batch_run
+from cusdec_gemini import (CONTEXT_CACHE_MODE, GEMINI_API_BASE, GEMINI_SLOTS, RESPONSE_CACHE, RESPONSE_CACHE_ENABLED,
+                           ContextCacheManager, ModelCatalog, collect_gemini_calls, current_call_log,
+                           current_late_call_sink,
+                           generate_content_body, is_cached_content_error, log_gemini_call, model_endpoint,
+                           model_from_endpoint, response_cache_key)
+from cusdec_hedge import GEMINI_HEDGER, HEDGE_DEFAULT_DELAY_SECONDS, HEDGE_SLOTS, HEDGE_TARGET
+from cusdec_http import GEMINI_CONCURRENCY, HTTP_SESSION, prewarm_http_session
+from cusdec_items import item_column_order, iter_item_records
+from cusdec_local import HYBRID_EXTRACTION_ENABLED, LOCAL_EXTRACTION_ENABLED, confident_fields, extract_fields_locally
+from cusdec_pdf import PARSE_CACHE, get_parsed_page, start_parse_pool, submit_parse_jobs
+from cusdec_prompt import (COMMON_FIELDS_MAP, JSON_OUTPUT_ENABLED, PACKED_DOCUMENTS_PER_REQUEST, build_document_prompt,
+                           build_instruction, build_packed_prompt, build_packed_response_schema, build_response_schema,
+                           compact_document_text, decode_json_response, decode_packed_response, estimate_tokens,
+                           json_generation_config, parse_field_lines, split_packed_text_reply)
+from cusdec_ratelimit import GEMINI_RATE_LIMITER
+from cusdec_retry import (CIRCUIT_REQUEUE_ROUNDS, CIRCUIT_REQUEUE_WAIT_SECONDS, GEMINI_CIRCUIT, RETRY_MAX_DELAY_SECONDS,
+                          RETRYABLE_STATUS_CODES, CircuitOpenError, RetryBudget, current_retry_budget, retry_delay)
+from cusdec_router import GEMINI_FALLBACK_MODELS, MODEL_NOT_FOUND_DEMOTION_SECONDS, MODEL_PRICES, ModelRouter
+from cusdec_stream import (STREAM_CONNECT_TIMEOUT_SECONDS, STREAM_STALL_SECONDS, STREAMING_ENABLED, FieldStreamer,
+                            current_field_sink, read_stream_reply)
+from cusdec_usage import (BATCH_PRICE_RATIO, USAGE_LEDGER, UsageTally, call_usage, current_usage_tally,
+                           format_usage, record_late_call, share_call, sum_usage)
+from cusdec_triage import ROUTE_REJECT, triage_pdf
 
 # --- Setup logging to terminal and browser console ---
 logger = logging.getLogger("cusdec_app")
@@ -257,101 +286,340 @@ else:
         pass
 
 # UPDATED: Use gemini-2.5-flash which was found in your valid models list
-gemini_endpoint = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+gemini_endpoint = model_endpoint("gemini-2.5-flash")
 
 
-def get_available_models(api_key):
+@st.cache_resource
+def prewarm_gemini_connections():
+    """Open the pooled Gemini connections once per server process, in the background."""
+    threading.Thread(target=prewarm_http_session, args=(HTTP_SESSION, f"{GEMINI_API_BASE}/models"),
+                     kwargs={"headers": {"X-goog-api-key": gemini_api_key}}, daemon=True).start()
+    return True
+
+
+@st.cache_resource
+def get_context_cache(model):
+    """One context-cache handle manager per model and server process, surviving reruns."""
+    return ContextCacheManager(gemini_api_key, model)
+
+
+@st.cache_resource
+def get_model_catalog():
+    """The models this API key can use, listed once at server start and refreshed in the background."""
+    catalog = ModelCatalog(gemini_api_key)
+    catalog.refresh()
+    log_info(f"Gemini model catalog: {catalog.summary()}")
+    return catalog
+
+
+@st.cache_resource
+def get_model_router():
     """
-    Diagnostic function to check what models are actually enabled for this API key.
+    The model router with its rolling statistics, shared by every session of the process.
+    Configured models the key cannot use are left out; if that leaves none, the first usable
+    model from the price table stands in, so a retired gemini_endpoint needs no code edit.
     """
+    configured = list(dict.fromkeys([model_from_endpoint(gemini_endpoint)] + GEMINI_FALLBACK_MODELS))
+    models = get_model_catalog().select(configured, substitutes=list(MODEL_PRICES))
+    if not models:
+        log_error(f"None of the Gemini models {', '.join(configured)} is available for this API key")
+        models = configured
+    elif models != configured:
+        log_warning(f"Gemini models not available for this API key: "
+                    f"{', '.join(m for m in configured if m not in models) or 'none'}; routing to {', '.join(models)}")
+    return ModelRouter(models)
+
+
+def check_gemini_setup():
+    """
+    Stop on a rejected API key and say which configured models are being replaced, before any
+    document is processed. Models that disappear from a refreshed list are demoted.
+    """
+    catalog = get_model_catalog()
+    if catalog.key_status == "invalid":
+        err_msg = f"The Gemini API key was rejected ({catalog.error}). Please check GOOGLE_API_KEY."
+        st.error(err_msg)
+        log_error(err_msg)
+        st.stop()
+    router = get_model_router()
+    primary = model_from_endpoint(gemini_endpoint)
+    if primary not in router.models:
+        st.warning(f"Gemini model {primary} is not available for this API key; using {', '.join(router.models)}.")
+    for model in router.models:
+        if catalog.knows(model) is False and not router.is_demoted(model):
+            router.demote(model, "no longer in the model list", MODEL_NOT_FOUND_DEMOTION_SECONDS)
+
+
+def send_generate_content(model, data, headers, slots=GEMINI_SLOTS, hedge=False, streamer=None):
+    """
+    POST one generateContent body to model, in a slot of the semaphore the caller acquired;
+    the slot is released here, possibly on a hedging thread. Never raises: returns the attempt
+    {"model", "data", "response", "error", "latency", "hedge"}.
+    With a streamer (cusdec_stream.FieldStreamer) the request goes to streamGenerateContent and
+    the text is fed to it as it arrives. A 200 attempt also has the decoded "reply" (assembled
+    from the stream when streaming) and, when streamed, "first_field_s", the seconds until the
+    first field was parsed.
+    """
+    sent = {"model": model, "data": data, "response": None, "error": None, "latency": 0.0, "hedge": hedge}
+    started_at = time.perf_counter()
     try:
-        url = "https://generativelanguage.googleapis.com/v1beta/models"
-        headers = {"X-goog-api-key": api_key}
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            # Extract just the model names
-            model_names = [m.get('name', '').replace('models/', '') for m in data.get('models', [])]
-            return model_names
+        if streamer is None:
+            response = HTTP_SESSION.post(model_endpoint(model), headers=headers, json=data, timeout=30)
+            sent["response"] = response
+            if response.status_code == 200:
+                try:
+                    sent["reply"] = response.json()
+                except ValueError:
+                    pass
         else:
-            logger.error(f"Failed to list models: {response.text}")
-            return []
-    except Exception as e:
-        logger.error(f"Error checking models: {e}")
-        return []
-
+            # The read timeout bounds the gap between chunks, so a stalled stream is given up early
+            response = HTTP_SESSION.post(model_endpoint(model, "streamGenerateContent"), params={"alt": "sse"},
+                                         headers=headers, json=data, stream=True,
+                                         timeout=(STREAM_CONNECT_TIMEOUT_SECONDS, STREAM_STALL_SECONDS))
+            sent["response"] = response
+            if response.status_code == 200:
+                with response:
+                    sent["reply"] = read_stream_reply(response, streamer)
+                if streamer.first_field_at is not None:
+                    sent["first_field_s"] = streamer.first_field_at - started_at
+    except requests.exceptions.RequestException as e:
+        sent["response"] = None
+        sent["error"] = e
+    finally:
+        sent["latency"] = time.perf_counter() - started_at
+        slots.release()
+    return sent
+
+
+def gemini_call_entry(sent, route, status):
+    """The call-log entry for one attempt, with its token counts and cost when it was answered."""
+    entry = {"model": sent["model"], "route": route, "status": status, "latency_s": round(sent["latency"], 2)}
+    if "reply" in sent:
+        entry.update(call_usage(sent["model"], sent["reply"].get("usageMetadata")))
+    if sent["hedge"]:
+        entry["hedge"] = True
+    if "first_field_s" in sent:
+        entry["first_field_s"] = round(sent["first_field_s"], 2)
+    return entry
+
+
+def generate_content(prompt, generation_config=None, instruction=None, use_cache=True, new_streamer=None,
+                     usable=None):
+    """
+    POST one generateContent request to the model the router picks for each attempt.
+    instruction is the static instruction block; it is sent through the context cache
+    (cachedContent or systemInstruction) rather than in the prompt. With hedging on, an attempt
+    still pending after the model's p95 latency is duplicated and the first good answer is used.
+    Every attempt is entered in the current Gemini call log (model, routing reason, status, latency).
+    A reply already in the response cache for the same prompt, config and model is returned without
+    a call; use_cache=False skips that lookup (the fresh reply still replaces the cached one).
+    new_streamer() returns a FieldStreamer for each attempt; with it the reply is streamed (hedges
+    are not, so only one attempt at a time feeds the fields shown).
+    usable(reply) says whether the caller can decode the reply; only a usable reply is cached, so a
+    garbled one is not served again for the cache's lifetime. Without it any reply with text is.
+    """
+    router = get_model_router()
+    if RESPONSE_CACHE_ENABLED and use_cache:
+        started_at = time.perf_counter()
+        # Any model's answer will do; the router's list order decides which one is preferred
+        cache_keys = {response_cache_key(m, prompt, generation_config, instruction): m for m in router.models}
+        cache_key, cached = RESPONSE_CACHE.get_first(list(cache_keys))
+        if cached is not None:
+            model = cache_keys[cache_key]
+            log_gemini_call(model=model, route="response cache", status=200,
+                            latency_s=round(time.perf_counter() - started_at, 3), cache_hit=True)
+            log_info(f"Gemini reply served from the response cache ({model})")
+            return cached
 
-def generate_content(prompt):
     headers = {
         "Content-Type": "application/json",
         "X-goog-api-key": gemini_api_key
     }
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
+    request_body = generate_content_body(prompt, generation_config)
+    cache_refreshed = False
+    # Input tokens this call is expected to use, for the TPM bucket (corrected from usageMetadata)
+    estimated_tokens = estimate_tokens(prompt) + estimate_tokens(instruction or "")
+    # Hedge losers finish on other threads, possibly after the caller has totalled its calls:
+    # they go to the caller's late-call sink (or, without one, straight into this list)
+    call_log = current_call_log.get()
+    late_call_sink = current_late_call_sink.get()
+
+    def request_data(model):
+        data = dict(request_body)
+        if instruction:
+            data.update(get_context_cache(model).request_fields(instruction))
+        return data
 
     max_retries = 3
-    retry_delay = 2  # start with 2 seconds
+    # Retries of the whole run share one budget (set by the worker threads); None = per-call limit only
+    budget = current_retry_budget.get()
+
+    def may_retry(attempt):
+        return attempt < max_retries and (budget is None or budget.try_spend())
 
     for attempt in range(max_retries + 1):
-        try:
-            logger.debug(f"Calling Gemini API (Attempt {attempt + 1}): {gemini_endpoint}")
-            log_info("Calling Gemini API...")
+        # During an outage fail fast instead of queuing up behind the backoff of every other file
+        if not GEMINI_CIRCUIT.allow():
+            raise CircuitOpenError(GEMINI_CIRCUIT.retry_after())
+        model, route_reason = router.choose(estimated_tokens)
+        logger.debug(f"Calling Gemini API (Attempt {attempt + 1}): {model_endpoint(model)} [{route_reason}]")
+        log_info("Calling Gemini API...")
+
+        primary_data = request_data(model)
+        # Before the slot is taken: the sink it resets updates the page, and may raise
+        streamer = new_streamer() if new_streamer else None
+        # Wait for RPM/TPM quota, then for an in-flight slot (send_generate_content releases it)
+        GEMINI_RATE_LIMITER.acquire(estimated_tokens)
+        GEMINI_SLOTS.acquire()
+
+        def hedge_request(primary_model=model):
+            # Optional traffic: only with a free slot and quota to spare right now
+            hedge_model = router.hedge_model(primary_model, estimated_tokens) if HEDGE_TARGET == "secondary" \
+                else primary_model
+            try:
+                # Built before a slot is taken, so a failure here has nothing to release
+                hedge_data = request_data(hedge_model)
+            except Exception as e:
+                logger.warning(f"Could not prepare a hedge request for {hedge_model}: {e}")
+                return None
+            if not HEDGE_SLOTS.acquire(blocking=False):
+                return None
+            if not GEMINI_RATE_LIMITER.try_acquire(estimated_tokens):
+                HEDGE_SLOTS.release()
+                return None
+            return in_script_run_context(
+                partial(send_generate_content, hedge_model, hedge_data, headers, HEDGE_SLOTS, hedge=True))
+
+        def settle_loser(loser, route=route_reason):
+            # The slower of a hedged pair still counts for its model's health and in the call log
+            status = loser["response"].status_code if loser["response"] is not None else "network error"
+            if status == 200 or status == "network error" or status in RETRYABLE_STATUS_CODES:
+                router.record(loser["model"], loser["latency"], ok=status == 200)
+            if late_call_sink is not None:
+                late_call_sink(gemini_call_entry(loser, route, status))
+            elif call_log is not None:
+                call_log.append(gemini_call_entry(loser, route, status))
+
+        sent = GEMINI_HEDGER.call(
+            in_script_run_context(partial(send_generate_content, model, primary_data, headers, streamer=streamer)),
+            hedge_request,
+            router.p95(model) or HEDGE_DEFAULT_DELAY_SECONDS,
+            lambda result: result["response"] is not None and result["response"].status_code == 200,
+            settle_loser)
+        if sent["hedge"]:
+            route_reason = f"hedge for a slow {model} call"
+        model, data, response, latency = sent["model"], sent["data"], sent["response"], sent["latency"]
+        endpoint = model_endpoint(model)
+
+        if sent["error"] is not None:
+            e = sent["error"]
+            log_gemini_call(**gemini_call_entry(sent, route_reason, "network error"))
+            router.record(model, latency, ok=False)
+            GEMINI_CIRCUIT.record_failure()
+            wait_time, _ = retry_delay(attempt)
+            if may_retry(attempt):
+                # Another model takes over straight away; the same one gets a backoff first
+                if router.fails_over(model):
+                    wait_time = 0.0
+                log_warning(f"Gemini API request failed ({e}). Retrying in {wait_time:.1f}s...")
+                time.sleep(wait_time)
+                continue
+            if GEMINI_CIRCUIT.is_open:
+                raise CircuitOpenError(GEMINI_CIRCUIT.retry_after())
+            tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+            err_msg = f"Error calling Gemini API: {e}\n{tb}"
+            st.error(err_msg)
+            log_error(err_msg)
+            return None
 
-            response = requests.post(gemini_endpoint, headers=headers, json=data, timeout=30)
+        log_gemini_call(**gemini_call_entry(sent, route_reason, response.status_code))
 
-            # If 429, retry
+        # Cache handle expired or deleted server-side: recreate it once and resend
+        if "cachedContent" in data and not cache_refreshed and response.status_code != 200 and \
+                is_cached_content_error(response.status_code, response.text):
+            GEMINI_CIRCUIT.release_probe()
+            log_warning(f"Gemini context cache {data['cachedContent']} is no longer valid; recreating it")
+            get_context_cache(model).invalidate(data["cachedContent"])
+            cache_refreshed = True
+            continue
+
+        # 429 and transient 5xx: wait as long as the server asks (Retry-After / RetryInfo), else back off
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            router.record(model, latency, ok=False)
             if response.status_code == 429:
-                if attempt < max_retries:
-                    wait_time = retry_delay * (2 ** attempt) + random.uniform(0, 1)
-                    log_warning(f"Rate limit hit (429). Retrying in {wait_time:.1f}s...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    err_msg = f"Gemini API 429 Error: Rate limit exceeded after {max_retries} retries."
-                    st.error(err_msg)
-                    log_error(err_msg)
-                    return None
-
-            # If 404, specifically check for Model Not Found and diagnose
-            if response.status_code == 404:
-                err_msg = f"Gemini API 404 Error (Model Not Found): {gemini_endpoint}"
-                st.error(err_msg)
-
-                # --- Auto-Diagnosis ---
-                st.warning("Running Auto-Diagnosis to find valid models for your key...")
-                available_models = get_available_models(gemini_api_key)
-                if available_models:
-                    st.success(f"Diagnosis Complete. Your API key supports these models: {', '.join(available_models)}")
-                    st.info(
-                        "Please update the 'gemini_endpoint' variable in your code to match one of the valid models above.")
-                else:
-                    st.error(
-                        "Diagnosis Failed. Could not list models. Please check if your API key is valid and has 'Generative Language API' enabled in Google AI Studio.")
+                GEMINI_RATE_LIMITER.throttled()
+            wait_time, from_server = retry_delay(attempt, response)
+            # A 429 with a usable hint is flow control, not an outage; anything else counts towards the breaker
+            if response.status_code == 429 and from_server and wait_time <= RETRY_MAX_DELAY_SECONDS:
+                GEMINI_CIRCUIT.release_probe()
+            else:
+                GEMINI_CIRCUIT.record_failure()
+            if router.fails_over(model):
+                wait_time = 0.0
+            if wait_time <= RETRY_MAX_DELAY_SECONDS and may_retry(attempt):
+                hint = " as requested by the server" if from_server else ""
+                log_warning(f"Gemini API returned {response.status_code}. Retrying in {wait_time:.1f}s{hint}...")
+                time.sleep(wait_time)
+                continue
+            if GEMINI_CIRCUIT.is_open:
+                # Out of retries in the middle of an outage: let the caller re-queue it for after the outage
+                raise CircuitOpenError(GEMINI_CIRCUIT.retry_after())
+            if wait_time > RETRY_MAX_DELAY_SECONDS:
+                reason = f"the server asks to wait {wait_time:.0f}s"
+            elif attempt < max_retries:
+                reason = "the retry budget of this run is used up"
+            else:
+                reason = f"{max_retries} retries"
+            err_msg = f"Gemini API {response.status_code} Error: giving up after {reason}."
+            st.error(err_msg)
+            log_error(err_msg)
+            return None
 
-                log_error(err_msg)
-                return None
+        # Anything else is about this request, not Gemini's health
+        if response.status_code == 200:
+            GEMINI_CIRCUIT.record_success()
+        else:
+            GEMINI_CIRCUIT.release_probe()
 
-            if response.status_code != 200:
-                body_preview = response.text[:2000]
-                err_msg = f"Gemini API returned {response.status_code}: {body_preview}"
-                st.error(err_msg)
-                log_error(err_msg)
-                return None
+        # If 404, specifically check for Model Not Found and diagnose
+        if response.status_code == 404:
+            router.demote(model, "model not found", MODEL_NOT_FOUND_DEMOTION_SECONDS)
+            if router.fails_over(model):
+                log_warning(f"Gemini model {model} not found; routing to the next model")
+                continue
+            err_msg = f"Gemini API 404 Error (Model Not Found): {endpoint}"
+            st.error(err_msg)
 
-            response.raise_for_status()
-            log_info("Gemini API call successful")
-            return response.json()
+            # --- Auto-Diagnosis (from the model list cached at startup) ---
+            available_models = get_model_catalog().models()
+            if available_models:
+                st.success(f"Diagnosis Complete. Your API key supports these models: {', '.join(available_models)}")
+                st.info(
+                    "Please update the 'gemini_endpoint' variable in your code to match one of the valid models above.")
+            else:
+                st.error(
+                    "Diagnosis Failed. Could not list models. Please check if your API key is valid and has 'Generative Language API' enabled in Google AI Studio.")
 
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries:
-                wait_time = retry_delay * (2 ** attempt)
-                time.sleep(wait_time)
-                continue
-            tb = traceback.format_exc()
-            err_msg = f"Error calling Gemini API: {e}\n{tb}"
+            log_error(err_msg)
+            return None
+
+        if response.status_code != 200:
+            body_preview = response.text[:2000]
+            err_msg = f"Gemini API returned {response.status_code}: {body_preview}"
             st.error(err_msg)
             log_error(err_msg)
             return None
 
+        router.record(model, latency, ok=True)
+        log_info(f"Gemini API call successful ({model})")
+        # Decoded (or assembled from the stream) by send_generate_content
+        response_json = sent["reply"] if "reply" in sent else response.json()
+        GEMINI_RATE_LIMITER.settle(estimated_tokens, response_json.get("usageMetadata"))
+        if RESPONSE_CACHE_ENABLED and (usable(response_json) if usable else response_text(response_json)):
+            RESPONSE_CACHE.put(response_cache_key(model, prompt, generation_config, instruction), response_json)
+        return response_json
+    return None
+
 
 def extract_page_from_pdf(pdf_file_object):
     try:
@@ -414,164 +682,202 @@ def extract_customs_reference_date(document_text, raw_customs_ref):
     return ""
 
 
-def extract_data_fields(file_bytes, filename):
+def response_text(response):
+    """Text of the first candidate of a generateContent response ("" when there is none)."""
+    if response and "candidates" in response and len(response['candidates']) > 0:
+        content_part = response['candidates'][0]['content']['parts'][0]
+        return content_part.get('text', "")
+    return ""
+
+
+def extract_fields_with_gemini(prompt, filename, json_fields=None, instruction=None, use_cache=True):
+    """
+    Send the extraction prompt (and the static instruction block, if separate) to Gemini and
+    parse the reply into {display name: value}.
+    With json_fields ({field-map key: display name}) Gemini is asked for a JSON object matching a
+    schema built from them and the reply is decoded in one parse; otherwise, or if that reply
+    does not decode, the "FieldName: FieldValue" lines are parsed.
+    use_cache=False bypasses the Gemini response cache. In streaming mode each field is also
+    passed to the current field sink as soon as its line or property has arrived.
+    """
+    generation_config = None
+    property_to_display = None
+    if json_fields:
+        response_schema, property_to_display = build_response_schema(json_fields)
+        generation_config = json_generation_config(response_schema)
+    sink = current_field_sink.get()
+
+    def new_streamer():
+        # Called for every attempt: fields a failed or overtaken attempt streamed are withdrawn first
+        if sink:
+            sink(filename, None, None)
+        return FieldStreamer(property_to_display, partial(sink, filename) if sink else None)
+
+    response = generate_content(prompt, generation_config, instruction, use_cache,
+                                new_streamer if STREAMING_ENABLED else None,
+                                usable=partial(reply_has_fields, property_to_display=property_to_display))
+    return decode_gemini_reply(response, filename, property_to_display)
+
+
+def reply_has_fields(response, property_to_display=None):
+    """True when decode_gemini_reply would get at least one field out of response (quietly)."""
+    text = response_text(response)
+    if not text:
+        return False
+    if property_to_display and decode_json_response(text, property_to_display):
+        return True
+    return bool(parse_field_lines(text))
+
+
+def decode_gemini_reply(response, filename, property_to_display=None):
+    """Parse a generateContent response into {display name: value} (JSON first when a schema was used)."""
+    common_data = {}
+
+    # Log the raw Gemini response for debugging
+    if response:
+        logger.debug(f"Gemini response for {filename}: {str(response)[:500]}")
+
+    extracted_text_response = response_text(response)
+    if extracted_text_response:
+        # Log what Gemini returned
+        log_info(f"Gemini extracted text preview (first 500 chars): {extracted_text_response[:500]}")
+        logger.debug(f"Full Gemini response text for {filename}:\n{extracted_text_response}")
+
+        if property_to_display:
+            decoded = decode_json_response(extracted_text_response, property_to_display)
+            if decoded is not None:
+                return decoded
+            log_warning(f"Gemini reply for {filename} was not valid JSON; falling back to line parsing")
+
+        common_data = parse_field_lines(extracted_text_response)
+        for display_key, cleaned_value in common_data.items():
+            logger.debug(f"Parsed field: {display_key} = {cleaned_value[:100]}")
+
+    return common_data
+
+
+def prepare_extraction(file_bytes, filename, parsed_page=None):
+    """
+    Everything before the Gemini call: parse, local rules, region snippets and the compacted page
+    text. Returns an extraction job dict for complete_extraction(), or {"error": ...}.
+    """
     # Reads from bytes, not file object!
-    try:
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            if len(pdf.pages) > 0:
-                page = pdf.pages[0]
-            else:
-                err = f"PDF file {filename} contains no pages."
-                log_error(err)
-                return {"error": err}
-            document_text = page.extract_text()
-    except Exception as e:
-        tb = traceback.format_exc()
-        err = f"Error extracting page from PDF ({filename}): {e}\n{tb}"
-        log_error(err)
-        return {"error": err}
+    # The page is parsed once; full text and every bbox region come from one character index.
+    # parsed_page may already have been produced by the parse pool; otherwise the parse cache is tried first.
+    if parsed_page is None:
+        parsed_page = get_parsed_page(filename, file_bytes)
+    if "error" in parsed_page:
+        log_error(parsed_page["error"])
+        return {"error": parsed_page["error"]}
+
+    document_text = parsed_page["document_text"]
+    specific_box_texts = parsed_page["specific_box_texts"]
 
     if not document_text:
         err = f"No text could be extracted from the first page of {filename}."
         log_error(err)
         return {"error": err}
 
-    # Optimization: If text is extremely long, truncate it.
-    # Most CUSDEC data is on page 1, which we already extracted.
-    # Just in case page 1 is dense, limit to first 3500 chars to speed up API.
-    if len(document_text) > 3500:
-        document_text = document_text[:3500]
-
-    # Custom bbox for additional fields (can be adjusted as needed)
-    specific_box_coords = {
-        "Customs Reference Code E Value": (600, 40, 680, 60),
-        "Declarant Sequence Number Value": (650, 110, 800, 130),
-        "Box 11 Value": (170, 100, 250, 130),
-        "Box 31 Description Value": (550, 300, 800, 450),
-        "Box 31 Full Text": (400, 280, 800, 480),
-        "D.Val Value": (450, 500, 550, 530),
-        "D.Qty Value": (580, 500, 680, 530),
-    }
-
-    specific_box_texts = {}
-    for box_name, bbox in specific_box_coords.items():
-        try:
-            extracted_text = page.extract_text(bbox=bbox)
-            specific_box_texts[box_name] = extracted_text.strip() if extracted_text else ""
-        except Exception:
-            specific_box_texts[box_name] = ""
-
-    specific_text_prompt = ""
-    if "Customs Reference Code E Value" in specific_box_texts:
-        specific_text_prompt += f"Text found in the approximate region of Customs Reference Code E (e.g., CBBE1): \"{specific_box_texts['Customs Reference Code E Value']}\"\n"
-    if "Declarant Sequence Number Value" in specific_box_texts:
-        specific_text_prompt += f"Text found in the approximate region of Declarant's Sequence Number (e.g., 2024 #3041): \"{specific_box_texts['Declarant Sequence Number Value']}\"\n"
-    if "Box 11 Value" in specific_box_texts:
-        specific_text_prompt += f"Text found in the approximate region of Box 11 value: \"{specific_box_texts['Box 11 Value']}\"\n"
-    if "Box 31 Description Value" in specific_box_texts:
-        specific_text_prompt += f"Text found in the approximate region of Box 31 Description value: \"{specific_box_texts['Box 31 Description Value']}\"\n"
-    if "Box 31 Full Text" in specific_box_texts:
-        specific_text_prompt += f"Full text found in the approximate region of Box 31: \"{specific_box_texts['Box 31 Full Text']}\"\n"
-    if "D.Val Value" in specific_box_texts:
-        specific_text_prompt += f"Text found in the approximate region of D.Val value: \"{specific_box_texts['D.Val Value']}\"\n"
-    if "D.Qty Value" in specific_box_texts:
-        specific_text_prompt += f"Text found in the approximate region of D.Qty value: \"{specific_box_texts['D.Qty Value']}\"\n"
-
     # Map for field extraction
-    common_fields_map = {
-        "Customs Reference Code E": "Customs Reference Code E",
-        "Customs Reference Number": "Customs Reference Number",
-        "Declarant Sequence Number": "Declarant's Sequence Number",
-        "Box 2": "Box 2: Exporter",
-        "Box 8": "Box 8: Consignee",
-        "Box 9": "Box 9: Person Responsible for Financial Settlement",
-        "Box 11": "Box 11: Trading",
-        "Box 14": "Box 14: Declarant/Representative",
-        "Box 15": "Box 15: Country of Export",
-        "Box 16": "Box 16: Country of origin",
-        "Box 18": "Box 18: Vessel/Flight",
-        "Box 20": "Box 20: Delivery Terms",
-        "Box 22": "Box 22: Currency & Total Amount Invoiced",
-        "Box 23": "Box 23: Exchange Rate",
-        "Box 28": "Box 28: Financial and banking data",
-        "Guarantee LKR": "Guarantee LKR",
-        "Box 31": "Box 31: Description",
-        "Marks & Nos of Packages": "Marks & Nos of Packages",
-        "Number & Kind": "Number & Kind",
-        # "Description": "Description",
-        "Box 33": "Box 33: Commodity (HS) Code",
-        "Box 35": "Box 35: Gross Mass (Kg)",
-        "Box 38": "Box 38: Net Mass (Kg)",
-        "D.Val": "D.Val",
-        "D.Qty": "D.Qty",
+    common_fields_map = COMMON_FIELDS_MAP
+
+    # Fields the local rules resolve confidently are not asked of Gemini at all (hybrid mode)
+    local_fields = extract_fields_locally(parsed_page) if LOCAL_EXTRACTION_ENABLED else {}
+    local_data = confident_fields(local_fields)
+    if not HYBRID_EXTRACTION_ENABLED and len(local_data) < len(common_fields_map):
+        local_data = {}
+    unresolved_fields = [name for name in common_fields_map.values() if name not in local_data]
+
+    # Region snippets, each sent only while one of the fields it helps with is unresolved
+    region_prompts = [
+        ("Customs Reference Code E Value",
+         "Text found in the approximate region of Customs Reference Code E (e.g., CBBE1)",
+         ["Customs Reference Code E"]),
+        ("Declarant Sequence Number Value",
+         "Text found in the approximate region of Declarant's Sequence Number (e.g., 2024 #3041)",
+         ["Declarant's Sequence Number"]),
+        ("Box 11 Value", "Text found in the approximate region of Box 11 value", ["Box 11: Trading"]),
+        ("Box 31 Description Value", "Text found in the approximate region of Box 31 Description value",
+         ["Box 31: Description"]),
+        ("Box 31 Full Text", "Full text found in the approximate region of Box 31",
+         ["Box 31: Description", "Marks & Nos of Packages", "Number & Kind"]),
+        ("D.Val Value", "Text found in the approximate region of D.Val value", ["D.Val"]),
+        ("D.Qty Value", "Text found in the approximate region of D.Qty value", ["D.Qty"]),
+    ]
+    specific_text_prompt = ""
+    sent_snippets = []
+    for box_name, description, related_fields in region_prompts:
+        if box_name in specific_box_texts and any(name in unresolved_fields for name in related_fields):
+            specific_text_prompt += f"{description}: \"{specific_box_texts[box_name]}\"\n"
+            sent_snippets.append(specific_box_texts[box_name])
+
+    # Fit the page text to the token budget: no layout padding, nothing the snippets already carry,
+    # and the lines nearest the labels of the fields still being asked for
+    prompt_document_text, compaction_stats = compact_document_text(document_text, unresolved_fields, sent_snippets)
+
+    if JSON_OUTPUT_ENABLED:
+        json_fields = {key: name for key, name in common_fields_map.items() if name in unresolved_fields}
+    else:
+        json_fields = None
+
+    if CONTEXT_CACHE_MODE == "off":
+        # Everything in one prompt, with field hints and names only for the unresolved fields
+        instruction = None
+        prompt = build_instruction(unresolved_fields) + "\n" + build_document_prompt(specific_text_prompt,
+                                                                                      prompt_document_text)
+    elif CONTEXT_CACHE_MODE == "system":
+        # The instruction is paid in full on every request, so it carries only the unresolved fields' hints
+        instruction = build_instruction(unresolved_fields)
+        prompt = build_document_prompt(specific_text_prompt, prompt_document_text, unresolved_fields)
+    else:
+        # The instruction block covering every field is identical for every document, so one context
+        # cache serves them all; the trade-off is that a hybrid call also carries (at the cached-token
+        # rate) the hints of the fields resolved locally. The prompt carries only this document's part
+        instruction = build_instruction()
+        prompt = build_document_prompt(specific_text_prompt, prompt_document_text, unresolved_fields)
+
+    if not unresolved_fields:
+        log_info(f"All fields of {filename} resolved locally; skipping Gemini")
+    else:
+        if local_data:
+            log_info(f"{len(local_data)} fields of {filename} resolved locally; "
+                     f"asking Gemini for the other {len(unresolved_fields)}")
+        log_info(f"Prompt text for {filename}: {compaction_stats['tokens_after']} tokens "
+                 f"(~{compaction_stats['tokens_saved']} saved by compaction)")
+
+    return {
+        "filename": filename,
+        "document_text": document_text,
+        "local_fields": local_fields,
+        "local_data": local_data,
+        "unresolved_fields": unresolved_fields,
+        "json_fields": json_fields,
+        "specific_text_prompt": specific_text_prompt,
+        "prompt_document_text": prompt_document_text,
+        "compaction_stats": compaction_stats,
+        "prompt": prompt,
+        "instruction": instruction,
     }
-    fields_to_extract_prompt_list = list(common_fields_map.values())
-    fields_to_extract_prompt = "\n".join([f"- {name}" for name in fields_to_extract_prompt_list])
-
-    prompt = f"""Analyze the following text from the first page of a SRI LANKA CUSTOMS-GOODS DECLARATION (CUSDEC II) document.
-{specific_text_prompt}
-Extract the following specific fields. For each field, look for the associated label and extract the value next to it.
-For 'Customs Reference Code E', use the text provided from its approximate region (e.g., CBBE1).
-For 'Customs Reference Number', extract all reference numbers (e.g., E 72766, E 76315, etc.) and keep the original lines.
-For 'Declarant's Sequence Number', use the text provided from its approximate region (e.g., 2024 #3041).
-For 'Marks & Nos of Packages', 'Number & Kind', and 'Description', extract the relevant text block under Box 31 and split according to the sublabels.
-Return fields in "FieldName: FieldValue" format. Use FieldName exactly as specified below.
-Common Fields to Extract:
-{fields_to_extract_prompt.strip()}
-If a field is not found, indicate 'Not Found'.
-Document text:
-{document_text}"""
-
-    response = generate_content(prompt)
-    common_data = {}
-    extracted_text_response = ""
 
-    # Log the raw Gemini response for debugging
-    if response:
-        logger.debug(f"Gemini response for {filename}: {str(response)[:500]}")
 
-    if response and "candidates" in response and len(response['candidates']) > 0:
-        content_part = response['candidates'][0]['content']['parts'][0]
-        if 'text' in content_part:
-            extracted_text_response = content_part['text']
-            # Log what Gemini returned
-            log_info(f"Gemini extracted text preview (first 500 chars): {extracted_text_response[:500]}")
-            logger.debug(f"Full Gemini response text for {filename}:\n{extracted_text_response}")
-
-            for line in extracted_text_response.strip().split('\n'):
-                line = line.strip()
-                # Remove leading bullet points or list markers (-, *, •, etc.)
-                line = re.sub(r'^[-*•]\s*', '', line)
-                if ": " in line:
-                    parts = line.split(": ", 1)
-                    if len(parts) == 2:
-                        gemini_key, value = parts[0].strip(), parts[1].strip()
-                        display_key = None
-                        for key_from_map, val_from_map in common_fields_map.items():
-                            if key_from_map == gemini_key or val_from_map == gemini_key:
-                                display_key = val_from_map
-                                break
-                        if display_key:
-                            cleaned_value = value.strip()
-                            potential_prefixes = []
-                            if gemini_key:
-                                potential_prefixes.extend([f"{gemini_key}:", f"{gemini_key} :", f"{gemini_key} "])
-                                gemini_key_parts = re.split(r'[:\s]+', gemini_key)
-                                for part in gemini_key_parts:
-                                    if part: potential_prefixes.extend([f"{part}:", f"{part} :", f"{part} "])
-                            if display_key:
-                                potential_prefixes.extend([f"{display_key}:", f"{display_key} :", f"{display_key} "])
-                                display_key_parts = re.split(r'[:\s]+', display_key)
-                                for part_dp in display_key_parts:
-                                    if part_dp: potential_prefixes.extend(
-                                        [f"{part_dp}:", f"{part_dp} :", f"{part_dp} "])
-                            potential_prefixes = sorted(list(set(potential_prefixes)), key=len, reverse=True)
-                            for prefix in potential_prefixes:
-                                if re.match(re.escape(prefix), cleaned_value, re.IGNORECASE):
-                                    cleaned_value = cleaned_value[len(prefix):].strip();
-                                    break
-                            common_data[display_key] = cleaned_value
-                            logger.debug(f"Parsed field: {display_key} = {cleaned_value[:100]}")
+def complete_extraction(job, gemini_data=None, packing=None, gemini_calls=None):
+    """
+    Merge Gemini's fields (None when no call was needed) with the local ones and post-process
+    them into the record's data dict. packing describes a packed request and gemini_calls lists
+    the Gemini attempts made for the document, for the _meta record.
+    """
+    filename = job["filename"]
+    document_text = job["document_text"]
+    local_data = job["local_data"]
+    if gemini_data is None:
+        # Every field resolved by the local rules: no network call needed
+        common_data = dict(local_data)
+        extraction_source = "local"
+    else:
+        common_data = dict(gemini_data)
+        # Locally resolved values win over anything Gemini volunteers for them
+        common_data.update(local_data)
+        extraction_source = "hybrid" if local_data else "gemini"
 
     # Log how many fields were extracted
     log_info(f"Extracted {len(common_data)} fields from {filename}")
@@ -635,9 +941,313 @@ Document text:
     common_data["Currency"] = currency
     common_data["Total Amount Invoiced"] = total_amount
 
+    # Bookkeeping for the UI; not an extracted field
+    common_data["_meta"] = {
+        "extraction_source": extraction_source,
+        "local_confidence": {name: field["confidence"] for name, field in job["local_fields"].items()},
+        "prompt_compaction": job["compaction_stats"],
+    }
+    if packing:
+        common_data["_meta"]["packing"] = packing
+    if gemini_calls:
+        common_data["_meta"]["gemini_calls"] = gemini_calls
+        answered = [call for call in gemini_calls if call["status"] == 200]
+        if answered:
+            common_data["_meta"]["model"] = answered[-1]["model"]
+            common_data["_meta"]["route"] = answered[-1]["route"]
+            common_data["_meta"]["response_cache_hit"] = bool(answered[-1].get("cache_hit"))
+            if "first_field_s" in answered[-1]:
+                common_data["_meta"]["first_field_s"] = answered[-1]["first_field_s"]
+        common_data["_meta"]["usage"] = sum_usage(gemini_calls)
+        USAGE_LEDGER.record(filename, gemini_calls)
+
     return common_data
 
 
+def late_call_sink(documents):
+    """Hedge losers of a request for documents [(filename, share)] go to the ledger and the usage tally."""
+    return partial(record_late_call, documents, current_usage_tally.get())
+
+
+def extract_data_fields(file_bytes, filename, parsed_page=None, force=False):
+    """
+    Extract one document's fields, with its own Gemini call if the local rules leave any unresolved.
+    force=True asks Gemini again even if its reply to the same prompt is in the response cache.
+    """
+    job = prepare_extraction(file_bytes, filename, parsed_page)
+    if "error" in job:
+        return job
+    gemini_data = None
+    gemini_calls = None
+    if job["unresolved_fields"]:
+        with collect_gemini_calls(late_call_sink([(filename, 1.0)])) as gemini_calls:
+            gemini_data = extract_fields_with_gemini(job["prompt"], filename, job["json_fields"], job["instruction"],
+                                                     use_cache=not force)
+    return complete_extraction(job, gemini_data, gemini_calls=gemini_calls)
+
+
+def extract_data_fields_packed(jobs):
+    """
+    Extract several documents with one Gemini request: their prompts are packed between
+    per-document delimiters and the reply is keyed by document id. Any document whose section
+    is missing or does not parse is retried with its own single-document call.
+    Returns {filename: data dict}.
+    """
+    if len(jobs) == 1:
+        job = jobs[0]
+        with collect_gemini_calls(late_call_sink([(job["filename"], 1.0)])) as gemini_calls:
+            gemini_data = extract_fields_with_gemini(job["prompt"], job["filename"], job["json_fields"],
+                                                     job["instruction"])
+        return {job["filename"]: complete_extraction(job, gemini_data, gemini_calls=gemini_calls)}
+
+    doc_ids = {f"doc{n + 1}": job for n, job in enumerate(jobs)}
+    sections = [(doc_id, job["specific_text_prompt"], job["prompt_document_text"], job["unresolved_fields"])
+                for doc_id, job in doc_ids.items()]
+    instruction = build_instruction()
+    prompt = build_packed_prompt(sections)
+    if CONTEXT_CACHE_MODE == "off":
+        prompt = instruction + "\n" + prompt
+        instruction = None
+
+    generation_config = None
+    property_maps = None
+    if JSON_OUTPUT_ENABLED:
+        packed_schema, property_maps = build_packed_response_schema(
+            {doc_id: job["json_fields"] for doc_id, job in doc_ids.items()})
+        generation_config = json_generation_config(packed_schema)
+
+    # Each document is charged for the packed calls in proportion to its share of the prompt
+    prompt_tokens = {doc_id: estimate_tokens(job["prompt"]) for doc_id, job in doc_ids.items()}
+    shares = {doc_id: tokens / sum(prompt_tokens.values()) if sum(prompt_tokens.values()) else 1 / len(jobs)
+              for doc_id, tokens in prompt_tokens.items()}
+
+    filenames = ", ".join(job["filename"] for job in jobs)
+    log_info(f"Packing {len(jobs)} documents into one Gemini request: {filenames}")
+
+    def decode_packed(reply):
+        reply_text = response_text(reply)
+        if property_maps:
+            return decode_packed_response(reply_text, property_maps)
+        return {doc_id: parse_field_lines(section) if section else None
+                for doc_id, section in split_packed_text_reply(reply_text, list(doc_ids)).items()}
+
+    with collect_gemini_calls(late_call_sink([(job["filename"], shares[doc_id])
+                                              for doc_id, job in doc_ids.items()])) as packed_calls:
+        # Cached only if every section decodes; otherwise a recapture would get the same gaps
+        response = generate_content(prompt, generation_config, instruction,
+                                    usable=lambda reply: all(decode_packed(reply).get(doc_id) for doc_id in doc_ids))
+    logger.debug(f"Packed Gemini reply for {filenames}:\n{response_text(response)}")
+    decoded = decode_packed(response)
+
+    results = {}
+    for doc_id, job in doc_ids.items():
+        gemini_data = decoded.get(doc_id)
+        packing = {"documents": len(jobs), "doc_id": doc_id, "fallback": False}
+        gemini_calls = [share_call(call, shares[doc_id]) for call in packed_calls]
+        if not gemini_data:
+            log_warning(f"Packed reply had no usable section for {job['filename']}; "
+                        f"falling back to a single-document request")
+            with collect_gemini_calls(late_call_sink([(job["filename"], 1.0)])) as fallback_calls:
+                gemini_data = extract_fields_with_gemini(job["prompt"], job["filename"], job["json_fields"],
+                                                         job["instruction"])
+            gemini_calls += fallback_calls
+            packing["fallback"] = True
+        results[job["filename"]] = complete_extraction(job, gemini_data, packing, gemini_calls)
+    return results
+
+
+def run_triage(file_bytes, filename):
+    """Pre-triage a PDF; returns (report, error dict or None). Rejected files skip parsing and Gemini."""
+    report = triage_pdf(file_bytes)
+    logger.debug(f"Triage for {filename}: {report}")
+    if report["route"] == ROUTE_REJECT:
+        err = f"Skipped {filename}: {report['reason']}"
+        log_warning(err)
+        return report, {"error": err}
+    return report, None
+
+
+def extract_item_rows(file_bytes, filename):
+    """Stream every page of the PDF and return one row per goods item (multi-item mode)."""
+    try:
+        return list(iter_item_records(file_bytes, filename))
+    except Exception as e:
+        log_error(f"Error extracting item rows from {filename}: {e}\n{traceback.format_exc()}")
+        return []
+
+
+def attach_script_run_context(script_run_ctx):
+    """Worker-thread initializer: let st.* calls (429/404 messages) reach the session's page."""
+    if script_run_ctx is not None:
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+
+
+def in_script_run_context(call):
+    """call, made to run with the caller's script run context on whichever thread ends up running it."""
+    script_run_ctx = get_script_run_ctx()
+
+    def run():
+        attach_script_run_context(script_run_ctx)
+        return call()
+    return run
+
+
+def start_gemini_executor(max_workers=GEMINI_CONCURRENCY):
+    """Worker pool for Gemini requests; GEMINI_SLOTS bounds what is actually in flight."""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini",
+                              initializer=attach_script_run_context, initargs=(get_script_run_ctx(),))
+
+
+def run_gemini_jobs(jobs, retry_budget=None, wait_for_circuit=0, field_sink=None, usage_tally=None):
+    """
+    Worker task: the Gemini request for one prepared job, or one packed request for several.
+    Retries draw on the run's retry_budget. While the circuit breaker is open the task fails
+    with CircuitOpenError, unless wait_for_circuit seconds are given to wait for it to close.
+    field_sink(filename, field, value) receives the fields of a streamed reply as they arrive;
+    usage_tally (cusdec_usage.UsageTally) the usage of hedge losers that finish late.
+    """
+    current_retry_budget.set(retry_budget)
+    current_field_sink.set(field_sink)
+    current_usage_tally.set(usage_tally)
+    deadline = time.monotonic() + wait_for_circuit
+    while True:
+        try:
+            return extract_data_fields_packed(jobs)
+        except CircuitOpenError as e:
+            if time.monotonic() >= deadline:
+                raise
+            # Half-open with another worker's probe in flight reports 0s: poll until it settles
+            time.sleep(min(max(e.retry_after, 0.5), max(0.0, deadline - time.monotonic())))
+
+
+def batch_request_body(job):
+    """The generateContent body for one prepared job, as a line of a Batch API JSONL file."""
+    generation_config = None
+    if job["json_fields"]:
+        response_schema, _ = build_response_schema(job["json_fields"])
+        generation_config = json_generation_config(response_schema)
+    # Batch requests run hours later, so the instruction block goes inline rather than via a context cache
+    return generate_content_body(job["prompt"], generation_config, job["instruction"])
+
+
+def submit_batch_extraction(processing_start_time_utc_str, current_user_login, extract_all_items):
+    """
+    Prepare every uploaded PDF as in the interactive run, then submit the Gemini requests of those
+    that still need one as a single Batch API job. Returns the persisted batch state.
+    """
+    uploaded = st.session_state['cached_uploaded_files']
+    triage_results = {filename: run_triage(file_bytes, filename) for filename, file_bytes in uploaded.items()}
+    parse_futures = submit_parse_jobs(
+        get_parse_pool(),
+        [(filename, file_bytes) for filename, file_bytes in uploaded.items() if triage_results[filename][1] is None])
+
+    records, jobs, requests_by_key = [], {}, {}
+    for i, (filename, file_bytes) in enumerate(uploaded.items()):
+        triage_report, triage_error = triage_results[filename]
+        record = {
+            "filename": filename,
+            "data": triage_error,
+            "items": [],
+            "triage": triage_report,
+            "processing_datetime_utc": processing_start_time_utc_str,
+            "processed_by_user": current_user_login
+        }
+        if triage_error is None:
+            parsed_page = None
+            try:
+                parsed_page = get_parsed_page(filename, file_bytes, parse_futures.get(filename))
+            except Exception as e:
+                logger.warning(f"Parse pool failed for {filename}, parsing inline: {e}")
+            job = prepare_extraction(file_bytes, filename, parsed_page)
+            if "error" in job:
+                record["data"] = job
+            elif job["unresolved_fields"]:
+                key = f"{i:05d}"
+                record["data"], record["batch_key"] = None, key
+                jobs[key] = job
+                requests_by_key[key] = batch_request_body(job)
+            else:
+                record["data"] = complete_extraction(job)
+            if extract_all_items:
+                record["items"] = extract_item_rows(file_bytes, filename)
+        records.append(record)
+
+    return submit_batch_run(BatchClient(gemini_api_key), BatchJobStore(), model_from_endpoint(gemini_endpoint),
+                            records, jobs, requests_by_key)
+
+
+def ingest_batch_results(state, results):
+    """Turn a finished batch's responses into all_extracted_data records, in upload order."""
+    records = []
+    for record in state["records"]:
+        record = dict(record)
+        key = record.pop("batch_key", None)
+        if key is not None:
+            job = state["jobs"][key]
+            response = results.get(key) or {"error": {"message": "no result returned"}}
+            if "candidates" not in response:
+                error = (response.get("error") or {}).get("message", "no candidates returned")
+                record["data"] = {"error": f"Batch request failed for {record['filename']}: {error}"}
+            else:
+                property_to_display = build_response_schema(job["json_fields"])[1] if job["json_fields"] else None
+                batch_call = {"model": state["model"], "route": "batch job", "status": 200,
+                              **call_usage(state["model"], response.get("usageMetadata"), BATCH_PRICE_RATIO)}
+                record["data"] = complete_extraction(
+                    job, decode_gemini_reply(response, record["filename"], property_to_display),
+                    gemini_calls=[batch_call])
+                record["data"]["_meta"]["batch_job"] = state["job_id"]
+        records.append(record)
+    return records
+
+
+def render_batch_jobs():
+    """Persisted offline batch runs: poll the unfinished ones and load finished results."""
+    store = BatchJobStore()
+    batch_states = store.list_jobs()
+    if not batch_states:
+        return
+    with st.expander(f"Offline batch jobs ({len(batch_states)})"):
+        st.dataframe(pd.DataFrame([{
+            "Job": state["job_id"],
+            "Files": len(state["records"]),
+            "Gemini requests": len(state["jobs"]),
+            "Remote state": state["remote_state"],
+            "Status": state["status"],
+            "Error": state["error"],
+        } for state in batch_states]), hide_index=True)
+
+        if st.button("Check batch jobs", key="check_batch_jobs"):
+            for state in batch_states:
+                results = poll_batch_run(BatchClient(gemini_api_key), store, state)
+                if results is None:
+                    continue
+                state["records"] = ingest_batch_results(state, results)
+                mark_ingested(store, state)
+                set_extracted_data(state["records"])
+                log_info(f"Ingested batch job {state['job_id']} ({len(state['records'])} files)")
+            st.rerun()
+
+        ingested = [state["job_id"] for state in batch_states if state["status"] == "ingested"]
+        if ingested:
+            job_id = st.selectbox("Finished batch job", ingested, key="batch_job_to_load")
+            if st.button("Load batch results", key="load_batch_results"):
+                set_extracted_data(store.load(job_id)["records"])
+                st.rerun()
+
+
+def set_extracted_data(records):
+    """Replace the files on screen; the late hedge-loser usage of the previous ones goes with them."""
+    st.session_state.all_extracted_data = records
+    st.session_state.late_usage = UsageTally()
+    current_usage_tally.set(st.session_state.late_usage)
+
+
+@st.cache_resource
+def get_parse_pool():
+    """One warm PDF parse pool per server process, shared across reruns."""
+    return start_parse_pool()
+
+
 def main():
     st.markdown("""
         <style>
@@ -651,6 +1261,14 @@ def main():
 
     current_user_login = "Hasaranga"
 
+    # TLS handshakes happen now, not on the first document
+    prewarm_gemini_connections()
+    # Key and model names are checked once per server process, not in the middle of a batch
+    check_gemini_setup()
+    st.sidebar.caption(f"Gemini rate limit: {GEMINI_RATE_LIMITER.limits()}. Set CUSDEC_GEMINI_RPM and "
+                       f"CUSDEC_GEMINI_TPM to your API key's quotas to throttle before Gemini does "
+                       f"(unset or 0: no client-side limit).")
+
     # File upload and caching for stability
     if 'cached_uploaded_files' not in st.session_state:
         st.session_state['cached_uploaded_files'] = {}
@@ -665,7 +1283,7 @@ def main():
                 st.session_state['cached_uploaded_files'][file.name] = file.read()
                 new_files_uploaded = True
         if new_files_uploaded:
-            st.session_state.all_extracted_data = []
+            set_extracted_data([])
 
     excel_column_order = [
         "Source File",
@@ -721,35 +1339,139 @@ def main():
         "D.Val", "D.Qty",
     ]
 
-    if 'all_extracted_data' not in st.session_state:
-        st.session_state.all_extracted_data = []
+    if 'all_extracted_data' not in st.session_state or 'late_usage' not in st.session_state:
+        set_extracted_data(st.session_state.get('all_extracted_data', []))
+    current_usage_tally.set(st.session_state.late_usage)
 
     if st.session_state['cached_uploaded_files']:
         st.write(f"{len(st.session_state['cached_uploaded_files'])} PDF(s) cached.")
+        extract_all_items = st.checkbox("Also extract every goods item from all pages (multi-page declarations)",
+                                        key="extract_all_items")
+        pack_size = st.number_input("Documents per Gemini request (packing cuts the request count under RPM limits)",
+                                    min_value=1, max_value=10, value=PACKED_DOCUMENTS_PER_REQUEST, key="pack_size")
+        if st.button("Submit as Offline Batch Job (Gemini Batch API, results later)"):
+            processing_start_time_utc_str = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            with st.spinner("Preparing documents and submitting the batch job..."):
+                batch_state = submit_batch_extraction(processing_start_time_utc_str, current_user_login,
+                                                      extract_all_items)
+            if batch_state["status"] == "failed":
+                st.error(batch_state["error"])
+            elif batch_state["batch_name"] is None:
+                # Nothing needed Gemini; the run is complete already
+                set_extracted_data(ingest_batch_results(batch_state, {}))
+                mark_ingested(BatchJobStore(), batch_state)
+                st.rerun()
+            else:
+                st.success(f"Submitted batch job {batch_state['job_id']} with {len(batch_state['jobs'])} requests. "
+                           f"Use 'Check batch jobs' below to collect the results.")
+
         if st.button("Extract Data from All Uploaded PDFs"):
             processing_start_time_utc_str = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-            st.session_state.all_extracted_data = []
+            set_extracted_data([])
 
             # Robust loop for multi-file processing
             progress_bar = st.progress(0)
             status_text = st.empty()
             total_files = len(st.session_state['cached_uploaded_files'])
 
+            # Cheap triage first, so files that can never yield data cost neither a parse nor an API call
+            triage_results = {filename: run_triage(file_bytes, filename)
+                              for filename, file_bytes in st.session_state['cached_uploaded_files'].items()}
+
+            # Parse every accepted PDF in the pool up front so parsing overlaps the Gemini calls below
+            parse_futures = submit_parse_jobs(
+                get_parse_pool(),
+                [(filename, file_bytes) for filename, file_bytes in st.session_state['cached_uploaded_files'].items()
+                 if triage_results[filename][1] is None])
+
+            # Gemini requests run on a bounded worker pool while the loop below keeps preparing files;
+            # (job, record) pairs wait here until pack_size of them can go out as one request
+            gemini_executor = start_gemini_executor()
+            gemini_futures = {}
+            retry_budget = RetryBudget.for_requests(total_files)
+            pending_jobs = []
+            files_done = 0
+            # Fields of streamed replies, shown while their documents are still in flight
+            live_fields_view = st.empty()
+            live_fields_lock = threading.Lock()
+
+            def show_streamed_field(records, filename, field, value):
+                # Runs on the Gemini worker threads (they carry the script run context)
+                record = records.get(filename)
+                if record is None:
+                    return
+                with live_fields_lock:
+                    if field is None:
+                        # A new attempt: the fields streamed so far are withdrawn
+                        record["streamed_fields"] = {}
+                    else:
+                        record.setdefault("streamed_fields", {})[field] = value
+                    live_fields_view.markdown(
+                        f"**{filename}** (streaming): " +
+                        " · ".join(f"{name}: {val}" for name, val in record["streamed_fields"].items()))
+
+            def submit_pending_jobs():
+                if pending_jobs:
+                    records = {job["filename"]: record for job, record in pending_jobs}
+                    gemini_futures[gemini_executor.submit(
+                        run_gemini_jobs, [job for job, _ in pending_jobs], retry_budget,
+                        field_sink=partial(show_streamed_field, records),
+                        usage_tally=st.session_state.late_usage)] = list(pending_jobs)
+                    pending_jobs.clear()
+
             for i, (filename, file_bytes) in enumerate(st.session_state['cached_uploaded_files'].items()):
                 status_text.text(f"Processing file {i + 1} of {total_files}: {filename}...")
 
+                triage_report, triage_error = triage_results[filename]
+                if triage_error:
+                    st.session_state.all_extracted_data.append({
+                        "filename": filename,
+                        "data": triage_error,
+                        "items": [],
+                        "triage": triage_report,
+                        "processing_datetime_utc": processing_start_time_utc_str,
+                        "processed_by_user": current_user_login
+                    })
+                    files_done += 1
+                    progress_bar.progress(files_done / total_files)
+                    continue
+
                 try:
-                    common_data_from_extraction = extract_data_fields(file_bytes, filename)
-                    # Handle case where extraction returns explicit error dict
-                    if isinstance(common_data_from_extraction, dict) and "error" in common_data_from_extraction:
+                    parsed_page = None
+                    if filename in parse_futures:
+                        try:
+                            parsed_page = get_parsed_page(filename, file_bytes, parse_futures[filename])
+                        except Exception as e:
+                            # Pool broke (e.g. a worker died); parse this file inline instead
+                            logger.warning(f"Parse pool failed for {filename}, parsing inline: {e}")
+                    job = prepare_extraction(file_bytes, filename, parsed_page)
+                    if "error" in job:
+                        common_data_from_extraction, job = job, None
                         logger.error(f"Error extracting {filename}: {common_data_from_extraction['error']}")
+                    elif job["unresolved_fields"]:
+                        # Replaced when its Gemini request completes; a rerun that stops this run first
+                        # leaves the placeholder on screen and in the export
+                        common_data_from_extraction = {
+                            "error": "Extraction interrupted; re-run or Recapture this file."}
+                    else:
+                        common_data_from_extraction, job = complete_extraction(job), None
 
-                    st.session_state.all_extracted_data.append({
+                    item_rows = extract_item_rows(file_bytes, filename) if extract_all_items else []
+
+                    record = {
                         "filename": filename,
                         "data": common_data_from_extraction,
+                        "items": item_rows,
+                        "triage": triage_report,
                         "processing_datetime_utc": processing_start_time_utc_str,
                         "processed_by_user": current_user_login
-                    })
+                    }
+                    st.session_state.all_extracted_data.append(record)
+                    if job is not None:
+                        pending_jobs.append((job, record))
+                        if len(pending_jobs) >= pack_size:
+                            submit_pending_jobs()
+                        continue
                 except Exception as e:
                     # Catch individual file errors so loop continues
                     logger.error(f"Critical error processing {filename}: {e}")
@@ -760,15 +1482,86 @@ def main():
                         "processed_by_user": current_user_login
                     })
 
-                # Small delay to be nice to API limits
-                time.sleep(1)
-                progress_bar.progress((i + 1) / total_files)
+                files_done += 1
+                progress_bar.progress(files_done / total_files)
+
+            submit_pending_jobs()
+            # Collect Gemini results as they complete, not in submission order. Requests refused by the
+            # open circuit breaker are re-queued once, to run when it closes again.
+            requeue_rounds = 0
+            while gemini_futures:
+                requeued = []
+                for future in as_completed(gemini_futures):
+                    job_records = gemini_futures[future]
+                    try:
+                        results = future.result()
+                    except CircuitOpenError as e:
+                        if requeue_rounds < CIRCUIT_REQUEUE_ROUNDS:
+                            requeued.append(job_records)
+                            continue
+                        log_warning(f"Gemini still unavailable for {len(job_records)} files: {e}")
+                        results = {job["filename"]: {"error": f"Gemini unavailable: {e}. Use Recapture later."}
+                                   for job, _ in job_records}
+                    except Exception as e:
+                        logger.error(f"Critical error processing Gemini request: {e}\n{traceback.format_exc()}")
+                        results = {job["filename"]: {"error": f"Failed to process: {str(e)}"}
+                                   for job, _ in job_records}
+                    for job, record in job_records:
+                        record["data"] = results[job["filename"]]
+                        record.pop("streamed_fields", None)
+                    files_done += len(job_records)
+                    progress_bar.progress(files_done / total_files)
+                    status_text.text(f"Extracted {', '.join(job['filename'] for job, _ in job_records)} "
+                                     f"({files_done} of {total_files} files done)")
+                gemini_futures = {}
+                if requeued:
+                    requeue_rounds += 1
+                    status_text.text(f"Gemini is failing; {sum(len(r) for r in requeued)} files re-queued until "
+                                     f"it recovers (about {GEMINI_CIRCUIT.retry_after():.0f}s)...")
+                    for job_records in requeued:
+                        gemini_futures[gemini_executor.submit(
+                            run_gemini_jobs, [job for job, _ in job_records], retry_budget,
+                            CIRCUIT_REQUEUE_WAIT_SECONDS,
+                            partial(show_streamed_field, {job["filename"]: record for job, record in job_records}),
+                            st.session_state.late_usage)
+                        ] = job_records
+            gemini_executor.shutdown()
+            live_fields_view.empty()
 
             status_text.text("Processing complete!")
+            log_info(f"Parse cache: {PARSE_CACHE.summary()}")
+            for model in get_model_router().models:
+                log_info(f"Gemini context cache ({model}): {get_context_cache(model).summary()}")
+            log_info(f"Gemini response cache: {RESPONSE_CACHE.summary()}")
+            log_info(f"Gemini model router: {get_model_router().summary()}")
+            log_info(f"Gemini hedging: {GEMINI_HEDGER.summary()}")
+            log_info(f"Gemini rate limiter: {GEMINI_RATE_LIMITER.summary()}")
+            log_info(f"Gemini retries: {retry_budget.spent} used of the run's budget; "
+                     f"circuit breaker {GEMINI_CIRCUIT.summary()}")
             st.success("Data extraction complete for all files!")
             st.rerun()
 
+    render_batch_jobs()
+
     if st.session_state.all_extracted_data:
+        st.caption(f"Parse cache: {PARSE_CACHE.summary()}")
+        if RESPONSE_CACHE_ENABLED:
+            cache_hits = sum(1 for item in st.session_state.all_extracted_data
+                             if isinstance(item["data"], dict)
+                             and item["data"].get("_meta", {}).get("response_cache_hit"))
+            st.caption(f"Gemini response cache: {cache_hits} of {len(st.session_state.all_extracted_data)} files "
+                       f"answered from the cache; {RESPONSE_CACHE.summary()}")
+        late_usage = st.session_state.late_usage
+        batch_calls = [call for item in st.session_state.all_extracted_data if isinstance(item["data"], dict)
+                       for call in item["data"].get("_meta", {}).get("gemini_calls", [])]
+        batch_calls += [call for _, call in late_usage.all_calls()]
+        ledger_totals = USAGE_LEDGER.totals()
+        ledger_note = f"; all recorded runs: ${ledger_totals['cost_usd']:.4f}" if ledger_totals else ""
+        st.caption(f"Gemini usage for these files: {format_usage(sum_usage(batch_calls))} "
+                   f"(estimated){ledger_note}")
+        st.caption(f"Model router: {get_model_router().summary()}")
+        if GEMINI_HEDGER.enabled:
+            st.caption(f"Hedged requests: {GEMINI_HEDGER.summary()}")
         st.markdown("---")
         for item_idx, item in enumerate(st.session_state.all_extracted_data):
             filename = item["filename"]
@@ -780,24 +1573,66 @@ def main():
             col_title, col_button = st.columns([2, 1])
             with col_title:
                 st.markdown(f'<h2 class="sub-title">Extracted Data for: {filename}</h2>', unsafe_allow_html=True)
-                st.markdown(f'<p class="info-text">Processed on: {proc_datetime} (UTC) by {proc_user}</p>',
-                            unsafe_allow_html=True)
+                meta = data_for_file.get("_meta", {}) if isinstance(data_for_file, dict) else {}
+                extraction_source = meta.get("extraction_source", "gemini") if isinstance(data_for_file, dict) else "N/A"
+                details = [f"Source: {extraction_source}"]
+                if extraction_source != "local" and "prompt_compaction" in meta:
+                    details.append(f'Prompt tokens saved: {meta["prompt_compaction"]["tokens_saved"]}')
+                if "packing" in meta:
+                    fallback_note = ", single-document fallback" if meta["packing"]["fallback"] else ""
+                    details.append(f'Packed request: {meta["packing"]["documents"]} documents{fallback_note}')
+                if "batch_job" in meta:
+                    details.append(f'Batch job: {meta["batch_job"]}')
+                if "gemini_calls" in meta:
+                    attempts = len(meta["gemini_calls"])
+                    attempts_note = f", {attempts} attempts" if attempts > 1 else ""
+                    if "model" in meta:
+                        details.append(f'Model: {meta["model"]} ({meta["route"]}{attempts_note})')
+                    else:
+                        details.append(f"Gemini failed after {attempts} attempts")
+                    if "first_field_s" in meta:
+                        details.append(f'First field after {meta["first_field_s"]}s')
+                # Hedge losers that finished after the file was totalled are added here
+                file_usage = sum_usage(meta.get("gemini_calls", []) + late_usage.calls(filename))
+                if file_usage["calls"]:
+                    details.append(f'Usage: {format_usage(file_usage)}')
+                st.markdown(f'<p class="info-text">Processed on: {proc_datetime} (UTC) by {proc_user} '
+                            f'· {" · ".join(details)}</p>', unsafe_allow_html=True)
             with col_button:
+                force_recapture = RESPONSE_CACHE_ENABLED and st.checkbox(
+                    "Force", key=f"force_{item_idx}_{filename}",
+                    help="Ask Gemini again instead of reusing its cached reply")
                 if st.button(f"🔄 Recapture Data", key=f"recapture_{item_idx}_{filename}"):
                     with st.spinner(f"Recapturing data for {filename}..."):
                         file_bytes = st.session_state['cached_uploaded_files'][filename]
-                        recaptured_data = extract_data_fields(file_bytes, filename)
+                        triage_report, recaptured_data = run_triage(file_bytes, filename)
+                        if recaptured_data is None:
+                            try:
+                                recaptured_data = extract_data_fields(file_bytes, filename, force=force_recapture)
+                            except CircuitOpenError as e:
+                                recaptured_data = {"error": f"{e}. Try the recapture again later."}
+                        recaptured_items = item.get("items", [])
+                        if "error" in recaptured_data:
+                            recaptured_items = []
+                        elif st.session_state.get("extract_all_items"):
+                            recaptured_items = extract_item_rows(file_bytes, filename)
 
                         # Update the specific item in the session state list
                         st.session_state.all_extracted_data[item_idx] = {
                             "filename": filename,
                             "data": recaptured_data,
+                            "items": recaptured_items,
+                            "triage": triage_report,
                             "processing_datetime_utc": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
                             "processed_by_user": current_user_login
                         }
                     st.success(f"Recapture complete for {filename}!")
                     st.rerun()  # Refresh the page to show the updated data
 
+            if not isinstance(data_for_file, dict):
+                st.error(f"No extracted data for {filename}; re-run or Recapture this file.")
+                st.markdown("---")
+                continue
             if "error" in data_for_file:
                 st.error(data_for_file["error"])
                 st.markdown("---")
@@ -821,6 +1656,10 @@ def main():
                 else:
                     with col3:
                         st.text_input(field, value=field_value, key=unique_key, disabled=True)
+            if item.get("items"):
+                st.markdown(f'<p class="info-text">{len(item["items"])} goods item(s) found across all pages</p>',
+                            unsafe_allow_html=True)
+                st.dataframe(pd.DataFrame(item["items"], columns=item_column_order), hide_index=True)
             st.markdown("---")
 
         if st.session_state.all_extracted_data:
@@ -837,11 +1676,12 @@ def main():
                     "Processing DateTime (UTC)": proc_datetime,
                     "Processed By User": proc_user
                 }
-                is_error_state = isinstance(data_for_file, str) or (
-                            isinstance(data_for_file, dict) and "error" in data_for_file)
+                is_error_state = not isinstance(data_for_file, dict) or "error" in data_for_file
                 if is_error_state:
-                    error_message = data_for_file if isinstance(data_for_file, str) else data_for_file.get("error",
-                                                                                                           "Unknown extraction error")
+                    if isinstance(data_for_file, dict):
+                        error_message = data_for_file.get("error", "Unknown extraction error")
+                    else:
+                        error_message = data_for_file or "No extracted data; re-run or Recapture this file"
                     row_data["Declarant Sequence Year"] = f"ERROR: {error_message}"
                     for field_name in excel_column_order:
                         if field_name not in row_data:
@@ -864,8 +1704,30 @@ def main():
                 df_export = df_export[final_columns_for_excel]
 
                 output = io.BytesIO()
+                all_item_rows = [row for item in st.session_state.all_extracted_data for row in item.get("items", [])]
+                usage_calls = [(item["filename"], call) for item in st.session_state.all_extracted_data
+                               if isinstance(item["data"], dict)
+                               for call in item["data"].get("_meta", {}).get("gemini_calls", [])]
+                usage_calls += st.session_state.late_usage.all_calls()
+                usage_rows = [
+                    {"Source File": filename, "Model": call.get("model"), "Route": call.get("route"),
+                     "Status": call.get("status"), "Prompt Tokens": call.get("prompt_tokens", 0),
+                     "Cached Tokens": call.get("cached_tokens", 0), "Output Tokens": call.get("output_tokens", 0),
+                     "Thinking Tokens": call.get("thinking_tokens", 0), "Share of Request": call.get("share", 1.0),
+                     "Estimated Cost (USD)": call.get("cost_usd", 0.0)}
+                    for filename, call in usage_calls if not call.get("cache_hit")]
                 with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
                     df_export.to_excel(writer, sheet_name='All Extracted Data', index=False)
+                    if all_item_rows:
+                        pd.DataFrame(all_item_rows, columns=item_column_order).to_excel(
+                            writer, sheet_name='Items', index=False)
+                    if usage_rows:
+                        df_usage = pd.DataFrame(usage_rows)
+                        totals_row = {"Source File": "Total"}
+                        totals_row.update(df_usage[["Prompt Tokens", "Cached Tokens", "Output Tokens",
+                                                    "Thinking Tokens", "Estimated Cost (USD)"]].sum().to_dict())
+                        pd.concat([df_usage, pd.DataFrame([totals_row])], ignore_index=True).to_excel(
+                            writer, sheet_name='Gemini Usage', index=False)
                 excel_data = output.getvalue()
                 if excel_data:
                     st.download_button(
@@ -0,0 +1,45 @@
+"""
+The app itself, pointed at the local Gemini stand-in, for benchmarks that should measure the real
+request path (Rajee.generate_content with its rate limiter, circuit breaker, model router, hedger
+and context cache) rather than a copy of it.
+
+Settings are read from the environment when the cusdec modules are imported, so load_app() must
+run before anything else imports them, and every configuration needs a process of its own
+(run_child() starts one).
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(base_url, **settings):
+    """
+    Import Rajee (in Streamlit's bare mode) against the stand-in at base_url. settings are extra
+    CUSDEC_* environment variables, e.g. CUSDEC_HEDGE="1". The response cache is off and every
+    on-disk cache goes to a throwaway directory, so runs do not answer each other.
+    """
+    os.environ.update({
+        "CUSDEC_GEMINI_BASE_URL": base_url,
+        "GOOGLE_API_KEY": "standin",
+        "CUSDEC_RESPONSE_CACHE": "0",
+        "CUSDEC_CACHE_DIR": tempfile.mkdtemp(prefix="cusdec-bench-"),
+        "CUSDEC_HTTP_PREWARM": "0",
+        "STREAMLIT_LOGGER_LEVEL": "error",
+    })
+    os.environ.update({name: str(value) for name, value in settings.items()})
+    sys.path.insert(0, ROOT)
+    import Rajee
+    # One "Calling Gemini API..." line per attempt would drown the results
+    logging.getLogger("cusdec_app").setLevel(logging.WARNING)
+    return Rajee
+
+
+def run_child(script, *args):
+    """Run script with args in a fresh interpreter; returns the JSON object it prints last."""
+    result = subprocess.run([sys.executable, script, *map(str, args)], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
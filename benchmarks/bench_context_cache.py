@@ -0,0 +1,101 @@
+"""
+Benchmark: per-request input tokens and latency with the static instruction block inlined,
+sent as systemInstruction, or held in a cached context, against the local Gemini stand-in.
+
+Usage:
+    python benchmarks/bench_context_cache.py [--requests 20] [--prefill-us-per-token 50] [--min-cache-tokens 0]
+
+Also checks that a cache deleted server-side (as on expiry) is recreated transparently.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+from cusdec_gemini import ContextCacheManager, is_cached_content_error, model_endpoint  # noqa: E402
+from cusdec_prompt import COMMON_FIELDS_MAP, build_document_prompt, build_instruction  # noqa: E402
+
+MODEL = "gemini-2.5-flash"
+
+
+def sample_document_prompt(idx):
+    page = "\n".join(f"{n} Line {n} of declaration {idx} CBBE1 E 7{idx:04d} 2024 #30{idx:02d}" for n in range(60))
+    return build_document_prompt("", page, list(COMMON_FIELDS_MAP.values())[:6])
+
+
+def post(endpoint, body, manager=None, instruction=None):
+    """One generateContent call, recreating the context cache once if the server dropped it."""
+    for _ in range(2):
+        start = time.perf_counter()
+        response = requests.post(endpoint, headers={"X-goog-api-key": "standin"}, json=body, timeout=30)
+        elapsed = time.perf_counter() - start
+        if manager and "cachedContent" in body and is_cached_content_error(response.status_code, response.text):
+            manager.invalidate(body.pop("cachedContent"))
+            body.update(manager.request_fields(instruction))
+            continue
+        response.raise_for_status()
+        return response.json()["usageMetadata"], elapsed
+    raise RuntimeError("cache was not recreated")
+
+
+def run_mode(mode, base_url, count):
+    endpoint = model_endpoint(MODEL, base_url=base_url)
+    instruction = build_instruction()
+    manager = ContextCacheManager("standin", MODEL, mode=mode, base_url=base_url)
+    uncached_tokens, latencies = [], []
+    for idx in range(count):
+        prompt = sample_document_prompt(idx)
+        if mode == "off":
+            body = {"contents": [{"parts": [{"text": instruction + "\n" + prompt}]}]}
+        else:
+            body = {"contents": [{"parts": [{"text": prompt}]}]}
+            body.update(manager.request_fields(instruction))
+        usage, elapsed = post(endpoint, body, manager, instruction)
+        uncached_tokens.append(usage["promptTokenCount"] - usage.get("cachedContentTokenCount", 0))
+        latencies.append(elapsed)
+    return uncached_tokens, latencies, manager
+
+
+def check_recreate(base_url, server):
+    manager = ContextCacheManager("standin", MODEL, mode="cached", base_url=base_url)
+    instruction = build_instruction()
+    name = manager.request_fields(instruction).get("cachedContent")
+    if name is None:
+        return "skipped (cache refused)"
+    with server.state.lock:
+        server.state.caches.pop(name, None)
+    body = {"contents": [{"parts": [{"text": sample_document_prompt(0)}]}], "cachedContent": name}
+    post(model_endpoint(MODEL, base_url=base_url), body, manager, instruction)
+    return f"ok ({manager.summary()})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--prefill-us-per-token", type=float, default=50.0)
+    parser.add_argument("--min-cache-tokens", type=int, default=0)
+    args = parser.parse_args()
+
+    server, base_url = start_standin(min_cache_tokens=args.min_cache_tokens,
+                                     prefill_us_per_token=args.prefill_us_per_token)
+    try:
+        print(f"{'mode':<8} {'uncached input tokens/req':>26} {'latency p50 ms':>15} {'latency p95 ms':>15}")
+        for mode in ("off", "system", "cached"):
+            tokens, latencies, manager = run_mode(mode, base_url, args.requests)
+            latencies.sort()
+            p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+            print(f"{mode:<8} {statistics.mean(tokens):>26.0f} {statistics.median(latencies) * 1000:>15.1f} "
+                  f"{p95 * 1000:>15.1f}   [{manager.summary()}]")
+        print(f"server-side expiry -> recreate: {check_recreate(base_url, server)}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
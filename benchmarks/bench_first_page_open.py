@@ -0,0 +1,116 @@
+"""
+Benchmark: open latency and peak RSS of the page-1-only (lazy) open against the full open.
+
+Usage:
+    python benchmarks/bench_first_page_open.py [file.pdf ...] [--pages 400] [--repeat 5]
+
+Without PDF arguments a synthetic multi-page declaration bundle is generated.
+Each mode runs in a fresh subprocess so its peak RSS is not polluted by the other.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_synthetic_pdf(page_count, lines_per_page=60):
+    """Write a plain multi-page text PDF by hand, so the benchmark needs no PDF writer."""
+    objects = []
+    kids = []
+    font_id = 3
+    objects.append((font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    next_id = 4
+    for page_no in range(page_count):
+        lines = [f"BT /F1 7 Tf 30 {580 - i * 9} Td (CUSDEC II page {page_no + 1} Box 31 line {i} "
+                 f"GOODS DESCRIPTION 1234567890) Tj ET" for i in range(lines_per_page)]
+        stream = "\n".join(lines).encode("latin-1")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects.append((content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"))
+        objects.append((page_id, b"<< /Type /Page /Parent 2 0 R /Contents %d 0 R >>" % content_id))
+        kids.append(page_id)
+    kids_ref = " ".join(f"{k} 0 R" for k in kids).encode()
+    objects.append((2, b"<< /Type /Pages /Count %d /MediaBox [0 0 842 595] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Kids [" % page_count + kids_ref + b"] >>"))
+    objects.append((1, b"<< /Type /Catalog /Pages 2 0 R >>"))
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + body + b"\nendobj\n"
+    xref_pos = len(out)
+    size = max(offsets) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for obj_id in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_pos)
+    return bytes(out)
+
+
+def run_mode(path, lazy, repeat):
+    """Child process body: time open_first_page() and report peak RSS."""
+    from cusdec_pdf import open_first_page
+
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with open_first_page(file_bytes, lazy=lazy) as (page, page_count):
+            _ = page.bbox
+        timings.append(time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"timings": timings, "peak_rss_kb": peak_kb, "page_count": page_count}))
+
+
+def measure(path, lazy, repeat):
+    cmd = [sys.executable, __file__, "--child", path, "--lazy", "1" if lazy else "0", "--repeat", str(repeat)]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--pages", type=int, default=400, help="page count of the synthetic PDF")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--lazy", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_mode(args.child, args.lazy == "1", args.repeat)
+        return
+
+    paths = list(args.pdfs)
+    tmp = None
+    if not paths:
+        tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        tmp.write(build_synthetic_pdf(args.pages))
+        tmp.close()
+        paths = [tmp.name]
+
+    try:
+        print(f"{'file':<40} {'mode':<5} {'pages':>6} {'open p50 ms':>12} {'open min ms':>12} {'peak RSS MB':>12}")
+        for path in paths:
+            for lazy in (False, True):
+                res = measure(path, lazy, args.repeat)
+                print(f"{os.path.basename(path)[:40]:<40} {'lazy' if lazy else 'full':<5} "
+                      f"{str(res['page_count']):>6} {statistics.median(res['timings']) * 1000:>12.1f} "
+                      f"{min(res['timings']) * 1000:>12.1f} {res['peak_rss_kb'] / 1024:>12.1f}")
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark: wall-clock time for a batch of Gemini requests at different concurrency levels. Each
+request goes through the app's own path: the Gemini worker pool (start_gemini_executor) running
+Rajee.generate_content, with its in-flight slots, rate limiter, circuit breaker, model router and
+context cache, against the local Gemini stand-in. Each level runs in its own process with
+CUSDEC_GEMINI_CONCURRENCY set, as the app would be configured.
+
+Usage:
+    python benchmarks/bench_gemini_concurrency.py [--files 100] [--latency-ms 200] [--levels 1,2,4,8]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.app_under_test import load_app, run_child  # noqa: E402
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+
+
+def run_level(base_url, files, concurrency):
+    """Child process body: extract files prompts through generate_content on the app's worker pool."""
+    app = load_app(base_url, CUSDEC_GEMINI_CONCURRENCY=concurrency)
+    instruction = app.build_instruction()
+    retry_budget = app.RetryBudget.for_requests(files)
+
+    def call(idx):
+        # What run_gemini_jobs sets up for each worker task
+        app.current_retry_budget.set(retry_budget)
+        prompt = app.build_document_prompt("", f"Box 2 Exporter ACME {idx}\nCBBE1 E 7{idx:04d}",
+                                           list(app.COMMON_FIELDS_MAP.values()))
+        return app.generate_content(prompt, instruction=instruction)
+
+    executor = app.start_gemini_executor()
+    start = time.perf_counter()
+    answered = sum(1 for future in as_completed([executor.submit(call, idx) for idx in range(files)])
+                   if future.result() is not None)
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    print(json.dumps({"wall_s": elapsed, "answered": answered, "retries": retry_budget.spent,
+                      "limiter": app.GEMINI_RATE_LIMITER.summary()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--levels", default="1,2,4,8")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_level(args.child, args.files, args.level)
+        return
+
+    server, base_url = start_standin(latency_ms=args.latency_ms, prefill_us_per_token=0)
+    try:
+        baseline = None
+        print(f"{'concurrency':>11} {'wall s':>8} {'speed-up':>9} {'answered':>9} {'retries':>8}")
+        for level in (int(n) for n in args.levels.split(",")):
+            result = run_child(__file__, "--child", base_url, "--level", level, "--files", args.files)
+            baseline = baseline or result["wall_s"]
+            print(f"{level:>11} {result['wall_s']:>8.2f} {baseline / result['wall_s']:>8.1f}x "
+                  f"{result['answered']:>9} {result['retries']:>8}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
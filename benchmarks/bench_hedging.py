@@ -0,0 +1,90 @@
+"""
+Benchmark: latency percentiles of a run of Gemini requests when a few calls hang, with and
+without hedged requests. The requests go through Rajee.generate_content on the app's worker pool
+against the local Gemini stand-in, so the hedge is the app's own: it fires at the model router's
+rolling p95 for the model, goes to the secondary model, takes a HEDGE_SLOTS slot and quota from
+the rate limiter, and the loser is settled into the router. Each setting runs in its own process
+with CUSDEC_HEDGE set.
+
+Usage:
+    python benchmarks/bench_hedging.py [--requests 300] [--concurrency 4] [--latency-ms 50]
+                                       [--tail-fraction 0.04] [--tail-ms 2000] [--max-rate 0.1]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.app_under_test import load_app, run_child  # noqa: E402
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+
+
+def run(base_url, args, hedging):
+    """Child process body: every request through generate_content; prints wall time and latencies."""
+    app = load_app(base_url, CUSDEC_HEDGE="1" if hedging else "0", CUSDEC_HEDGE_MAX_RATE=args.max_rate,
+                   CUSDEC_GEMINI_CONCURRENCY=args.concurrency)
+    # The 1 s floor on the hedge delay is meant for real latencies; scale it to the stand-in's
+    app.GEMINI_HEDGER.min_delay = 0.1
+    instruction = app.build_instruction()
+
+    def call(idx):
+        prompt = app.build_document_prompt("", f"Box 2 Exporter ACME {idx}", list(app.COMMON_FIELDS_MAP.values()))
+        started_at = time.perf_counter()
+        reply = app.generate_content(prompt, instruction=instruction)
+        return time.perf_counter() - started_at, reply is not None
+
+    executor = app.start_gemini_executor()
+    start = time.perf_counter()
+    results = list(executor.map(call, range(args.requests)))
+    wall = time.perf_counter() - start
+    executor.shutdown()
+    if hedging:
+        time.sleep(args.tail_ms / 1000)  # let the losers finish so the saved time is complete
+    print(json.dumps({"wall_s": wall, "latencies": [latency for latency, _ in results],
+                      "answered": sum(ok for _, ok in results), "hedger": app.GEMINI_HEDGER.summary(),
+                      "router": app.get_model_router().summary()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--tail-fraction", type=float, default=0.04)
+    parser.add_argument("--tail-ms", type=float, default=2000.0)
+    parser.add_argument("--max-rate", type=float, default=0.1)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--hedging", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run(args.child, args, args.hedging == "1")
+        return
+
+    from cusdec_router import percentile
+
+    server, base_url = start_standin(latency_ms=args.latency_ms, prefill_us_per_token=0)
+    server.state.tail_fraction, server.state.tail_ms = args.tail_fraction, args.tail_ms
+    try:
+        print(f"{'hedging':>8} {'wall s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'ok':>4}")
+        for hedging in (False, True):
+            server.state.random.seed(0)
+            result = run_child(__file__, "--child", base_url, "--hedging", int(hedging),
+                               "--requests", args.requests, "--concurrency", args.concurrency,
+                               "--tail-ms", args.tail_ms, "--max-rate", args.max_rate)
+            latencies = result["latencies"]
+            p50, p95, p99 = (percentile(latencies, f) * 1000 for f in (0.5, 0.95, 0.99))
+            print(f"{'on' if hedging else 'off':>8} {result['wall_s']:>7.2f} {p50:>7.0f} {p95:>7.0f} {p99:>7.0f} "
+                  f"{max(latencies) * 1000:>7.0f} {result['answered']:>4}")
+            if hedging:
+                print(f"hedger: {result['hedger']}")
+                print(f"router: {result['router']}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
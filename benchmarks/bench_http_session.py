@@ -0,0 +1,84 @@
+"""
+Benchmark: per-request latency of a fresh connection per call (plain requests.post, as before)
+against the app's pooled keep-alive session, pre-warmed, over TLS to the local Gemini stand-in.
+
+Usage:
+    python benchmarks/bench_http_session.py [--requests 50] [--concurrency 4]
+
+Needs the openssl CLI to make a throwaway certificate.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gemini_standin import make_self_signed_cert, start_standin  # noqa: E402
+from cusdec_gemini import generate_content_body, model_endpoint  # noqa: E402
+from cusdec_http import create_http_session, prewarm_http_session  # noqa: E402
+
+MODEL = "gemini-2.5-flash"
+HEADERS = {"X-goog-api-key": "standin"}
+
+
+def timed_calls(post, endpoint, count, concurrency):
+    body = generate_content_body("- Box 2: Exporter\nDocument text:\nCUSDEC II declaration")
+
+    def call(_):
+        start = time.perf_counter()
+        post(endpoint, headers=HEADERS, json=body, timeout=30).raise_for_status()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sorted(executor.map(call, range(count)))
+
+
+def report(name, latencies):
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{name:<28} {statistics.median(latencies) * 1000:>9.2f} {statistics.mean(latencies) * 1000:>9.2f} "
+          f"{p95 * 1000:>9.2f}")
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_self_signed_cert(tmp)
+        server, base_url = start_standin(prefill_us_per_token=0, tls_cert=cert, tls_key=key)
+        endpoint = model_endpoint(MODEL, base_url=base_url)
+        try:
+            print(f"{'mode':<28} {'p50 ms':>9} {'mean ms':>9} {'p95 ms':>9}")
+
+            def fresh_post(url, **kwargs):
+                return requests.post(url, verify=cert, **kwargs)
+
+            fresh = report("new connection per request", timed_calls(fresh_post, endpoint, args.requests,
+                                                                     args.concurrency))
+
+            session = create_http_session(pool_size=args.concurrency, http2=False)
+            # Ignore CA-bundle environment overrides so the throwaway certificate is what gets checked
+            session.trust_env = False
+            session.verify = cert
+            start = time.perf_counter()
+            prewarm_http_session(session, f"{base_url}/models", connections=args.concurrency, headers=HEADERS)
+            print(f"{'(pre-warm)':<28} {(time.perf_counter() - start) * 1000:>9.2f} ms for "
+                  f"{args.concurrency} connections")
+            pooled = report("pooled keep-alive session", timed_calls(session.post, endpoint, args.requests,
+                                                                     args.concurrency))
+            print(f"saved per request: {(fresh - pooled) * 1000:.2f} ms")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
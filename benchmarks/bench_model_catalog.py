@@ -0,0 +1,96 @@
+"""
+Benchmark: a batch whose configured model has been retired, against the local Gemini stand-in.
+
+    reactive - what generate_content used to do: each document gets a 404 and then lists the
+               models itself to diagnose it, so every file pays the listing and fails
+    catalog  - ModelCatalog lists the models once at startup; the router leaves out the retired
+               model and substitutes a usable one, so documents go straight to it
+
+Also checks that a rejected key is reported by the startup listing, and that a model dropped
+from the list is noticed by the background refresh after the TTL without blocking the caller.
+
+Usage:
+    python benchmarks/bench_model_catalog.py [--documents 10] [--list-latency-ms 1000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+from cusdec_gemini import HTTP_SESSION, ModelCatalog, generate_content_body, model_endpoint  # noqa: E402
+from cusdec_router import MODEL_PRICES, ModelRouter  # noqa: E402
+
+RETIRED_MODEL = "gemini-2.0-flash"
+HEADERS = {"X-goog-api-key": "standin"}
+
+
+def post(base_url, model, idx):
+    body = generate_content_body(f"- Box 2: Exporter\nDocument text:\ndeclaration {idx}")
+    return HTTP_SESSION.post(model_endpoint(model, base_url=base_url), headers=HEADERS, json=body, timeout=30)
+
+
+def run_reactive(base_url, documents):
+    ok = 0
+    for idx in range(documents):
+        response = post(base_url, RETIRED_MODEL, idx)
+        if response.status_code == 404:
+            HTTP_SESSION.get(f"{base_url}/models", headers=HEADERS, timeout=10)
+        ok += response.status_code == 200
+    return ok
+
+
+def run_catalog(base_url, documents):
+    catalog = ModelCatalog("standin", base_url=base_url)
+    start = time.perf_counter()
+    catalog.refresh()
+    startup = time.perf_counter() - start
+    router = ModelRouter(catalog.select([RETIRED_MODEL], substitutes=list(MODEL_PRICES)))
+    ok = 0
+    for idx in range(documents):
+        model, _ = router.choose()
+        ok += post(base_url, model, idx).status_code == 200
+    return ok, startup, router.models
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--list-latency-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    server, base_url = start_standin(latency_ms=20, prefill_us_per_token=0)
+    server.state.list_latency_ms = args.list_latency_ms
+    try:
+        print(f"{'policy':>9} {'ok':>4} {'wall s':>7}  notes")
+        start = time.perf_counter()
+        ok = run_reactive(base_url, args.documents)
+        print(f"{'reactive':>9} {ok:>4} {time.perf_counter() - start:>7.2f}  one listing per failing document")
+        start = time.perf_counter()
+        ok, startup, models = run_catalog(base_url, args.documents)
+        print(f"{'catalog':>9} {ok:>4} {time.perf_counter() - start:>7.2f}  "
+              f"{startup:.2f}s listing at startup, routed to {', '.join(models)}")
+
+        bad_key = ModelCatalog("invalid-key", base_url=base_url)
+        bad_key.refresh()
+        print(f"rejected key at startup: {bad_key.summary()}")
+
+        server.state.list_latency_ms = 0
+        catalog = ModelCatalog("standin", base_url=base_url, ttl_seconds=0.2)
+        catalog.refresh()
+        server.state.listed_models.remove("gemini-2.5-pro")
+        time.sleep(0.3)
+        start = time.perf_counter()
+        before = catalog.knows("gemini-2.5-pro")
+        waited = time.perf_counter() - start
+        time.sleep(0.2)
+        print(f"after the TTL: lookup took {waited * 1000:.2f} ms and still answered {before}; "
+              f"after the background refresh: {catalog.knows('gemini-2.5-pro')}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark: where the model router sends a stream of requests while the primary model is
+healthy, failing and slow, compared with the single hard-coded model ("static"), against the
+local Gemini stand-in. Cool-down and SLO are scaled
+down so the whole run takes seconds.
+
+Phases (in order, --phase-seconds each):
+    healthy  - every model answers normally
+    outage   - the primary model answers 503
+    recovery - the primary model is healthy again (promoted back after its cool-down)
+    slow     - the primary model takes --slow-ms per call, above the latency SLO
+
+Usage:
+    python benchmarks/bench_model_router.py [--phase-seconds 2] [--concurrency 4] [--slow-ms 400]
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+from cusdec_gemini import HTTP_SESSION, generate_content_body, model_endpoint  # noqa: E402
+from cusdec_retry import RETRYABLE_STATUS_CODES  # noqa: E402
+from cusdec_router import ModelRouter  # noqa: E402
+
+MODELS = ["gemini-2.5-flash", "gemini-2.5-pro"]
+LATENCY_SLO_SECONDS = 0.25
+DEMOTION_SECONDS = 1.0
+
+
+def call(router, base_url, idx):
+    """One request as generate_content routes it: up to 4 attempts, failing over between models."""
+    body = generate_content_body(f"- Box 2: Exporter\nDocument text:\ndeclaration {idx}")
+    attempts = []
+    for _ in range(4):
+        model, _ = router.choose(1000)
+        started_at = time.perf_counter()
+        try:
+            response = HTTP_SESSION.post(model_endpoint(model, base_url=base_url),
+                                         headers={"X-goog-api-key": "standin"}, json=body, timeout=30)
+            status = response.status_code
+        except requests.exceptions.RequestException:
+            status = None
+        latency = time.perf_counter() - started_at
+        attempts.append(model)
+        ok = status == 200
+        if ok or status in RETRYABLE_STATUS_CODES or status is None:
+            router.record(model, latency, ok)
+        if ok:
+            return model, attempts, latency
+        if not router.fails_over(model):
+            time.sleep(0.05)
+    return None, attempts, None
+
+
+def run_phase(server, router, base_url, seconds, concurrency, phase, slow_ms):
+    primary = MODELS[0]
+    server.state.set_outage(200, count=0)
+    server.state.model_latency_ms.clear()
+    if phase == "outage":
+        server.state.set_outage(503, seconds=seconds, model=primary)
+    elif phase == "slow":
+        server.state.model_latency_ms[primary] = slow_ms
+    answered, failed, attempts = Counter(), 0, 0
+    deadline = time.monotonic() + seconds
+    latencies = []
+
+    def worker(worker_idx):
+        nonlocal failed, attempts
+        idx = 0
+        while time.monotonic() < deadline:
+            model, tried, latency = call(router, base_url, worker_idx * 100000 + idx)
+            idx += 1
+            attempts += len(tried)
+            if model is None:
+                failed += 1
+            else:
+                answered[model] += 1
+                latencies.append(latency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return answered, failed, attempts, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--phase-seconds", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--slow-ms", type=float, default=400.0)
+    args = parser.parse_args()
+
+    server, base_url = start_standin(latency_ms=20, prefill_us_per_token=0)
+    try:
+        print(f"{'policy':>7} {'phase':>9} {'answered':>9} {'failed':>7} {'attempts':>9} {'p95 ms':>7}  by model")
+        for policy, models in (("static", MODELS[:1]), ("router", MODELS)):
+            router = ModelRouter(models, latency_slo=LATENCY_SLO_SECONDS, demotion_seconds=DEMOTION_SECONDS)
+            for phase in ("healthy", "outage", "recovery", "slow"):
+                answered, failed, attempts, latencies = run_phase(server, router, base_url, args.phase_seconds,
+                                                                  args.concurrency, phase, args.slow_ms)
+                latencies.sort()
+                p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else 0.0
+                by_model = ", ".join(f"{model} {count}" for model, count in sorted(answered.items()))
+                print(f"{policy:>7} {phase:>9} {sum(answered.values()):>9} {failed:>7} {attempts:>9} {p95:>7.0f}  "
+                      f"{by_model}")
+            print(f"{policy}: {router.summary()}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
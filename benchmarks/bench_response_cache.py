@@ -0,0 +1,89 @@
+"""
+Benchmark: re-processing the same documents with the Gemini response cache, against the local
+Gemini stand-in. A cold pass calls the stand-in and fills the cache; a warm pass is answered
+from memory, a restarted process from the SQLite tier. Bumping PROMPT_TEMPLATE_VERSION or
+letting the TTL pass must turn every lookup back into a miss.
+
+Usage:
+    python benchmarks/bench_response_cache.py [--documents 30] [--latency-ms 300]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cusdec_gemini  # noqa: E402
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+from cusdec_cache import TwoTierCache  # noqa: E402
+from cusdec_gemini import HTTP_SESSION, generate_content_body, model_endpoint, response_cache_key  # noqa: E402
+from cusdec_prompt import COMMON_FIELDS_MAP, build_document_prompt  # noqa: E402
+
+MODEL = "gemini-2.5-flash"
+
+
+def sample_prompt(idx):
+    page = "\n".join(f"{n} Line {n} of declaration {idx} CBBE1 E 7{idx:04d} 2024 #30{idx:02d}" for n in range(60))
+    return build_document_prompt("", page, list(COMMON_FIELDS_MAP.values())[:6])
+
+
+def make_cache(cache_dir, ttl_seconds=None):
+    return TwoTierCache("gemini_responses", 16 * 1024 * 1024, 256 * 1024 * 1024, cache_dir=cache_dir,
+                        ttl_seconds=ttl_seconds)
+
+
+def run_pass(cache, endpoint, prompts):
+    """generate_content's cache path: look up, else call and store. Returns (latencies, calls)."""
+    latencies, calls = [], 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        key = response_cache_key(MODEL, prompt)
+        reply = cache.get(key)
+        if reply is None:
+            response = HTTP_SESSION.post(endpoint, headers={"X-goog-api-key": "standin"},
+                                         json=generate_content_body(prompt), timeout=30)
+            response.raise_for_status()
+            reply = response.json()
+            cache.put(key, reply)
+            calls += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, calls
+
+
+def report(name, latencies, calls):
+    print(f"{name:>16} {calls:>6} {statistics.median(latencies) * 1000:>9.2f} {sum(latencies):>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    server, base_url = start_standin(latency_ms=args.latency_ms)
+    endpoint = model_endpoint(MODEL, base_url=base_url)
+    prompts = [sample_prompt(idx) for idx in range(args.documents)]
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            print(f"{'pass':>16} {'calls':>6} {'p50 ms':>9} {'total s':>8}")
+            cache = make_cache(cache_dir)
+            report("cold", *run_pass(cache, endpoint, prompts))
+            report("warm (memory)", *run_pass(cache, endpoint, prompts))
+            report("restart (disk)", *run_pass(make_cache(cache_dir), endpoint, prompts))
+
+            cusdec_gemini.PROMPT_TEMPLATE_VERSION += 1
+            report("template bumped", *run_pass(make_cache(cache_dir), endpoint, prompts))
+
+            expiring = make_cache(cache_dir, ttl_seconds=0.5)
+            time.sleep(0.6)
+            report("ttl expired", *run_pass(expiring, endpoint, prompts))
+            print(f"expiring cache: {expiring.summary()}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
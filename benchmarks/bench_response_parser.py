@@ -0,0 +1,97 @@
+"""
+Micro-benchmark: the precompiled alias-lookup reply parser against the previous per-line scan.
+
+Usage:
+    python benchmarks/bench_response_parser.py [replies.jsonl] [--repeat 2000]
+
+Each JSONL line holds a recorded reply, either {"text": "..."} or a full generateContent
+response body. Both parsers must agree on every reply before timings are reported.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cusdec_prompt import COMMON_FIELDS_MAP, parse_field_lines  # noqa: E402
+
+DEFAULT_REPLIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gemini_replies.jsonl")
+
+
+def legacy_parse(extracted_text_response, common_fields_map=COMMON_FIELDS_MAP):
+    """The line parser as it was in extract_data_fields, kept verbatim as the baseline."""
+    common_data = {}
+    for line in extracted_text_response.strip().split('\n'):
+        line = line.strip()
+        line = re.sub(r'^[-*•]\s*', '', line)
+        if ": " in line:
+            parts = line.split(": ", 1)
+            if len(parts) == 2:
+                gemini_key, value = parts[0].strip(), parts[1].strip()
+                display_key = None
+                for key_from_map, val_from_map in common_fields_map.items():
+                    if key_from_map == gemini_key or val_from_map == gemini_key:
+                        display_key = val_from_map
+                        break
+                if display_key:
+                    cleaned_value = value.strip()
+                    potential_prefixes = []
+                    if gemini_key:
+                        potential_prefixes.extend([f"{gemini_key}:", f"{gemini_key} :", f"{gemini_key} "])
+                        gemini_key_parts = re.split(r'[:\s]+', gemini_key)
+                        for part in gemini_key_parts:
+                            if part: potential_prefixes.extend([f"{part}:", f"{part} :", f"{part} "])
+                    if display_key:
+                        potential_prefixes.extend([f"{display_key}:", f"{display_key} :", f"{display_key} "])
+                        display_key_parts = re.split(r'[:\s]+', display_key)
+                        for part_dp in display_key_parts:
+                            if part_dp: potential_prefixes.extend(
+                                [f"{part_dp}:", f"{part_dp} :", f"{part_dp} "])
+                    potential_prefixes = sorted(list(set(potential_prefixes)), key=len, reverse=True)
+                    for prefix in potential_prefixes:
+                        if re.match(re.escape(prefix), cleaned_value, re.IGNORECASE):
+                            cleaned_value = cleaned_value[len(prefix):].strip()
+                            break
+                    common_data[display_key] = cleaned_value
+    return common_data
+
+
+def load_replies(path):
+    replies = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "text" in record:
+                replies.append(record["text"])
+            else:
+                replies.append(record["candidates"][0]["content"]["parts"][0]["text"])
+    return replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("replies", nargs="?", default=DEFAULT_REPLIES)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    replies = load_replies(args.replies)
+    for idx, reply in enumerate(replies):
+        legacy, engine = legacy_parse(reply), parse_field_lines(reply)
+        # The engine also accepts case/whitespace variants the legacy scan missed; it must never lose a field
+        missing = {k: v for k, v in legacy.items() if engine.get(k) != v}
+        if missing:
+            sys.exit(f"Reply {idx}: parsers disagree on {missing}")
+
+    for name, func in (("legacy scan", legacy_parse), ("alias lookup", parse_field_lines)):
+        seconds = timeit.timeit(lambda: [func(r) for r in replies], number=args.repeat)
+        per_reply_us = seconds / (args.repeat * len(replies)) * 1e6
+        print(f"{name:<14} {per_reply_us:>10.1f} us/reply  ({len(replies)} replies x {args.repeat})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark: a run of generateContent calls through a Gemini outage, with the old per-call retry
+loop (fixed exponential backoff, each file retrying on its own) against the retry subsystem
+(server hints, jittered backoff, one retry budget per run, circuit breaker with re-queueing),
+using the local Gemini stand-in. Delays are scaled down so a run takes seconds.
+
+Scenarios:
+    throttle - 429s for --throttle-seconds, each carrying Retry-After / RetryInfo up to the end of the window
+    outage   - every call fails with 503 for --outage-seconds, then the service recovers
+
+Usage:
+    python benchmarks/bench_retry.py [--files 40] [--concurrency 4] [--throttle-seconds 1.5] [--outage-seconds 2]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app's 2 s backoff base and 30 s breaker cool-down, scaled down 1:8 and 1:30
+os.environ.setdefault("CUSDEC_RETRY_BASE_DELAY", "0.25")
+
+import requests  # noqa: E402
+
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+from cusdec_gemini import HTTP_SESSION, generate_content_body, model_endpoint  # noqa: E402
+from cusdec_retry import (RETRYABLE_STATUS_CODES, CircuitBreaker, CircuitOpenError, RetryBudget,  # noqa: E402
+                          retry_delay)
+
+MODEL = "gemini-2.5-flash"
+MAX_RETRIES = 3
+LEGACY_BASE_DELAY = 0.25
+BREAKER_RESET_SECONDS = 1.0
+
+
+def post(endpoint, idx):
+    body = generate_content_body(f"- Box 2: Exporter\nDocument text:\ndeclaration {idx}")
+    return HTTP_SESSION.post(endpoint, headers={"X-goog-api-key": "standin"}, json=body, timeout=30)
+
+
+def call_legacy(endpoint, idx):
+    """The loop generate_content had: only 429s and network errors retry, on a fixed schedule."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = post(endpoint, idx)
+        except requests.exceptions.RequestException:
+            if attempt < MAX_RETRIES:
+                time.sleep(LEGACY_BASE_DELAY * 2 ** attempt)
+                continue
+            return False
+        if response.status_code == 429 and attempt < MAX_RETRIES:
+            time.sleep(LEGACY_BASE_DELAY * 2 ** attempt + LEGACY_BASE_DELAY * 0.5)
+            continue
+        return response.status_code == 200
+    return False
+
+
+def call_new(endpoint, idx, budget, breaker):
+    """generate_content's retry loop on top of cusdec_retry."""
+    for attempt in range(MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.retry_after())
+        try:
+            response = post(endpoint, idx)
+        except requests.exceptions.RequestException:
+            breaker.record_failure()
+            if attempt < MAX_RETRIES and budget.try_spend():
+                time.sleep(retry_delay(attempt)[0])
+                continue
+            if breaker.is_open:
+                raise CircuitOpenError(breaker.retry_after())
+            return False
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            wait_time, from_server = retry_delay(attempt, response)
+            if response.status_code == 429 and from_server:
+                breaker.release_probe()
+            else:
+                breaker.record_failure()
+            if attempt < MAX_RETRIES and budget.try_spend():
+                time.sleep(wait_time)
+                continue
+            if breaker.is_open:
+                raise CircuitOpenError(breaker.retry_after())
+            return False
+        breaker.record_success()
+        return response.status_code == 200
+    return False
+
+
+def run_new_task(endpoint, idx, budget, breaker, wait_for_circuit=0):
+    """run_gemini_jobs: optionally wait for an open breaker to close."""
+    deadline = time.monotonic() + wait_for_circuit
+    while True:
+        try:
+            return call_new(endpoint, idx, budget, breaker)
+        except CircuitOpenError as e:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(min(max(e.retry_after, 0.05), max(0.0, deadline - time.monotonic())))
+
+
+def run(server, endpoint, files, concurrency, outage, policy):
+    server.state.requests = server.state.failed_requests = 0
+    server.state.set_outage(**outage)
+    ok = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if policy == "legacy":
+            futures = [executor.submit(call_legacy, endpoint, idx) for idx in range(files)]
+            ok = sum(future.result() for future in as_completed(futures))
+        else:
+            budget = RetryBudget.for_requests(files)
+            breaker = CircuitBreaker(reset_seconds=BREAKER_RESET_SECONDS)
+            futures = {executor.submit(run_new_task, endpoint, idx, budget, breaker): idx for idx in range(files)}
+            requeued = []
+            for future in as_completed(futures):
+                try:
+                    ok += future.result()
+                except CircuitOpenError:
+                    requeued.append(futures[future])
+            retries = [executor.submit(run_new_task, endpoint, idx, budget, breaker, 2 * BREAKER_RESET_SECONDS)
+                       for idx in requeued]
+            for future in as_completed(retries):
+                try:
+                    ok += future.result()
+                except CircuitOpenError:
+                    pass
+    elapsed = time.perf_counter() - start
+    server.state.set_outage(200, count=0)
+    return elapsed, ok, server.state.requests, server.state.failed_requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--throttle-seconds", type=float, default=1.5)
+    parser.add_argument("--outage-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    server, base_url = start_standin(latency_ms=20, prefill_us_per_token=0)
+    endpoint = model_endpoint(MODEL, base_url=base_url)
+    scenarios = {
+        "throttle": {"status": 429, "seconds": args.throttle_seconds},
+        "outage": {"status": 503, "seconds": args.outage_seconds},
+    }
+    try:
+        print(f"{'scenario':>9} {'policy':>7} {'wall s':>7} {'ok':>4} {'requests':>9} {'failed':>7}")
+        for name, outage in scenarios.items():
+            for policy in ("legacy", "retry"):
+                elapsed, ok, sent, failed = run(server, endpoint, args.files, args.concurrency, outage, policy)
+                print(f"{name:>9} {policy:>7} {elapsed:>7.2f} {ok:>4} {sent:>9} {failed:>7}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: time to the first field and to the whole reply, with generateContent against
+streamGenerateContent (SSE) parsed incrementally, for line and JSON replies, using the local
+Gemini stand-in with output generation time. Also times how long a stalled stream takes to be
+abandoned and answered by a retry.
+
+Usage:
+    python benchmarks/bench_streaming.py [--documents 10] [--latency-ms 300] [--decode-us-per-token 3000]
+                                         [--stall-seconds 1]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from benchmarks.gemini_standin import start_standin  # noqa: E402
+from cusdec_gemini import HTTP_SESSION, generate_content_body, model_endpoint  # noqa: E402
+from cusdec_prompt import (COMMON_FIELDS_MAP, build_document_prompt, build_response_schema,  # noqa: E402
+                           decode_json_response, json_generation_config, parse_field_lines)
+from cusdec_stream import FieldStreamer, read_stream_reply  # noqa: E402
+
+MODEL = "gemini-2.5-flash"
+HEADERS = {"X-goog-api-key": "standin"}
+
+
+def sample_request(idx, json_mode):
+    page = "\n".join(f"{n} Line {n} of declaration {idx} CBBE1 E 7{idx:04d} 2024 #30{idx:02d}" for n in range(40))
+    prompt = build_document_prompt("", page, list(COMMON_FIELDS_MAP.values()))
+    if not json_mode:
+        return generate_content_body(prompt), None
+    schema, property_to_display = build_response_schema(COMMON_FIELDS_MAP)
+    return generate_content_body(prompt, json_generation_config(schema)), property_to_display
+
+
+def call_plain(base_url, body, property_to_display):
+    """(seconds to the first field, seconds to the whole reply, fields)."""
+    start = time.perf_counter()
+    response = HTTP_SESSION.post(model_endpoint(MODEL, base_url=base_url), headers=HEADERS, json=body, timeout=30)
+    response.raise_for_status()
+    text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+    fields = decode_json_response(text, property_to_display) if property_to_display else parse_field_lines(text)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, fields
+
+
+def call_streamed(base_url, body, property_to_display, stall_seconds=30.0):
+    start = time.perf_counter()
+    streamer = FieldStreamer(property_to_display)
+    with HTTP_SESSION.post(model_endpoint(MODEL, "streamGenerateContent", base_url=base_url), params={"alt": "sse"},
+                           headers=HEADERS, json=body, stream=True, timeout=(10, stall_seconds)) as response:
+        response.raise_for_status()
+        read_stream_reply(response, streamer)
+    return streamer.first_field_at - start, time.perf_counter() - start, streamer.fields
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--decode-us-per-token", type=float, default=3000)
+    parser.add_argument("--stall-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server, base_url = start_standin(latency_ms=args.latency_ms, prefill_us_per_token=0)
+    server.state.decode_us_per_token = args.decode_us_per_token
+    try:
+        print(f"{'reply':>5} {'mode':>9} {'first field p50 s':>18} {'whole reply p50 s':>18} {'fields':>7}")
+        for json_mode in (False, True):
+            for name, call in (("generate", call_plain), ("stream", call_streamed)):
+                first, whole, counts = [], [], []
+                for idx in range(args.documents):
+                    body, property_to_display = sample_request(idx, json_mode)
+                    to_first, to_whole, fields = call(base_url, body, property_to_display)
+                    first.append(to_first)
+                    whole.append(to_whole)
+                    counts.append(len(fields))
+                print(f"{'json' if json_mode else 'lines':>5} {name:>9} {statistics.median(first):>18.3f} "
+                      f"{statistics.median(whole):>18.3f} {min(counts):>7}")
+
+        # One stream hangs after its first chunk; the read timeout gives up on it and a retry answers
+        server.state.stall_streams, server.state.stall_seconds = 1, 30.0
+        body, property_to_display = sample_request(0, False)
+        start = time.perf_counter()
+        try:
+            call_streamed(base_url, body, property_to_display, args.stall_seconds)
+        except requests.exceptions.RequestException as e:
+            abandoned = time.perf_counter() - start
+            print(f"stalled stream abandoned after {abandoned:.2f}s ({type(e).__name__})")
+        call_streamed(base_url, body, property_to_display, args.stall_seconds)
+        print(f"answered by the retry {time.perf_counter() - start:.2f}s after the first attempt started "
+              f"(the stall lasted {server.state.stall_seconds:.0f}s)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+"""
+Local stand-in for the Gemini REST API, for exercising the app's client code without a key or network.
+
+Usage:
+    python benchmarks/gemini_standin.py [--port 8765] [--min-cache-tokens 0] [--prefill-us-per-token 50]
+                                        [--batch-seconds 4] [--latency-ms 0] [--tls-cert C --tls-key K]
+                                        [--fail-status 429 --fail-count N | --fail-seconds S] [--retry-after S]
+                                        [--fail-model M] [--model-latency M=MS ...]
+                                        [--tail-fraction 0.05 --tail-ms 20000]
+                                        [--decode-us-per-token 0] [--stall-streams N --stall-seconds S]
+                                        [--thinking-tokens 0]
+    CUSDEC_GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta streamlit run Rajee.py
+
+Emulated endpoints (under /v1beta):
+    GET    /models                    (400 for an API key starting with "invalid")
+    POST   /models/{model}:generateContent
+    POST   /models/{model}:streamGenerateContent?alt=sse   (server-sent events, chunked)
+    POST   /cachedContents            (refused below --min-cache-tokens, like the real minimum size)
+    GET    /cachedContents/{id}
+    DELETE /cachedContents/{id}
+    POST   /models/{model}:batchGenerateContent   (input from an uploaded JSONL file)
+    GET    /batches/{id}              (PENDING -> RUNNING -> SUCCEEDED over --batch-seconds)
+    POST   /upload/v1beta/files       (resumable start + "upload, finalize")
+    GET    /download/v1beta/files/{id}:download?alt=media
+
+Replies answer every requested schema property (or every listed field, per packed document)
+with "Not Found" and report usageMetadata with tokens estimated at 4 characters each. Response
+time grows with the uncached prompt tokens, so moving text into a cached context shows up in
+latency too.
+
+Outages can be injected (--fail-*, or StandinState.set_outage), for every model or just one:
+generateContent then answers with the given status, and for a 429 with a Retry-After header plus
+a google.rpc.RetryInfo detail. --model-latency (StandinState.model_latency_ms) slows one model down,
+and --tail-fraction/--tail-ms make a random share of calls hang (a latency tail).
+
+--decode-us-per-token adds output generation time: a generateContent reply waits for all of it,
+a stream spreads it over its chunks. --stall-streams makes that many streams hang for
+--stall-seconds after their first chunk.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import ssl
+import subprocess
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELS = ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-pro"]
+FIELD_LINE_RE = re.compile(r"^- (.+)$", re.MULTILINE)
+PACKED_SECTION_RE = re.compile(r"<<<BEGIN (\w+)>>>(.*?)<<<END \1>>>", re.DOTALL)
+BATCH_TYPE = "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch"
+BATCH_OUTPUT_TYPE = "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatchOutput"
+RETRY_INFO_TYPE = "type.googleapis.com/google.rpc.RetryInfo"
+ERROR_STATUS_NAMES = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 504: "DEADLINE_EXCEEDED"}
+
+
+def estimate_tokens(text):
+    return -(-len(text) // 4) if text else 0
+
+
+def _parts_text(content):
+    return "".join(part.get("text", "") for part in (content or {}).get("parts", []))
+
+
+class StandinState:
+    """Server-side state shared by handler threads: live caches, uploaded files, batches and counters."""
+
+    def __init__(self, min_cache_tokens=0, prefill_us_per_token=50.0, batch_seconds=4.0, latency_ms=0.0):
+        self.min_cache_tokens = min_cache_tokens
+        self.latency_ms = latency_ms
+        self.prefill_us_per_token = prefill_us_per_token
+        self.batch_seconds = batch_seconds
+        self.caches = {}  # name -> {"text", "tokens", "model", "expires_at"}
+        self.uploads = {}  # upload id -> display name, until finalized
+        self.files = {}  # "files/..." -> bytes
+        self.batches = {}  # "batches/..." -> {"model", "input_file", "created_at", "output_file"}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed_requests = 0
+        self.outage = None  # {"status", "count", "until", "retry_after", "model"} while failures are injected
+        self.model_latency_ms = {}  # model -> extra latency per call
+        self.listed_models = list(MODELS)  # what GET /models returns and generateContent accepts
+        self.list_latency_ms = 0.0
+        self.tail_fraction = 0.0  # share of calls that take tail_ms longer
+        self.tail_ms = 0.0
+        self.random = random.Random(0)
+        self.decode_us_per_token = 0.0
+        self.thinking_tokens = 0  # thoughtsTokenCount reported per reply, as a thinking model would
+        self.stream_chunk_chars = 80
+        self.stall_streams = 0  # streams still to hang after their first chunk
+        self.stall_seconds = 30.0
+
+    def set_outage(self, status, count=None, seconds=None, retry_after=None, model=None):
+        """
+        Fail the next count generateContent calls (or all of them for seconds) with status;
+        with model, only that model's calls.
+        """
+        with self.lock:
+            self.outage = {"status": status, "count": count, "retry_after": retry_after, "model": model,
+                           "until": time.time() + seconds if seconds is not None else None}
+
+    def take_fault(self, model):
+        """(status, payload, headers) if an injected outage fails this call, else None."""
+        with self.lock:
+            outage = self.outage
+            if outage is None or (outage["model"] and outage["model"] != model):
+                return None
+            if (outage["until"] is not None and time.time() >= outage["until"]) or outage["count"] == 0:
+                self.outage = None
+                return None
+            if outage["count"] is not None:
+                outage["count"] -= 1
+            self.requests += 1
+            self.failed_requests += 1
+        status = outage["status"]
+        payload = _error(status, "Injected stand-in failure", ERROR_STATUS_NAMES.get(status, "UNKNOWN"))
+        headers = {}
+        retry_after = outage["retry_after"]
+        if retry_after is None and outage["until"] is not None:
+            # Like a quota window: come back when it resets
+            retry_after = max(0.0, outage["until"] - time.time())
+        if status == 429 and retry_after is not None:
+            headers["Retry-After"] = str(math.ceil(retry_after))
+            payload["error"]["details"] = [{"@type": RETRY_INFO_TYPE, "retryDelay": f"{retry_after:.3f}s"}]
+        return status, payload, headers
+
+    def live_cache(self, name):
+        with self.lock:
+            cache = self.caches.get(name)
+            if cache and cache["expires_at"] <= time.time():
+                del self.caches[name]
+                cache = None
+            return cache
+
+    def generate(self, model, body, simulate_latency=True, decode_latency=True):
+        """
+        One generateContent call: (HTTP status, response or error payload). decode_latency=False
+        leaves the output generation time to the caller (streaming pays it chunk by chunk).
+        """
+        if model not in self.listed_models:
+            return 404, _error(404, f"models/{model} is not found for API version v1beta", "NOT_FOUND")
+        cached_tokens = 0
+        if body.get("cachedContent"):
+            cache = self.live_cache(body["cachedContent"])
+            if cache is None:
+                return 403, _error(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+            if cache["model"] != model:
+                return 400, _error(400, "Model used by GenerateContent request and CachedContent has to be the same",
+                                   "INVALID_ARGUMENT")
+            cached_tokens = cache["tokens"]
+        prompt_text = _parts_text(body.get("systemInstruction"))
+        prompt_text += "".join(_parts_text(content) for content in body.get("contents", []))
+        prompt_tokens = estimate_tokens(prompt_text)
+        with self.lock:
+            self.requests += 1
+        reply = build_reply(prompt_text, body.get("generationConfig"))
+        if simulate_latency:
+            latency_ms = self.latency_ms + self.model_latency_ms.get(model, 0.0)
+            with self.lock:
+                if self.random.random() < self.tail_fraction:
+                    latency_ms += self.tail_ms
+            decode_seconds = estimate_tokens(reply) * self.decode_us_per_token / 1e6 if decode_latency else 0.0
+            time.sleep(latency_ms / 1000 + prompt_tokens * self.prefill_us_per_token / 1e6 + decode_seconds)
+
+        usage = {
+            "promptTokenCount": prompt_tokens + cached_tokens,
+            "candidatesTokenCount": estimate_tokens(reply),
+            "totalTokenCount": prompt_tokens + cached_tokens + estimate_tokens(reply),
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        if self.thinking_tokens:
+            usage["thoughtsTokenCount"] = self.thinking_tokens
+            usage["totalTokenCount"] += self.thinking_tokens
+        return 200, {
+            "candidates": [{"content": {"parts": [{"text": reply}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": usage,
+            "modelVersion": model,
+        }
+
+    def batch_operation(self, name):
+        """The batch operation as GET /batches/{id} reports it; runs the batch when its time is up."""
+        with self.lock:
+            batch = self.batches.get(name)
+        if batch is None:
+            return None
+        elapsed = time.time() - batch["created_at"]
+        if elapsed < self.batch_seconds / 2:
+            state = "BATCH_STATE_PENDING"
+        elif elapsed < self.batch_seconds:
+            state = "BATCH_STATE_RUNNING"
+        else:
+            state = "BATCH_STATE_SUCCEEDED"
+            if batch["output_file"] is None:
+                self._run_batch(name, batch)
+        operation = {"name": name, "metadata": {"@type": BATCH_TYPE, "name": name, "model": f"models/{batch['model']}",
+                                                "state": state},
+                     "done": state == "BATCH_STATE_SUCCEEDED"}
+        if operation["done"]:
+            operation["response"] = {"@type": BATCH_OUTPUT_TYPE, "responsesFile": batch["output_file"]}
+        return operation
+
+    def _run_batch(self, name, batch):
+        lines = []
+        for line in self.files.get(batch["input_file"], b"").decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            status, payload = self.generate(batch["model"], entry.get("request", {}), simulate_latency=False)
+            result = {"key": entry.get("key")}
+            result["response" if status == 200 else "error"] = payload if status == 200 else payload["error"]
+            lines.append(json.dumps(result))
+        output_file = f"files/{name.split('/', 1)[1]}-results"
+        with self.lock:
+            self.files[output_file] = ("\n".join(lines) + "\n").encode("utf-8")
+            batch["output_file"] = output_file
+
+
+def _error(code, message, status):
+    return {"error": {"code": code, "message": message, "status": status}}
+
+
+def _schema_answer(schema):
+    if schema.get("type") == "OBJECT":
+        return {name: _schema_answer(prop) for name, prop in schema.get("properties", {}).items()}
+    return "Not Found"
+
+
+def build_reply(prompt_text, generation_config):
+    schema = (generation_config or {}).get("responseSchema")
+    if schema:
+        return json.dumps(_schema_answer(schema))
+    sections = PACKED_SECTION_RE.findall(prompt_text)
+    if sections:
+        return "\n".join(f"### {doc_id}\n" + "\n".join(f"{name}: Not Found" for name in FIELD_LINE_RE.findall(body))
+                         for doc_id, body in sections)
+    return "\n".join(f"{name}: Not Found" for name in FIELD_LINE_RE.findall(prompt_text))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "GeminiStandin/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without this, Nagle + delayed ACK add ~40 ms per reply
+    disable_nagle_algorithm = True
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, error_status):
+        self._send_json(status, _error(status, message, error_status))
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        match = re.search(r"/download/v1beta/(files/[\w-]+):download", self.path)
+        if match:
+            with self.state.lock:
+                content = self.state.files.get(match.group(1))
+            if content is None:
+                self._send_error(404, f"{match.group(1)} not found", "NOT_FOUND")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        match = re.search(r"/v1beta/(batches/[\w-]+)$", self.path)
+        if match:
+            operation = self.state.batch_operation(match.group(1))
+            if operation is None:
+                self._send_error(404, f"{match.group(1)} not found", "NOT_FOUND")
+            else:
+                self._send_json(200, operation)
+            return
+        if self.path.split("?", 1)[0].rstrip("/").endswith("/v1beta/models"):
+            time.sleep(self.state.list_latency_ms / 1000)
+            if self.headers.get("X-goog-api-key", "").startswith("invalid"):
+                self._send_error(400, "API key not valid. Please pass a valid API key.", "INVALID_ARGUMENT")
+                return
+            self._send_json(200, {"models": [
+                {"name": f"models/{m}", "supportedGenerationMethods": ["generateContent", "countTokens"]}
+                for m in self.state.listed_models]})
+            return
+        match = re.search(r"/v1beta/(cachedContents/[\w-]+)$", self.path)
+        if match:
+            cache = self.state.live_cache(match.group(1))
+            if cache is None:
+                self._send_error(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+            else:
+                self._send_json(200, {"name": match.group(1), "model": f"models/{cache['model']}"})
+            return
+        self._send_error(404, f"Unknown path {self.path}", "NOT_FOUND")
+
+    def do_DELETE(self):
+        match = re.search(r"/v1beta/(cachedContents/[\w-]+)$", self.path)
+        with self.state.lock:
+            removed = match and self.state.caches.pop(match.group(1), None)
+        if removed:
+            self._send_json(200, {})
+        else:
+            self._send_error(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+
+    def do_POST(self):
+        if "/upload/v1beta/files" in self.path:
+            self._upload()
+            return
+        if self.path.endswith("/v1beta/cachedContents"):
+            self._create_cache(self._read_json())
+            return
+        match = re.search(r"/v1beta/models/([\w.-]+):generateContent$", self.path)
+        if match:
+            body = self._read_json()
+            fault = self.state.take_fault(match.group(1))
+            self._send_json(*(fault or self.state.generate(match.group(1), body)))
+            return
+        match = re.search(r"/v1beta/models/([\w.-]+):streamGenerateContent(\?.*)?$", self.path)
+        if match:
+            body = self._read_json()
+            status, payload, *headers = self.state.take_fault(match.group(1)) or \
+                self.state.generate(match.group(1), body, decode_latency=False)
+            if status == 200:
+                self._stream_reply(payload)
+            else:
+                self._send_json(status, payload, *headers)
+            return
+        match = re.search(r"/v1beta/models/([\w.-]+):batchGenerateContent$", self.path)
+        if match:
+            self._create_batch(match.group(1), self._read_json())
+            return
+        self._send_error(404, f"Unknown path {self.path}", "NOT_FOUND")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_reply(self, payload):
+        """Send a generateContent reply as SSE events of stream_chunk_chars text each; usage comes last."""
+        text = payload["candidates"][0]["content"]["parts"][0]["text"]
+        size = self.state.stream_chunk_chars
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        with self.state.lock:
+            stall = self.state.stall_streams > 0
+            self.state.stall_streams -= stall
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for n, piece in enumerate(pieces):
+                time.sleep(estimate_tokens(piece) * self.state.decode_us_per_token / 1e6)
+                if stall and n == 1:
+                    time.sleep(self.state.stall_seconds)
+                candidate = {"content": {"parts": [{"text": piece}], "role": "model"}}
+                event = {"candidates": [candidate], "modelVersion": payload["modelVersion"]}
+                if n == len(pieces) - 1:
+                    candidate["finishReason"] = "STOP"
+                    event["usageMetadata"] = payload["usageMetadata"]
+                self._write_chunk(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on a stalled stream
+            self.close_connection = True
+
+    def _upload(self):
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if command == "start":
+            self._read_json()
+            upload_id = uuid.uuid4().hex[:12]
+            with self.state.lock:
+                self.state.uploads[upload_id] = True
+            self.send_response(200)
+            self.send_header("X-Goog-Upload-URL",
+                             f"http://{self.headers.get('Host')}/upload/v1beta/files?upload_id={upload_id}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        match = re.search(r"upload_id=(\w+)", self.path)
+        with self.state.lock:
+            known = bool(match) and self.state.uploads.pop(match.group(1), None)
+        if not known or "finalize" not in command:
+            self._send_error(400, "Unknown or unfinished upload", "INVALID_ARGUMENT")
+            return
+        content = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        name = f"files/{match.group(1)}"
+        with self.state.lock:
+            self.state.files[name] = content
+        self._send_json(200, {"file": {"name": name, "sizeBytes": str(len(content)), "state": "ACTIVE"}})
+
+    def _create_batch(self, model, body):
+        if model not in self.state.listed_models:
+            self._send_error(404, f"models/{model} is not found for API version v1beta", "NOT_FOUND")
+            return
+        input_file = ((body.get("batch") or {}).get("input_config") or {}).get("file_name")
+        with self.state.lock:
+            known = input_file in self.state.files
+        if not known:
+            self._send_error(400, f"Input file {input_file} not found", "INVALID_ARGUMENT")
+            return
+        name = f"batches/{uuid.uuid4().hex[:12]}"
+        with self.state.lock:
+            self.state.batches[name] = {"model": model, "input_file": input_file, "created_at": time.time(),
+                                        "output_file": None}
+        self._send_json(200, self.state.batch_operation(name))
+
+    def _create_cache(self, body):
+        text = _parts_text(body.get("systemInstruction"))
+        text += "".join(_parts_text(content) for content in body.get("contents", []))
+        tokens = estimate_tokens(text)
+        if tokens < self.state.min_cache_tokens:
+            self._send_error(400, f"Cached content is too small. total_token_count={tokens}, "
+                                  f"min_total_token_count={self.state.min_cache_tokens}", "INVALID_ARGUMENT")
+            return
+        ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "").replace("models/", "")
+        with self.state.lock:
+            self.state.caches[name] = {"text": text, "tokens": tokens, "model": model,
+                                       "expires_at": time.time() + ttl}
+        self._send_json(200, {"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": tokens}})
+
+
+def start_standin(port=0, min_cache_tokens=0, prefill_us_per_token=50.0, batch_seconds=4.0, latency_ms=0.0,
+                  tls_cert=None, tls_key=None, outage=None, model_latency_ms=None):
+    """
+    Start the stand-in on a background thread; returns (server, base URL).
+    With tls_cert/tls_key (PEM files) it serves HTTPS, so TLS handshake costs are real.
+    outage is a dict of StandinState.set_outage arguments to start with; model_latency_ms maps
+    model -> extra latency.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    server.daemon_threads = True
+    server.state = StandinState(min_cache_tokens, prefill_us_per_token, batch_seconds, latency_ms)
+    if outage:
+        server.state.set_outage(**outage)
+    server.state.model_latency_ms.update(model_latency_ms or {})
+    scheme = "http"
+    if tls_cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(tls_cert, tls_key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/v1beta"
+
+
+def make_self_signed_cert(directory):
+    """Write a throwaway certificate for 127.0.0.1 with the openssl CLI; returns (cert path, key path)."""
+    cert, key = os.path.join(directory, "standin-cert.pem"), os.path.join(directory, "standin-key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                    "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--min-cache-tokens", type=int, default=0)
+    parser.add_argument("--prefill-us-per-token", type=float, default=50.0)
+    parser.add_argument("--batch-seconds", type=float, default=4.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fixed extra latency per generateContent call")
+    parser.add_argument("--tls-cert", help="PEM certificate; serve HTTPS (with --tls-key)")
+    parser.add_argument("--tls-key")
+    parser.add_argument("--fail-status", type=int, default=429, help="status of injected failures")
+    parser.add_argument("--fail-count", type=int, help="fail this many generateContent calls at startup")
+    parser.add_argument("--fail-seconds", type=float, help="fail every generateContent call for this long")
+    parser.add_argument("--retry-after", type=float,
+                        help="seconds advertised on injected 429s (default: until --fail-seconds is over)")
+    parser.add_argument("--fail-model", help="inject the failures for this model only")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="extra latency per call for one model")
+    parser.add_argument("--tail-fraction", type=float, default=0.0, help="share of calls that hang for --tail-ms")
+    parser.add_argument("--tail-ms", type=float, default=20000.0)
+    parser.add_argument("--decode-us-per-token", type=float, default=0.0, help="output generation time per token")
+    parser.add_argument("--stall-streams", type=int, default=0, help="streams that hang after their first chunk")
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    parser.add_argument("--thinking-tokens", type=int, default=0, help="thoughtsTokenCount reported per reply")
+    args = parser.parse_args()
+    outage = None
+    if args.fail_count is not None or args.fail_seconds is not None:
+        outage = {"status": args.fail_status, "count": args.fail_count, "seconds": args.fail_seconds,
+                  "retry_after": args.retry_after, "model": args.fail_model}
+    model_latency_ms = {model: float(ms) for model, ms in (item.split("=", 1) for item in args.model_latency)}
+    server, base_url = start_standin(args.port, args.min_cache_tokens, args.prefill_us_per_token, args.batch_seconds,
+                                     args.latency_ms, args.tls_cert, args.tls_key, outage, model_latency_ms)
+    server.state.tail_fraction, server.state.tail_ms = args.tail_fraction, args.tail_ms
+    server.state.decode_us_per_token = args.decode_us_per_token
+    server.state.stall_streams, server.state.stall_seconds = args.stall_streams, args.stall_seconds
+    server.state.thinking_tokens = args.thinking_tokens
+    print(f"Gemini stand-in listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
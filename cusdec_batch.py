@@ -0,0 +1,223 @@
+"""
+Offline batch mode: the per-document generateContent requests of a run are written to a JSONL
+file, uploaded through the Files API and submitted as one Gemini Batch API job. The job state
+(batch name, prepared extraction jobs, records still waiting for results) is persisted on disk,
+so a run can be polled and ingested after the app restarts.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+import requests
+
+from cusdec_cache import CACHE_DIR
+from cusdec_gemini import GEMINI_API_BASE
+from cusdec_http import HTTP_SESSION
+
+logger = logging.getLogger("cusdec_app")
+
+BATCH_JOB_DIR = os.path.join(CACHE_DIR, "batch_jobs")
+
+# Batch states as reported in the operation metadata (BATCH_STATE_* / JOB_STATE_* depending on surface)
+BATCH_DONE_STATES = ("SUCCEEDED", "FAILED", "CANCELLED", "EXPIRED")
+
+# Local lifecycle of a persisted job on top of the remote state
+STATUS_SUBMITTED = "submitted"
+STATUS_INGESTED = "ingested"
+STATUS_FAILED = "failed"
+
+
+def _split_base(base_url):
+    """"https://host/v1beta" -> ("https://host", "v1beta")."""
+    root, version = base_url.rstrip("/").rsplit("/", 1)
+    return root, version
+
+
+def batch_state_name(state):
+    """"BATCH_STATE_SUCCEEDED" / "JOB_STATE_SUCCEEDED" -> "SUCCEEDED"."""
+    return (state or "UNSPECIFIED").rsplit("_STATE_", 1)[-1]
+
+
+def write_batch_jsonl(requests_by_key, path):
+    """One {"key", "request"} line per generateContent request body."""
+    with open(path, "w", encoding="utf-8") as f:
+        for key, request_body in requests_by_key.items():
+            f.write(json.dumps({"key": key, "request": request_body}) + "\n")
+
+
+class BatchClient:
+    """Files API upload, batch submission, polling and result download over plain REST."""
+
+    def __init__(self, api_key, base_url=GEMINI_API_BASE, timeout=60):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    @property
+    def _headers(self):
+        return {"X-goog-api-key": self.api_key}
+
+    def upload_jsonl(self, path, display_name):
+        """Resumable upload of a JSONL file; returns the file resource name ("files/...")."""
+        root, version = _split_base(self.base_url)
+        with open(path, "rb") as f:
+            payload = f.read()
+        start = HTTP_SESSION.post(
+            f"{root}/upload/{version}/files",
+            headers={**self._headers,
+                     "X-Goog-Upload-Protocol": "resumable",
+                     "X-Goog-Upload-Command": "start",
+                     "X-Goog-Upload-Header-Content-Length": str(len(payload)),
+                     "X-Goog-Upload-Header-Content-Type": "application/jsonl"},
+            json={"file": {"display_name": display_name}}, timeout=self.timeout)
+        start.raise_for_status()
+        upload_url = start.headers["X-Goog-Upload-URL"]
+        finish = HTTP_SESSION.post(
+            upload_url,
+            headers={**self._headers,
+                     "X-Goog-Upload-Offset": "0",
+                     "X-Goog-Upload-Command": "upload, finalize"},
+            data=payload, timeout=self.timeout)
+        finish.raise_for_status()
+        return finish.json()["file"]["name"]
+
+    def submit(self, model, file_name, display_name):
+        """Create the batch job; returns its resource name ("batches/...")."""
+        response = HTTP_SESSION.post(
+            f"{self.base_url}/models/{model}:batchGenerateContent", headers=self._headers,
+            json={"batch": {"display_name": display_name, "input_config": {"file_name": file_name}}},
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["name"]
+
+    def get(self, batch_name):
+        """The batch operation: {"name", "metadata": {"state", ...}, "done", "response"}."""
+        response = HTTP_SESSION.get(f"{self.base_url}/{batch_name}", headers=self._headers,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def download_results(self, operation):
+        """{key: generateContent response or {"error": ...}} from a finished batch operation."""
+        result = operation.get("response") or {}
+        inlined = (result.get("inlinedResponses") or {}).get("inlinedResponses")
+        if inlined is not None:
+            return {entry.get("metadata", {}).get("key", str(idx)):
+                    entry.get("response") or {"error": entry.get("error")} for idx, entry in enumerate(inlined)}
+        file_name = result.get("responsesFile")
+        if not file_name:
+            return {}
+        root, version = _split_base(self.base_url)
+        response = HTTP_SESSION.get(f"{root}/download/{version}/{file_name}:download", params={"alt": "media"},
+                                    headers=self._headers, timeout=self.timeout)
+        response.raise_for_status()
+        results = {}
+        for line in response.text.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                results[entry.get("key")] = entry.get("response") or {"error": entry.get("error")}
+        return results
+
+
+class BatchJobStore:
+    """One JSON state file per batch run under BATCH_JOB_DIR."""
+
+    def __init__(self, job_dir=BATCH_JOB_DIR):
+        self.job_dir = job_dir
+
+    def _path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def new_job(self, model, records, jobs):
+        """
+        Create local state for a run. records are the run's per-file records in upload order;
+        those still waiting for Gemini have data None and a "batch_key" into jobs, which maps
+        request key -> prepared extraction job.
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        state = {"job_id": job_id, "model": model, "status": STATUS_SUBMITTED, "batch_name": None,
+                 "remote_state": "PENDING", "created_at": time.time(), "updated_at": time.time(),
+                 "records": records, "jobs": jobs, "error": ""}
+        self.save(state)
+        return state
+
+    def save(self, state):
+        state["updated_at"] = time.time()
+        tmp_path = self._path(state["job_id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path(state["job_id"]))
+
+    def load(self, job_id):
+        with open(self._path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+
+    def jsonl_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.requests.jsonl")
+
+    def list_jobs(self):
+        """Every persisted run, newest first."""
+        if not os.path.isdir(self.job_dir):
+            return []
+        states = []
+        for name in sorted(os.listdir(self.job_dir), reverse=True):
+            if name.endswith(".json"):
+                try:
+                    states.append(self.load(name[:-len(".json")]))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Unreadable batch job state {name}: {e}")
+        return states
+
+
+def submit_batch_run(client, store, model, records, jobs, requests_by_key):
+    """Persist the run, write and upload its JSONL, submit the batch. Returns the saved state."""
+    state = store.new_job(model, records, jobs)
+    if not requests_by_key:
+        return state
+    path = store.jsonl_path(state["job_id"])
+    write_batch_jsonl(requests_by_key, path)
+    try:
+        file_name = client.upload_jsonl(path, f"cusdec-{state['job_id']}")
+        state["batch_name"] = client.submit(model, file_name, f"cusdec-{state['job_id']}")
+        logger.info(f"Submitted Gemini batch {state['batch_name']} with {len(requests_by_key)} requests")
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        state.update(status=STATUS_FAILED, error=f"Batch submission failed: {e}")
+        logger.error(state["error"])
+    store.save(state)
+    return state
+
+
+def poll_batch_run(client, store, state):
+    """
+    Refresh one run's remote state. Returns {key: response} once the batch has succeeded
+    (the caller ingests them), else None.
+    """
+    if state["status"] != STATUS_SUBMITTED:
+        return None
+    if not state["batch_name"]:
+        # Every document resolved locally: nothing was sent
+        return {}
+    try:
+        operation = client.get(state["batch_name"])
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Could not poll batch {state['batch_name']}: {e}")
+        return None
+    state["remote_state"] = batch_state_name((operation.get("metadata") or {}).get("state"))
+    if state["remote_state"] in BATCH_DONE_STATES and state["remote_state"] != "SUCCEEDED":
+        state.update(status=STATUS_FAILED, error=f"Batch ended in state {state['remote_state']}")
+    store.save(state)
+    if state["remote_state"] != "SUCCEEDED":
+        return None
+    try:
+        return client.download_results(operation)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Could not download results of batch {state['batch_name']}: {e}")
+        return None
+
+
+def mark_ingested(store, state):
+    state["status"] = STATUS_INGESTED
+    store.save(state)
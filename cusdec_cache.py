@@ -0,0 +1,201 @@
+"""
+Two-tier cache for the CUSDEC II extractor: an in-memory LRU in front of a SQLite file.
+
+Values must be JSON-serialisable. Both tiers evict by size (bytes of the JSON encoding),
+least recently used first; with a TTL, entries older than it are dropped when looked up.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("cusdec_app")
+
+CACHE_DIR = os.getenv("CUSDEC_CACHE_DIR", ".cusdec_cache")
+
+
+def sha256_hex(*parts):
+    """SHA-256 over bytes/str parts, with a separator so ("ab", "c") and ("a", "bc") differ."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SqliteConnection:
+    """
+    The connection of one process to a SQLite file, opened (and the schema created) on first use.
+    A connection must not cross a fork, so a forked child opens its own. migrations are
+    (table, column, definition, backfill) for columns added after files were first written:
+    a file without the column gets it, then backfill(connection) runs if given. Callers
+    serialise their use of the connection with their own lock.
+    """
+
+    def __init__(self, db_path, schema, migrations=(), wal=False):
+        self.db_path = db_path
+        self.schema = schema
+        self.migrations = migrations
+        self.wal = wal
+        self._conn = None
+        self._conn_pid = None
+
+    def get(self):
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            if self.wal:
+                conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            for table, column, definition, backfill in self.migrations:
+                if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    if backfill is not None:
+                        backfill(conn)
+            conn.commit()
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+
+class TwoTierCache:
+    """
+    Memory LRU + SQLite cache with hit/miss counters.
+    Safe to share between Streamlit session threads; forked children reopen their own connection.
+    """
+
+    def __init__(self, name, max_memory_bytes, max_disk_bytes, cache_dir=CACHE_DIR, ttl_seconds=None):
+        self.name = name
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.db_path = os.path.join(cache_dir, f"{name}.sqlite3") if max_disk_bytes > 0 else None
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._sqlite = None if self.db_path is None else SqliteConnection(
+            self.db_path,
+            ["CREATE TABLE IF NOT EXISTS entries ("
+             "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, "
+             "created_at REAL NOT NULL DEFAULT 0)"],
+            # Files written before entries carried their age; treat them as created now
+            [("entries", "created_at", "REAL NOT NULL DEFAULT 0",
+              lambda conn: conn.execute("UPDATE entries SET created_at = ?", (time.time(),)))],
+            wal=True)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _db(self):
+        return None if self._sqlite is None else self._sqlite.get()
+
+    def _remember(self, key, value, size, created_at):
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._memory[key] = (value, size, created_at)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def _expired(self, created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key):
+        """Return the cached value or None."""
+        return self.get_first([key])[1]
+
+    def get_first(self, keys):
+        """(key, value) for the first of keys that is cached, else (None, None); counts one hit or miss."""
+        with self._lock:
+            expired = False
+            for key in keys:
+                value, tier = self._lookup(key)
+                if tier in ("memory", "disk"):
+                    self.stats[f"{tier}_hits"] += 1
+                    return key, value
+                expired = expired or tier == "expired"
+            self.stats["expired" if expired else "misses"] += 1
+            return None, None
+
+    def _lookup(self, key):
+        """(value, "memory" | "disk") on a hit, (None, "expired") or (None, None) otherwise. Lock held."""
+        expired = False
+        if key in self._memory:
+            value, size, created_at = self._memory[key]
+            if not self._expired(created_at):
+                self._memory.move_to_end(key)
+                return value, "memory"
+            self._memory_bytes -= size
+            del self._memory[key]
+            expired = True
+        try:
+            db = self._db()
+            row = db.execute("SELECT value, size, created_at FROM entries WHERE key = ?",
+                             (key,)).fetchone() if db else None
+            if row is not None and self._expired(row[2]):
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                expired = True
+                row = None
+            elif row is not None:
+                db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            if db:
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"{self.name} cache read failed: {e}")
+            row = None
+        if row is None:
+            return None, "expired" if expired else None
+        value = json.loads(row[0])
+        self._remember(key, value, row[1], row[2])
+        return value, "disk"
+
+    def contains(self, key):
+        """Presence check that does not touch the counters or the LRU order."""
+        with self._lock:
+            if key in self._memory:
+                return True
+            try:
+                db = self._db()
+                return bool(db and db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone())
+            except sqlite3.Error:
+                return False
+
+    def put(self, key, value):
+        encoded = json.dumps(value)
+        size = len(encoded.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, size, now)
+            try:
+                db = self._db()
+                if db is None or size > self.max_disk_bytes:
+                    return
+                db.execute("INSERT OR REPLACE INTO entries (key, value, size, last_access, created_at) "
+                           "VALUES (?, ?, ?, ?, ?)", (key, encoded, size, now, now))
+                self._evict_disk(db)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"{self.name} cache write failed: {e}")
+
+    def _evict_disk(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.stats["evictions"] += 1
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    def hits(self):
+        return self.stats["memory_hits"] + self.stats["disk_hits"]
+
+    def summary(self):
+        return f"{self.hits()} hits ({self.stats['memory_hits']} memory, {self.stats['disk_hits']} disk), " \
+               f"{self.stats['misses']} misses, {self.stats['evictions']} evictions, {self.stats['expired']} expired"
@@ -0,0 +1,312 @@
+"""
+Gemini REST plumbing shared by the app: endpoint URLs, request bodies, the concurrency limit,
+and the handle manager that moves the static instruction block out of every request, either
+into a cached context (cachedContents) or into systemInstruction.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from cusdec_cache import TwoTierCache, sha256_hex
+from cusdec_http import GEMINI_CONCURRENCY, HTTP_SESSION
+from cusdec_prompt import PROMPT_TEMPLATE_VERSION, estimate_tokens
+from cusdec_usage import record_cache_creation
+
+logger = logging.getLogger("cusdec_app")
+
+# Point at a local stand-in (benchmarks/gemini_standin.py) to test without the real API
+GEMINI_API_BASE = os.getenv("CUSDEC_GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+# Caps the Gemini requests in flight at once, across every session of this server process
+GEMINI_SLOTS = threading.BoundedSemaphore(GEMINI_CONCURRENCY)
+
+# Successful generateContent replies keyed by model, prompt template version and the full request,
+# so recaptures and re-uploads of an unchanged document skip the API call
+RESPONSE_CACHE_ENABLED = os.getenv("CUSDEC_RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE = TwoTierCache(
+    "gemini_responses",
+    max_memory_bytes=int(os.getenv("CUSDEC_RESPONSE_CACHE_MEMORY_MB", "16")) * 1024 * 1024,
+    max_disk_bytes=int(os.getenv("CUSDEC_RESPONSE_CACHE_DISK_MB", "256")) * 1024 * 1024,
+    ttl_seconds=float(os.getenv("CUSDEC_RESPONSE_CACHE_TTL_HOURS", "168")) * 3600,
+)
+
+# The list of models the API key can use is fetched at startup and again in the background after this long
+MODEL_LIST_TTL_SECONDS = float(os.getenv("CUSDEC_MODEL_LIST_TTL_MINUTES", "60")) * 60
+# Key-related statuses from GET /models; anything else (5xx, network) leaves the key's validity unknown
+INVALID_KEY_STATUS_CODES = (400, 401, 403)
+
+# generate_content appends one entry per HTTP attempt to this list, for the document(s) being extracted
+current_call_log = contextvars.ContextVar("current_call_log", default=None)
+current_late_call_sink = contextvars.ContextVar("current_late_call_sink", default=None)
+
+# How the static instruction block is sent:
+#   "cached" - cachedContents handle, falling back to systemInstruction if the API refuses the cache
+#   "system" - systemInstruction on every request, with only the unresolved fields' hints
+#   "off"    - inlined into the prompt text
+# "system" is the default: the block (about 375 tokens) is below the API's minimum cacheable size
+# (1,024 tokens or more, by model), so "cached" would only spend a refused cachedContents call and
+# then send every field's hints on each request.
+CONTEXT_CACHE_MODE = os.getenv("CUSDEC_CONTEXT_CACHE", "system")
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CUSDEC_CONTEXT_CACHE_TTL", "3600"))
+# Recreate a cache this long before its TTL runs out, so no request races the expiry
+CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS = 60
+# After a failed cache creation that may succeed later (network error, 429, 5xx) wait this long before
+# trying again, doubling with every further failure up to the maximum
+CONTEXT_CACHE_RETRY_SECONDS = 30
+CONTEXT_CACHE_MAX_RETRY_SECONDS = 900
+
+
+def model_endpoint(model, method="generateContent", base_url=GEMINI_API_BASE):
+    return f"{base_url}/models/{model}:{method}"
+
+
+def model_from_endpoint(endpoint):
+    """"https://.../models/gemini-2.5-flash:generateContent" -> "gemini-2.5-flash"."""
+    return endpoint.rsplit("/models/", 1)[-1].split(":", 1)[0]
+
+
+def generate_content_body(prompt, generation_config=None, instruction=None):
+    """generateContent request body, with the instruction block (if any) as systemInstruction."""
+    body = {"contents": [{"parts": [{"text": prompt}]}]}
+    if generation_config:
+        body["generationConfig"] = generation_config
+    if instruction:
+        body["systemInstruction"] = {"parts": [{"text": instruction}]}
+    return body
+
+
+def response_cache_key(model, prompt, generation_config=None, instruction=None):
+    """Cache key of one generateContent request; the schema and instruction block are part of the prompt."""
+    return sha256_hex(PROMPT_TEMPLATE_VERSION, model, json.dumps(generation_config or {}, sort_keys=True),
+                      instruction or "", prompt)
+
+
+def log_gemini_call(**entry):
+    """Record one Gemini attempt in the call log of the current extraction, if one is collecting."""
+    calls = current_call_log.get()
+    if calls is not None:
+        calls.append(entry)
+
+
+@contextlib.contextmanager
+def collect_gemini_calls(late_call_sink=None):
+    """
+    Collect the log_gemini_call entries made inside the block into the yielded list. Entries of
+    hedge losers, which may only finish after the block has ended, go to late_call_sink(entry)
+    instead when one is given.
+    """
+    calls = []
+    token = current_call_log.set(calls)
+    sink_token = current_late_call_sink.set(late_call_sink)
+    try:
+        yield calls
+    finally:
+        current_late_call_sink.reset(sink_token)
+        current_call_log.reset(token)
+
+
+def is_cached_content_error(status_code, body):
+    """True when a generateContent failure is about the cachedContent handle (expired or deleted)."""
+    return status_code in (400, 403, 404) and "cachedcontent" in (body or "").lower()
+
+
+class ContextCacheManager:
+    """
+    Hands out the request fields that carry the static instruction block:
+    {"cachedContent": name} while a cache is alive, {"systemInstruction": ...} otherwise.
+
+    Cache handles are keyed by (model, instruction) and tracked against their TTL locally;
+    an expired or server-rejected handle is recreated on next use. If the API refuses to create
+    a cache with a 4xx (e.g. the block is below the model's minimum cacheable size) that instruction
+    falls back to systemInstruction for the life of the process; after a network error, 429 or 5xx
+    it falls back only until a backoff has passed, then creation is tried again.
+    """
+
+    def __init__(self, api_key, model, mode=CONTEXT_CACHE_MODE, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+                 base_url=GEMINI_API_BASE, timeout=30):
+        self.api_key = api_key
+        self.model = model
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.base_url = base_url
+        self.timeout = timeout
+        self._handles = {}  # key -> (cache name, local expiry time)
+        self._uncacheable = set()
+        self._retry_at = {}  # key -> (monotonic time creation may be tried again, failures so far)
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "reused": 0, "recreated": 0, "fallbacks": 0}
+
+    def _key(self, instruction):
+        return sha256_hex(self.model, instruction)
+
+    def _create(self, instruction):
+        """(cache name, None) on success; (None, True) if the API refused it for good, (None, False) if not."""
+        body = {
+            "model": f"models/{self.model}",
+            "displayName": "cusdec-instructions",
+            "systemInstruction": {"parts": [{"text": instruction}]},
+            "ttl": f"{self.ttl_seconds}s",
+        }
+        try:
+            response = HTTP_SESSION.post(f"{self.base_url}/cachedContents",
+                                         headers={"X-goog-api-key": self.api_key}, json=body, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not create Gemini context cache: {e}")
+            return None, False
+        if response.status_code != 200:
+            logger.warning(f"Gemini refused the context cache ({response.status_code}): {response.text[:300]}")
+            return None, 400 <= response.status_code < 500 and response.status_code != 429
+        try:
+            reply = response.json()
+            name = reply.get("name")
+        except (ValueError, AttributeError):
+            reply, name = {}, None
+        if not name:
+            logger.warning(f"Gemini context cache reply has no cache name: {response.text[:300]}")
+            return None, False
+        tokens = (reply.get("usageMetadata") or {}).get("totalTokenCount") or estimate_tokens(instruction)
+        record_cache_creation(self.model, tokens, self.ttl_seconds)
+        logger.info(f"Created Gemini context cache {name} ({tokens} tokens, TTL {self.ttl_seconds}s)")
+        return name, None
+
+    def request_fields(self, instruction):
+        """Fields to merge into a generateContent body for this instruction block."""
+        system_instruction = {"systemInstruction": {"parts": [{"text": instruction}]}}
+        if self.mode != "cached":
+            return system_instruction
+        key = self._key(instruction)
+        with self._lock:
+            if key in self._uncacheable:
+                return system_instruction
+            handle = self._handles.get(key)
+            if handle and handle[1] > time.time():
+                self.stats["reused"] += 1
+                return {"cachedContent": handle[0]}
+            retry_at, failures = self._retry_at.get(key, (0.0, 0))
+            if time.monotonic() < retry_at:
+                self.stats["fallbacks"] += 1
+                return system_instruction
+            name, refused = self._create(instruction)
+            if name is None:
+                if refused:
+                    self._uncacheable.add(key)
+                else:
+                    backoff = min(CONTEXT_CACHE_MAX_RETRY_SECONDS, CONTEXT_CACHE_RETRY_SECONDS * 2 ** failures)
+                    self._retry_at[key] = (time.monotonic() + backoff, failures + 1)
+                self.stats["fallbacks"] += 1
+                return system_instruction
+            self._retry_at.pop(key, None)
+            self.stats["recreated" if handle else "created"] += 1
+            self._handles[key] = (name, time.time() + self.ttl_seconds - CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS)
+            return {"cachedContent": name}
+
+    def invalidate(self, cache_name):
+        """Forget a handle the server no longer accepts; the next request_fields recreates it."""
+        with self._lock:
+            for key, (name, expires_at) in list(self._handles.items()):
+                if name == cache_name:
+                    # Keep the entry (expired) so the recreation is counted as such
+                    self._handles[key] = (name, 0)
+
+    def summary(self):
+        return (f"mode {self.mode}, {self.stats['created']} created, {self.stats['recreated']} recreated, "
+                f"{self.stats['reused']} reused, {self.stats['fallbacks']} fallbacks")
+
+
+class ModelCatalog:
+    """
+    The models the API key may call generateContent on, from GET /models. Listed once when the
+    catalog is created (that also validates the key) and refreshed in the background once the
+    list is older than ttl_seconds, so no caller waits for the listing after the first one.
+    A failed refresh keeps the last good list.
+    """
+
+    def __init__(self, api_key, base_url=GEMINI_API_BASE, ttl_seconds=MODEL_LIST_TTL_SECONDS, timeout=10):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self._models = None  # None: never listed successfully
+        self._listed_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        # "unknown" until a listing answers; "valid" or "invalid" afterwards
+        self.key_status = "unknown"
+        self.error = ""
+
+    def refresh(self):
+        """List the models now (following nextPageToken). Returns True if the list was updated."""
+        models = []
+        params = {"pageSize": 1000}
+        try:
+            while True:
+                response = HTTP_SESSION.get(f"{self.base_url}/models", headers={"X-goog-api-key": self.api_key},
+                                            params=params, timeout=self.timeout)
+                if response.status_code != 200:
+                    break
+                data = response.json()
+                for model in data.get("models", []):
+                    # The stand-in and older API versions omit the methods: assume generateContent
+                    if "generateContent" in model.get("supportedGenerationMethods", ["generateContent"]):
+                        models.append(model.get("name", "").replace("models/", ""))
+                if not data.get("nextPageToken"):
+                    break
+                params["pageToken"] = data["nextPageToken"]
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._lock:
+                self.error = f"could not list models: {e}"
+                self._refreshing = False
+            logger.warning(f"Gemini model list: {self.error}")
+            return False
+        with self._lock:
+            self._refreshing = False
+            if response.status_code != 200:
+                self.error = f"listing models returned {response.status_code}: {response.text[:300]}"
+                if response.status_code in INVALID_KEY_STATUS_CODES:
+                    self.key_status = "invalid"
+                logger.error(f"Gemini model list: {self.error}")
+                return False
+            self._models = models
+            self._listed_at = time.monotonic()
+            self.key_status = "valid"
+            self.error = ""
+        logger.info(f"Gemini model list: {len(models)} models support generateContent")
+        return True
+
+    def models(self):
+        """The cached list (None if it was never listed), starting a background refresh when it is stale."""
+        with self._lock:
+            stale = time.monotonic() - self._listed_at >= self.ttl_seconds
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self.refresh, name="gemini-model-list", daemon=True).start()
+            return list(self._models) if self._models is not None else None
+
+    def knows(self, model):
+        """True/False once the list is known; None while it is not."""
+        models = self.models()
+        return None if models is None else model in models
+
+    def select(self, preferred, substitutes=()):
+        """
+        The preferred models the key can use, in order. If none of them is available, the first
+        available of substitutes takes their place; while the list is unknown preferred is kept.
+        """
+        models = self.models()
+        if models is None:
+            return list(preferred)
+        usable = [model for model in preferred if model in models]
+        if usable:
+            return usable
+        return [model for model in substitutes if model in models][:1]
+
+    def summary(self):
+        models = self.models()
+        listed = f"{len(models)} models listed" if models is not None else "model list unavailable"
+        return f"key {self.key_status}, {listed}" + (f" ({self.error})" if self.error else "")
@@ -0,0 +1,124 @@
+"""
+Hedged requests: when a Gemini call has not answered within the model's rolling p95 latency,
+a duplicate goes out (to the next model by default) and the first good answer wins. A cap on
+the share of hedged calls protects the quota; the loser is left to finish in the background so
+the tail latency the hedge saved can be measured.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cusdec_http import GEMINI_CONCURRENCY
+
+logger = logging.getLogger("cusdec_app")
+
+HEDGE_ENABLED = os.getenv("CUSDEC_HEDGE", "0") == "1"
+# At most this share of calls may send a duplicate
+HEDGE_MAX_RATE = float(os.getenv("CUSDEC_HEDGE_MAX_RATE", "0.1"))
+# Hedge delay until the model has enough samples for a p95, and the floor below which it never goes
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("CUSDEC_HEDGE_DELAY", "8"))
+HEDGE_MIN_DELAY_SECONDS = 1.0
+# "secondary": the duplicate goes to the next model the router would pick; "same": to the same model
+HEDGE_TARGET = os.getenv("CUSDEC_HEDGE_TARGET", "secondary")
+
+# Hedges in flight at once, on top of GEMINI_SLOTS (whose slots are all busy exactly when hedges are due)
+HEDGE_SLOTS = threading.BoundedSemaphore(max(1, GEMINI_CONCURRENCY // 2))
+
+
+class Hedger:
+    """
+    Runs a call, and if it is still pending after delay seconds, a hedge call alongside it.
+    Calls are zero-argument callables returning an attempt; is_success(attempt) picks the winner.
+    """
+
+    def __init__(self, enabled=HEDGE_ENABLED, max_rate=HEDGE_MAX_RATE, min_delay=HEDGE_MIN_DELAY_SECONDS,
+                 max_workers=2 * GEMINI_CONCURRENCY):
+        self.enabled = enabled
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-hedge") if enabled \
+            else None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "capped": 0, "saved_seconds": 0.0}
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.stats["hedged"] + 1 > self.max_rate * self.stats["calls"]:
+                self.stats["capped"] += 1
+                return False
+            self.stats["hedged"] += 1
+            return True
+
+    @staticmethod
+    def _timed(call):
+        def run():
+            result = call()
+            return result, time.monotonic()
+        return run
+
+    def _submit(self, call):
+        # On the pool thread the call still sees the caller's context variables (call log, field sink...)
+        return self._pool.submit(contextvars.copy_context().run, self._timed(call))
+
+    def call(self, primary, hedge_factory, delay, is_success, on_loser=None):
+        """
+        The winning attempt. hedge_factory() is only called when a hedge is due; it returns the
+        hedge callable, or None if there is no capacity for one right now. on_loser(attempt) is
+        called (possibly later, from another thread) with the attempt that did not win.
+        Both calls run in copies of the caller's contextvars context.
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+        if not self.enabled:
+            return primary()
+        primary_future = self._submit(primary)
+        done, _ = wait([primary_future], timeout=max(self.min_delay, delay))
+        if done or not self._may_hedge():
+            return primary_future.result()[0]
+        hedge = hedge_factory()
+        if hedge is None:
+            with self._lock:
+                self.stats["hedged"] -= 1
+            return primary_future.result()[0]
+        logger.info(f"Gemini call still pending after {delay:.1f}s; sending a hedge request")
+        hedge_future = self._submit(hedge)
+
+        pending = {primary_future, hedge_future}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if winner is None and is_success(future.result()[0]):
+                    winner = future
+        if winner is None:
+            # Both failed: report the primary's failure, as without a hedge
+            winner = primary_future
+        loser = hedge_future if winner is primary_future else primary_future
+        winner_attempt, winner_finished = winner.result()
+        if winner is hedge_future:
+            with self._lock:
+                self.stats["hedge_wins"] += 1
+
+        def settle_loser(future):
+            attempt, finished = future.result()
+            if winner is hedge_future:
+                with self._lock:
+                    self.stats["saved_seconds"] += max(0.0, finished - winner_finished)
+            if on_loser:
+                on_loser(attempt)
+
+        loser.add_done_callback(settle_loser)
+        return winner_attempt
+
+    def summary(self):
+        share = self.stats["hedged"] / self.stats["calls"] if self.stats["calls"] else 0.0
+        state = "on" if self.enabled else "off"
+        return (f"{state}, {self.stats['hedged']} of {self.stats['calls']} calls hedged ({share:.0%}), "
+                f"{self.stats['hedge_wins']} won by the hedge, {self.stats['capped']} held back by the cap, "
+                f"{self.stats['saved_seconds']:.1f}s of tail latency saved")
+
+
+GEMINI_HEDGER = Hedger()
@@ -0,0 +1,181 @@
+"""
+The process-wide HTTP session for Gemini traffic: one keep-alive connection pool shared by the
+synchronous calls, the concurrent workers, context-cache and batch requests, optionally over
+HTTP/2 (needs httpx with the http2 extra), and pre-warmed so the first documents do not pay
+the TLS handshake.
+"""
+import contextlib
+import logging
+import os
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+try:
+    import httpx
+except ImportError:  # optional: only needed for CUSDEC_HTTP2=1
+    httpx = None
+
+logger = logging.getLogger("cusdec_app")
+
+# Gemini requests in flight at once, across every session of this server process
+GEMINI_CONCURRENCY = max(1, int(os.getenv("CUSDEC_GEMINI_CONCURRENCY", "4")))
+# Kept-alive connections; a couple above the concurrency for cache/model-list/batch calls alongside
+HTTP_POOL_SIZE = max(1, int(os.getenv("CUSDEC_HTTP_POOL_SIZE", str(GEMINI_CONCURRENCY + 2))))
+# Connections opened at startup
+HTTP_PREWARM_CONNECTIONS = int(os.getenv("CUSDEC_HTTP_PREWARM", str(GEMINI_CONCURRENCY)))
+HTTP2_ENABLED = os.getenv("CUSDEC_HTTP2", "0") == "1"
+
+# TCP keep-alive probes so idle pooled connections are not silently dropped by middleboxes
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+for _name, _value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 15), ("TCP_KEEPCNT", 4)):
+    if hasattr(socket, _name):
+        KEEPALIVE_SOCKET_OPTIONS.append((socket.IPPROTO_TCP, getattr(socket, _name), _value))
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections have TCP keep-alive enabled."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = KEEPALIVE_SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def _requests_errors():
+    """Raise httpx transport errors as the requests exceptions callers catch."""
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        raise requests.exceptions.Timeout(str(e)) from e
+    except httpx.HTTPError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+
+class _Http2Response:
+    """
+    The parts of requests.Response the app uses, over an httpx response. A streamed response
+    is read only as iter_lines (or text/content) asks for it and must be closed, e.g. with `with`.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.http_version = response.http_version
+
+    def _read(self):
+        with _requests_errors():
+            return self._response.read()
+
+    @property
+    def content(self):
+        return self._read()
+
+    @property
+    def text(self):
+        self._read()
+        return self._response.text
+
+    @property
+    def encoding(self):
+        return self._response.encoding
+
+    @encoding.setter
+    def encoding(self, value):
+        self._response.encoding = value
+
+    def json(self):
+        self._read()
+        return self._response.json()
+
+    def iter_lines(self, chunk_size=None, decode_unicode=True):
+        with _requests_errors():
+            yield from self._response.iter_lines()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self._response.url}",
+                                                response=self)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Http2Session:
+    """
+    requests-style get/post over an httpx HTTP/2 client, so callers keep catching
+    requests.exceptions.RequestException. Many requests multiplex over few connections.
+    stream=True and (connect, read) timeouts behave as in requests.
+    """
+
+    def __init__(self, pool_size):
+        self._client = httpx.Client(http2=True, limits=httpx.Limits(max_connections=pool_size,
+                                                                     max_keepalive_connections=pool_size))
+
+    def request(self, method, url, data=None, stream=False, timeout=None, **kwargs):
+        if data is not None:
+            kwargs["content"] = data
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+        elif timeout is not None:
+            kwargs["timeout"] = timeout
+        with _requests_errors():
+            request = self._client.build_request(method, url, **kwargs)
+            return _Http2Response(self._client.send(request, stream=stream))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+def create_http_session(pool_size=HTTP_POOL_SIZE, http2=HTTP2_ENABLED):
+    """A pooled keep-alive session; HTTP/2 when asked for and httpx[http2] is installed."""
+    if http2:
+        if httpx is None:
+            logger.warning("CUSDEC_HTTP2=1 but httpx is not installed; using HTTP/1.1 keep-alive")
+        else:
+            return Http2Session(pool_size)
+    session = requests.Session()
+    adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def prewarm_http_session(session, url, connections=HTTP_PREWARM_CONNECTIONS, headers=None, timeout=10):
+    """
+    Open up to `connections` pooled connections to url's host in parallel (the response itself
+    does not matter, an auth error still leaves a warm TLS connection behind).
+    Returns the number of requests that completed.
+    """
+    completed = []
+
+    def warm():
+        try:
+            session.get(url, headers=headers, timeout=timeout)
+            completed.append(1)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Connection pre-warm to {url} failed: {e}")
+
+    threads = [threading.Thread(target=warm, daemon=True) for _ in range(max(0, connections))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout + 1)
+    return len(completed)
+
+
+HTTP_SESSION = create_http_session()
@@ -0,0 +1,99 @@
+"""
+Multi-page, multi-item extraction: stream every page of a declaration (first page and
+continuation sheets) and emit one record per goods item (Box 31/33/35/38).
+"""
+import logging
+import re
+
+from cusdec_pdf import iter_pages
+
+logger = logging.getLogger("cusdec_app")
+
+# Start of an item block, e.g. "32 Item No 3" or "Item No: 3"
+ITEM_START_RE = re.compile(r"^\s*(?:32\s*)?Item\s*No\.?\s*[:\-]?\s*(\d+)?", re.IGNORECASE)
+HS_CODE_RE = re.compile(r"\b(\d{4}\.\d{2}(?:\.\d{2})?|\d{8})\b")
+GROSS_MASS_RE = re.compile(r"Gross\s+Mass\s*\(Kg\)\s*:?\s*([\d,]+(?:\.\d+)?)", re.IGNORECASE)
+NET_MASS_RE = re.compile(r"Net\s+Mass\s*\(Kg\)\s*:?\s*([\d,]+(?:\.\d+)?)", re.IGNORECASE)
+DESCRIPTION_LABEL_RE = re.compile(r"(?:Packages and\s+)?description of goods|Description", re.IGNORECASE)
+
+# Cap on the description text kept per item
+MAX_DESCRIPTION_CHARS = 500
+
+item_column_order = [
+    "Source File",
+    "Page",
+    "Item No",
+    "Box 31: Description",
+    "Box 33: Commodity (HS) Code",
+    "Box 35: Gross Mass (Kg)",
+    "Box 38: Net Mass (Kg)",
+]
+
+
+def split_item_blocks(page_text):
+    """Split a page's text into [(item number or None, block lines)] at each item start line."""
+    blocks = []
+    current_no, current_lines = None, None
+    for line in page_text.splitlines():
+        match = ITEM_START_RE.match(line)
+        if match:
+            if current_lines is not None:
+                blocks.append((current_no, current_lines))
+            current_no, current_lines = match.group(1), []
+            continue
+        if current_lines is not None:
+            current_lines.append(line)
+    if current_lines is not None:
+        blocks.append((current_no, current_lines))
+    return blocks
+
+
+def parse_item_block(lines):
+    """Pull Box 31/33/35/38 values out of one item block; missing values are ""."""
+    block_text = "\n".join(lines)
+    hs_match = HS_CODE_RE.search(block_text)
+    gross_match = GROSS_MASS_RE.search(block_text)
+    net_match = NET_MASS_RE.search(block_text)
+    description_lines = []
+    in_description = False
+    for line in lines:
+        if DESCRIPTION_LABEL_RE.search(line):
+            in_description = True
+            remainder = DESCRIPTION_LABEL_RE.split(line, 1)[-1].strip(" :")
+            if remainder:
+                description_lines.append(remainder)
+            continue
+        if in_description:
+            if HS_CODE_RE.search(line) or GROSS_MASS_RE.search(line) or NET_MASS_RE.search(line):
+                break
+            if line.strip():
+                description_lines.append(line.strip())
+    return {
+        "Box 31: Description": " ".join(description_lines)[:MAX_DESCRIPTION_CHARS],
+        "Box 33: Commodity (HS) Code": hs_match.group(1) if hs_match else "",
+        "Box 35: Gross Mass (Kg)": gross_match.group(1) if gross_match else "",
+        "Box 38: Net Mass (Kg)": net_match.group(1) if net_match else "",
+    }
+
+
+def iter_item_records(file_bytes, filename):
+    """
+    Yield one record per goods item across every page of the PDF.
+    Pages without an item header but with item values count as a single item.
+    """
+    item_counter = 0
+    for page_number, index in iter_pages(file_bytes):
+        page_text = index.full_text()
+        del index
+        blocks = split_item_blocks(page_text)
+        if not blocks:
+            blocks = [(None, page_text.splitlines())]
+        for item_no, lines in blocks:
+            values = parse_item_block(lines)
+            if not any(values.values()):
+                continue
+            item_counter += 1
+            record = {"Source File": filename, "Page": page_number, "Item No": item_no or str(item_counter)}
+            record.update(values)
+            yield record
+    logger.debug(f"Extracted {item_counter} item records from {filename}")
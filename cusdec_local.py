@@ -0,0 +1,242 @@
+"""
+Local, deterministic field extraction for CUSDEC II first pages.
+
+Rules anchor on the fixed form labels, using the bbox region texts, the page text
+and the positioned words from the parse stage. Every field comes back with a
+confidence in [0, 1]; when all of them clear the threshold the document needs
+no Gemini call at all.
+"""
+import logging
+import os
+import re
+
+logger = logging.getLogger("cusdec_app")
+
+LOCAL_EXTRACTION_ENABLED = os.getenv("CUSDEC_LOCAL_EXTRACTION", "1") == "1"
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("CUSDEC_LOCAL_CONFIDENCE", "0.85"))
+# Send Gemini only the fields the local rules could not resolve (otherwise local results are
+# used only when every field resolves)
+HYBRID_EXTRACTION_ENABLED = os.getenv("CUSDEC_HYBRID_EXTRACTION", "1") == "1"
+
+# Confidence given by each kind of rule. Words near a label are only a guess (on the form the
+# value sits under its label, and the words beside it may be the next box's label) until a value
+# pattern confirms them.
+CONF_REGION_PATTERN = 0.95
+CONF_LABEL_PATTERN = 0.9
+CONF_LABEL_GEOMETRY = 0.6
+CONF_REGION_LOOSE = 0.6
+CONF_SAME_LINE_TEXT = 0.6
+
+# Words on the same line as a label are those whose top is within this many points
+SAME_LINE_TOLERANCE = 3
+# Only look this far (points) to the right of a label for its value
+RIGHT_OF_LABEL_REACH = 200
+# Values under a label: lines starting at most this far (points) below it, in its column. The
+# column starts a little left of the label, where the box number is printed.
+BELOW_LABEL_REACH = 30
+BOX_NUMBER_WIDTH = 20
+
+CODE_E_RE = re.compile(r"\b([A-Z]{4}\d)\b")
+DSN_RE = re.compile(r"\b((?:19|20)\d{2})\s*(#\s*\d+)")
+REF_NUMBER_RE = re.compile(r"\b([A-Z])\s+(\d{4,})\b")
+CURRENCY_AMOUNT_RE = re.compile(r"\b([A-Z]{3})\s*([\d,]+\.\d{2})\b")
+HS_CODE_DOTTED_RE = re.compile(r"\b(\d{4}\.\d{2}(?:\.\d{2})?)\b")
+HS_CODE_PLAIN_RE = re.compile(r"\b(\d{8})\b")
+NUMBER_RE = re.compile(r"^[\d,]+(?:\.\d+)?$")
+NUMBER_IN_TEXT_RE = re.compile(r"[\d,]*\d(?:\.\d+)?")
+
+COUNTRY_CODE_RE = re.compile(r"^[A-Z]{2}$")
+INCOTERM_RE = re.compile(r"^(?:EXW|FCA|FAS|FOB|CFR|CIF|CPT|CIP|DAP|DPU|DAT|DDP)\b")
+
+# Fields without a dedicated rule: take the words right of the label on the same line (or, without
+# positioned words, the text after the label on its line of the page text)
+SAME_LINE_LABELS = {
+    "Box 2: Exporter": "Exporter",
+    "Box 8: Consignee": "Consignee",
+    "Box 9: Person Responsible for Financial Settlement": "Person Responsible for Financial Settlement",
+    "Box 11: Trading": "Trading",
+    "Box 14: Declarant/Representative": "Declarant/Representative",
+    "Box 15: Country of Export": "Country of Export",
+    "Box 16: Country of origin": "Country of origin",
+    "Box 18: Vessel/Flight": "Vessel/Flight",
+    "Box 20: Delivery Terms": "Delivery Terms",
+    "Box 23: Exchange Rate": "Exchange Rate",
+    "Box 28: Financial and banking data": "Financial and banking data",
+    "Guarantee LKR": "Guarantee LKR",
+    "Box 31: Description": "Description",
+    "Marks & Nos of Packages": "Marks & Nos of Packages",
+    "Number & Kind": "Number & Kind",
+}
+
+# Same-line fields whose value has a recognisable shape; a value next to or under the label that
+# matches it is trusted. The others are free text, often over several lines, and are left to
+# Gemini whatever the rules find.
+SAME_LINE_PATTERNS = {
+    "Trading": COUNTRY_CODE_RE,
+    "Country of Export": COUNTRY_CODE_RE,
+    "Country of origin": COUNTRY_CODE_RE,
+    "Delivery Terms": INCOTERM_RE,
+    "Exchange Rate": NUMBER_RE,
+    "Guarantee LKR": NUMBER_RE,
+}
+
+
+def _field(value, confidence, rule):
+    return {"value": value, "confidence": confidence if value else 0.0, "rule": rule}
+
+
+def _text_after_label(document_text, label, reach=200):
+    pos = document_text.find(label)
+    return document_text[pos + len(label):pos + len(label) + reach] if pos >= 0 else ""
+
+
+def _find_label(words, label_tokens):
+    """(x0, top, x1, bottom) of the first occurrence of label_tokens in words, or None."""
+    count = len(label_tokens)
+    for i in range(len(words) - count + 1):
+        if all(words[i + k][0].rstrip(":") == label_tokens[k] for k in range(count)):
+            _, label_x0, label_top, _, _ = words[i]
+            _, _, _, label_x1, label_bottom = words[i + count - 1]
+            return label_x0, label_top, label_x1, label_bottom
+    return None
+
+
+def _words_right_of(words, label_tokens):
+    """Return the words on the same line right of the first occurrence of label_tokens."""
+    label = _find_label(words, label_tokens)
+    if label is None:
+        return []
+    _, label_top, label_x1, _ = label
+    return [w for w in words
+            if abs(w[2] - label_top) <= SAME_LINE_TOLERANCE and label_x1 < w[1] <= label_x1 + RIGHT_OF_LABEL_REACH]
+
+
+def _first_line_below(words, label_tokens):
+    """
+    Return the words of the first line under the label, in its column: from the box number left
+    of the label to the next word right of it on its line (the neighbouring box's label), if any.
+    """
+    label = _find_label(words, label_tokens)
+    if label is None:
+        return []
+    label_x0, _, _, label_bottom = label
+    column_end = min([w[1] for w in _words_right_of(words, label_tokens)], default=label_x0 + RIGHT_OF_LABEL_REACH)
+    below = [w for w in words if label_bottom <= w[2] <= label_bottom + BELOW_LABEL_REACH
+             and label_x0 - BOX_NUMBER_WIDTH <= w[1] < column_end]
+    if not below:
+        return []
+    first_top = min(w[2] for w in below)
+    return [w for w in below if w[2] - first_top <= SAME_LINE_TOLERANCE]
+
+
+def _joined(words):
+    return " ".join(w[0] for w in sorted(words, key=lambda w: w[1])).strip(" :")
+
+
+def _number_right_of(words, label_tokens, rule):
+    # Under the label first: the words right of it may start with the next box's number
+    for word in _first_line_below(words, label_tokens) + _words_right_of(words, label_tokens):
+        text = word[0].strip(":")
+        if NUMBER_RE.match(text):
+            return _field(text, CONF_LABEL_PATTERN, rule)
+    return _field("", 0.0, rule)
+
+
+def _region_number(region_text, rule):
+    numbers = NUMBER_IN_TEXT_RE.findall(region_text or "")
+    if len(numbers) == 1:
+        return _field(numbers[0], CONF_REGION_PATTERN, rule)
+    if numbers:
+        return _field(numbers[0], CONF_REGION_LOOSE, rule)
+    return _field("", 0.0, rule)
+
+
+def _code_e(parsed_page):
+    region = parsed_page["specific_box_texts"].get("Customs Reference Code E Value", "")
+    match = CODE_E_RE.search(region)
+    if match:
+        return _field(match.group(1), CONF_REGION_PATTERN, "region:code_e")
+    match = CODE_E_RE.search(_text_after_label(parsed_page["document_text"], "Customs Reference"))
+    return _field(match.group(1) if match else "", CONF_REGION_LOOSE, "text:code_e")
+
+
+def _customs_reference_number(parsed_page):
+    after = _text_after_label(parsed_page["document_text"], "Customs Reference", reach=300)
+    numbers = [f"{m.group(1)} {m.group(2)}" for m in REF_NUMBER_RE.finditer(after)]
+    return _field("\n".join(numbers), CONF_LABEL_PATTERN, "text:customs_reference")
+
+
+def _declarant_sequence(parsed_page):
+    region = parsed_page["specific_box_texts"].get("Declarant Sequence Number Value", "")
+    match = DSN_RE.search(region)
+    if match:
+        return _field(f"{match.group(1)} {match.group(2).replace(' ', '')}", CONF_REGION_PATTERN, "region:dsn")
+    match = DSN_RE.search(_text_after_label(parsed_page["document_text"], "Declarant"))
+    return _field(f"{match.group(1)} {match.group(2)}" if match else "", CONF_REGION_LOOSE, "text:dsn")
+
+
+def _box22(parsed_page):
+    for label in ("Total Amount Invoiced", "Currency"):
+        match = CURRENCY_AMOUNT_RE.search(_text_after_label(parsed_page["document_text"], label))
+        if match:
+            return _field(f"{match.group(1)} {match.group(2)}", CONF_LABEL_PATTERN, "text:box22")
+    return _field("", 0.0, "text:box22")
+
+
+def _box33(parsed_page):
+    after = _text_after_label(parsed_page["document_text"], "Commodity")
+    match = HS_CODE_DOTTED_RE.search(after)
+    if match:
+        return _field(match.group(1), CONF_LABEL_PATTERN, "text:hs_code")
+    match = HS_CODE_PLAIN_RE.search(after)
+    return _field(match.group(1) if match else "", CONF_REGION_LOOSE, "text:hs_code")
+
+
+def _same_line(parsed_page, label):
+    """
+    The value under the label, or failing that right of it. Only a value matching the field's
+    SAME_LINE_PATTERNS entry clears the threshold; anything else is a low-confidence guess.
+    """
+    words = parsed_page.get("words") or []
+    label_tokens = label.split()
+    pattern = SAME_LINE_PATTERNS.get(label)
+    right, below = _joined(_words_right_of(words, label_tokens)), _joined(_first_line_below(words, label_tokens))
+    if pattern is not None:
+        for value, where in ((below, "below"), (right, "right")):
+            if value and pattern.match(value):
+                return _field(value, CONF_LABEL_PATTERN, f"geometry:{label}:{where}")
+    if right or below:
+        return _field(below or right, CONF_LABEL_GEOMETRY, f"geometry:{label}")
+    for line in parsed_page["document_text"].splitlines():
+        pos = line.find(label)
+        if pos >= 0:
+            return _field(line[pos + len(label):].strip(" :"), CONF_SAME_LINE_TEXT, f"text:{label}")
+    return _field("", 0.0, f"text:{label}")
+
+
+def extract_fields_locally(parsed_page):
+    """
+    Return {display field name: {"value", "confidence", "rule"}} for every CUSDEC field.
+    parsed_page is the parse-stage result (document_text, specific_box_texts, words).
+    """
+    words = parsed_page.get("words") or []
+    boxes = parsed_page["specific_box_texts"]
+    fields = {
+        "Customs Reference Code E": _code_e(parsed_page),
+        "Customs Reference Number": _customs_reference_number(parsed_page),
+        "Declarant's Sequence Number": _declarant_sequence(parsed_page),
+        "Box 22: Currency & Total Amount Invoiced": _box22(parsed_page),
+        "Box 33: Commodity (HS) Code": _box33(parsed_page),
+        "Box 35: Gross Mass (Kg)": _number_right_of(words, ["Gross", "Mass"], "geometry:gross_mass"),
+        "Box 38: Net Mass (Kg)": _number_right_of(words, ["Net", "Mass"], "geometry:net_mass"),
+        "D.Val": _region_number(boxes.get("D.Val Value", ""), "region:d_val"),
+        "D.Qty": _region_number(boxes.get("D.Qty Value", ""), "region:d_qty"),
+    }
+    for display_name, label in SAME_LINE_LABELS.items():
+        fields[display_name] = _same_line(parsed_page, label)
+    return fields
+
+
+def confident_fields(local_fields, threshold=LOCAL_CONFIDENCE_THRESHOLD):
+    """Return {display name: value} for the fields that clear the confidence threshold."""
+    return {name: field["value"] for name, field in local_fields.items() if field["confidence"] >= threshold}
@@ -0,0 +1,317 @@
+"""
+PDF parsing helpers for the CUSDEC II extractor.
+
+Nothing in here touches Streamlit, so the same code can run off the UI thread.
+"""
+import io
+import json
+import logging
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import pdfplumber
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1
+from pdfplumber.page import Page
+from pdfplumber.utils import extract_text as extract_text_from_chars
+from pdfplumber.utils import clip_obj, extract_words
+
+from cusdec_cache import TwoTierCache, sha256_hex
+from cusdec_templates import TEMPLATE_STORE, find_anchor_positions, fingerprint
+
+logger = logging.getLogger("cusdec_app")
+
+# Custom bbox for additional fields (can be adjusted as needed)
+SPECIFIC_BOX_COORDS = {
+    "Customs Reference Code E Value": (600, 40, 680, 60),
+    "Declarant Sequence Number Value": (650, 110, 800, 130),
+    "Box 11 Value": (170, 100, 250, 130),
+    "Box 31 Description Value": (550, 300, 800, 450),
+    "Box 31 Full Text": (400, 280, 800, 480),
+    "D.Val Value": (450, 500, 550, 530),
+    "D.Qty Value": (580, 500, 680, 530),
+}
+
+# Bump when the parse output changes shape; the bbox set is hashed into the cache key as well
+PARSE_CACHE_VERSION = 3
+# Change CUSDEC_TEMPLATE_BASELINE to drop the calibrated template bbox sets and start over
+TEMPLATE_BASELINE = os.getenv("CUSDEC_TEMPLATE_BASELINE", "1")
+BBOX_SET_VERSION = sha256_hex(json.dumps(SPECIFIC_BOX_COORDS, sort_keys=True), TEMPLATE_BASELINE)[:12]
+
+# Parsed pages keyed by content hash, so re-uploads and recaptures skip pdfplumber entirely
+PARSE_CACHE = TwoTierCache(
+    "parsed_pages",
+    max_memory_bytes=int(os.getenv("CUSDEC_PARSE_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+    max_disk_bytes=int(os.getenv("CUSDEC_PARSE_CACHE_DISK_MB", "512")) * 1024 * 1024,
+)
+
+# Grid cell size (in PDF points) of the character index
+CHAR_INDEX_CELL_SIZE = 50
+
+# Resolve only page 1 of the page tree instead of building every page object
+LAZY_FIRST_PAGE_OPEN = os.getenv("CUSDEC_LAZY_OPEN", "1") == "1"
+
+# Number of parsing worker processes (0 parses inline on the calling thread)
+PARSE_WORKERS = int(os.getenv("CUSDEC_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+class CharIndex:
+    """
+    Grid index over the characters of one page, keyed on char x0/top.
+    Built in a single pass so the full-page text and every region text
+    come from the same character list instead of re-running layout analysis.
+    """
+
+    def __init__(self, chars, page_bbox, cell_size=CHAR_INDEX_CELL_SIZE):
+        self.chars = list(chars)
+        self.page_bbox = tuple(page_bbox)
+        self.cell_size = cell_size
+        self.cells = {}
+        for idx, char in enumerate(self.chars):
+            for cell in self._cells_for(char["x0"], char["top"], char["x1"], char["bottom"]):
+                self.cells.setdefault(cell, []).append(idx)
+
+    def _cells_for(self, x0, top, x1, bottom):
+        size = self.cell_size
+        for col in range(int(x0 // size), int(x1 // size) + 1):
+            for row in range(int(top // size), int(bottom // size) + 1):
+                yield col, row
+
+    def validate_bbox(self, bbox):
+        """Raise ValueError unless bbox is a non-empty box inside the page, as page.crop() would."""
+        x0, top, x1, bottom = bbox
+        if x0 >= x1 or top >= bottom:
+            raise ValueError(f"Bounding box {bbox} has no area.")
+        px0, ptop, px1, pbottom = self.page_bbox
+        if x0 < px0 or top < ptop or x1 > px1 or bottom > pbottom:
+            raise ValueError(f"Bounding box {bbox} is not fully within page bounding box {self.page_bbox}.")
+
+    def chars_in(self, bbox):
+        """
+        Return the chars a page.crop(bbox) would keep, in page order and clipped to bbox as crop
+        clips them. Like crop, a char that only touches bbox along an edge is kept.
+        """
+        self.validate_bbox(bbox)
+        x0, top, x1, bottom = bbox
+        candidates = set()
+        for cell in self._cells_for(x0, top, x1, bottom):
+            candidates.update(self.cells.get(cell, ()))
+        return [clipped for clipped in (clip_obj(self.chars[idx], bbox) for idx in sorted(candidates))
+                if clipped is not None]
+
+    def words(self):
+        """Positioned words as [text, x0, top, x1, bottom] lists (compact and JSON-friendly)."""
+        return [[w["text"], round(w["x0"], 1), round(w["top"], 1), round(w["x1"], 1), round(w["bottom"], 1)]
+                for w in extract_words(self.chars)]
+
+    def full_text(self):
+        return extract_text_from_chars(self.chars) or ""
+
+    def region_text(self, bbox):
+        """The text page.crop(bbox).extract_text() would return."""
+        return extract_text_from_chars(self.chars_in(bbox)) or ""
+
+
+def extract_region_texts(index, box_coords=None):
+    """Return {box_name: stripped text} for every bbox, "" for regions that cannot be cropped."""
+    box_coords = SPECIFIC_BOX_COORDS if box_coords is None else box_coords
+    region_texts = {}
+    for box_name, bbox in box_coords.items():
+        try:
+            region_texts[box_name] = index.region_text(bbox).strip()
+        except ValueError as e:
+            logger.warning(f"Region '{box_name}' skipped: {e}")
+            region_texts[box_name] = ""
+    return region_texts
+
+
+@contextmanager
+def _open_pdf(file_bytes):
+    """
+    pdfplumber.open for callers that build their own Page objects. PDF.close() goes through
+    pdf.pages, constructing a Page for every page of the document just to close it, so on
+    exit only the document caches are flushed (the in-memory stream needs no closing).
+    """
+    pdf = pdfplumber.open(io.BytesIO(file_bytes))
+    try:
+        yield pdf
+    finally:
+        pdf.flush_cache()
+
+
+@contextmanager
+def open_first_page(file_bytes, lazy=None):
+    """
+    Open a PDF and yield (page, page_count) for its first page, or (None, 0) if it has none.
+
+    The lazy path walks the page tree depth-first and stops at the first leaf, so
+    only page 1 and its inherited resources are resolved, on open and on close;
+    page_count then comes from the root /Count entry (None if the tree does not
+    carry one). The full path goes through pdf.pages, which builds a Page object
+    for every page.
+    """
+    lazy = LAZY_FIRST_PAGE_OPEN if lazy is None else lazy
+    if not lazy:
+        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+            if len(pdf.pages) == 0:
+                yield None, 0
+            else:
+                yield pdf.pages[0], len(pdf.pages)
+        return
+    with _open_pdf(file_bytes) as pdf:
+        page_obj = next(PDFPage.create_pages(pdf.doc), None)
+        if page_obj is None:
+            yield None, 0
+            return
+        page_count = resolve1(pdf.doc.catalog.get("Pages"))
+        page_count = resolve1(page_count.get("Count")) if isinstance(page_count, dict) else None
+        page = Page(pdf, page_obj, page_number=1, initial_doctop=0)
+        try:
+            yield page, page_count
+        finally:
+            page.close()
+
+
+def _release_document_caches(doc):
+    """Drop pdfminer's resolved-object caches so decoded content streams of finished pages can be freed."""
+    for cache_name in ("_cached_objs", "_parsed_objs"):
+        cache = getattr(doc, cache_name, None)
+        if isinstance(cache, dict):
+            cache.clear()
+
+
+def iter_pages(file_bytes):
+    """
+    Stream a PDF page by page, yielding (page_number, CharIndex).
+    Only one page object is alive at a time and pdfminer's object caches are
+    cleared between pages, so memory stays bounded regardless of page count.
+    """
+    with _open_pdf(file_bytes) as pdf:
+        doctop = 0
+        for page_number, page_obj in enumerate(PDFPage.create_pages(pdf.doc), start=1):
+            page = Page(pdf, page_obj, page_number=page_number, initial_doctop=doctop)
+            doctop += page.height
+            index = CharIndex(page.chars, page.bbox)
+            page.flush_cache()
+            del page, page_obj
+            yield page_number, index
+            _release_document_caches(pdf.doc)
+
+
+def classify_page(index, page_size):
+    """Return (template fingerprint, bbox set, settled) for an indexed page; see TemplateStore.bbox_set_for."""
+    anchors = find_anchor_positions(index.chars)
+    template_id = fingerprint(anchors, page_size)
+    bbox_set, settled = TEMPLATE_STORE.bbox_set_for(template_id, anchors, index.page_bbox,
+                                                    SPECIFIC_BOX_COORDS, BBOX_SET_VERSION)
+    return template_id, bbox_set, settled
+
+
+def parse_first_page(file_bytes, box_coords=None, lazy=None):
+    """
+    Parse the first page of a PDF once and return its full text and region texts.
+    Unless box_coords is given, the regions come from the calibrated bbox set of the
+    page's layout template. Returns None if the PDF has no pages. Any parsing error
+    is raised to the caller.
+    """
+    with open_first_page(file_bytes, lazy) as (page, page_count):
+        if page is None:
+            return None
+        index = CharIndex(page.chars, page.bbox)
+        template_id, settled = None, True
+        if box_coords is None:
+            template_id, box_coords, settled = classify_page(index, (page.width, page.height))
+        return {
+            "document_text": index.full_text(),
+            "specific_box_texts": extract_region_texts(index, box_coords),
+            "words": index.words(),
+            "page_meta": {
+                "page_count": page_count,
+                "width": float(page.width),
+                "height": float(page.height),
+                "char_count": len(index.chars),
+                "template": template_id,
+                # Regions taken before the layout's calibration existed; not worth caching
+                "provisional": not settled,
+            },
+        }
+
+
+def parse_pdf_job(filename, file_bytes):
+    """
+    Parse one uploaded file. Used both inline and as the process-pool entry point,
+    so errors come back as {"error": ...} and the result is always picklable.
+    """
+    try:
+        parsed_page = parse_first_page(file_bytes)
+    except Exception as e:
+        tb = traceback.format_exc()
+        return {"error": f"Error extracting page from PDF ({filename}): {e}\n{tb}"}
+    if parsed_page is None:
+        return {"error": f"PDF file {filename} contains no pages."}
+    return parsed_page
+
+
+def parse_cache_key(file_bytes):
+    return sha256_hex(file_bytes, BBOX_SET_VERSION, PARSE_CACHE_VERSION)
+
+
+def get_parsed_page(filename, file_bytes, future=None):
+    """
+    Return the parsed first page for file_bytes, from the cache when possible.
+    On a miss the result of future (a pending parse_pdf_job) is used, or the file
+    is parsed inline. Only successful parses with settled regions are cached, so a page
+    parsed before its layout could be calibrated is parsed again once it can.
+    """
+    key = parse_cache_key(file_bytes)
+    parsed_page = PARSE_CACHE.get(key)
+    if parsed_page is not None:
+        logger.debug(f"Parse cache hit for {filename}")
+        return parsed_page
+    parsed_page = future.result() if future is not None else parse_pdf_job(filename, file_bytes)
+    if "error" not in parsed_page and not parsed_page["page_meta"].get("provisional"):
+        PARSE_CACHE.put(key, parsed_page)
+    return parsed_page
+
+
+def _warm_parse_worker():
+    """Pool initializer: pull in the pdfminer layout machinery before the first job arrives."""
+    import pdfminer.layout  # noqa: F401
+    import pdfminer.pdfinterp  # noqa: F401
+    import pdfplumber.page  # noqa: F401
+
+
+def start_parse_pool(max_workers=PARSE_WORKERS):
+    """
+    Start a pre-warmed process pool for PDF parsing, or return None when parsing
+    should stay inline. The server is multi-threaded by the time the pool is started
+    (Tornado, session and pre-warm threads), and a child forked from it can inherit a
+    lock another thread held (a logging handler's, say) and hang on it. So workers come
+    from a forkserver: a clean single-threaded process that has imported only this
+    module, which is safe to import anywhere. Platforms without forkserver parse inline.
+    """
+    if max_workers <= 0 or "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=_warm_parse_worker)
+    # Submit one no-op per worker so the processes are up before real work arrives
+    for future in [pool.submit(int) for _ in range(max_workers)]:
+        future.result()
+    logger.info(f"Started PDF parse pool with {max_workers} workers")
+    return pool
+
+
+def submit_parse_jobs(pool, files):
+    """
+    Queue every (filename, file_bytes) pair that is not already cached on the pool and
+    return {filename: future}. The caller consumes results in its own order while later
+    files are still parsing.
+    """
+    if pool is None:
+        return {}
+    return {filename: pool.submit(parse_pdf_job, filename, file_bytes) for filename, file_bytes in files
+            if not PARSE_CACHE.contains(parse_cache_key(file_bytes))}
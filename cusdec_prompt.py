@@ -0,0 +1,364 @@
+"""
+Prompt-side helpers for the Gemini extraction call: the field map, the structured-output
+schema, and decoding of both JSON and "FieldName: FieldValue" replies.
+"""
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger("cusdec_app")
+
+# Ask Gemini for a JSON object (responseMimeType/responseSchema) instead of "FieldName: FieldValue" lines
+JSON_OUTPUT_ENABLED = os.getenv("CUSDEC_JSON_OUTPUT", "1") == "1"
+
+NOT_FOUND = "Not Found"
+
+# Bump whenever the prompt layout, the field instructions or the reply decoding change meaning;
+# it is part of the response-cache key, so replies to older prompts are no longer reused
+PROMPT_TEMPLATE_VERSION = 1
+
+# Map for field extraction: key used in prompts/schemas -> display name used in records
+COMMON_FIELDS_MAP = {
+    "Customs Reference Code E": "Customs Reference Code E",
+    "Customs Reference Number": "Customs Reference Number",
+    "Declarant Sequence Number": "Declarant's Sequence Number",
+    "Box 2": "Box 2: Exporter",
+    "Box 8": "Box 8: Consignee",
+    "Box 9": "Box 9: Person Responsible for Financial Settlement",
+    "Box 11": "Box 11: Trading",
+    "Box 14": "Box 14: Declarant/Representative",
+    "Box 15": "Box 15: Country of Export",
+    "Box 16": "Box 16: Country of origin",
+    "Box 18": "Box 18: Vessel/Flight",
+    "Box 20": "Box 20: Delivery Terms",
+    "Box 22": "Box 22: Currency & Total Amount Invoiced",
+    "Box 23": "Box 23: Exchange Rate",
+    "Box 28": "Box 28: Financial and banking data",
+    "Guarantee LKR": "Guarantee LKR",
+    "Box 31": "Box 31: Description",
+    "Marks & Nos of Packages": "Marks & Nos of Packages",
+    "Number & Kind": "Number & Kind",
+    # "Description": "Description",
+    "Box 33": "Box 33: Commodity (HS) Code",
+    "Box 35": "Box 35: Gross Mass (Kg)",
+    "Box 38": "Box 38: Net Mass (Kg)",
+    "D.Val": "D.Val",
+    "D.Qty": "D.Qty",
+}
+
+# Printed form labels near which each field's value sits, used to rank page lines for the prompt
+FIELD_LABELS = {
+    "Customs Reference Code E": ["Customs Reference"],
+    "Customs Reference Number": ["Customs Reference"],
+    "Declarant's Sequence Number": ["Declarant's Sequence", "Sequence Number"],
+    "Box 2: Exporter": ["Exporter"],
+    "Box 8: Consignee": ["Consignee"],
+    "Box 9: Person Responsible for Financial Settlement": ["Person Responsible", "Financial Settlement"],
+    "Box 11: Trading": ["Trading"],
+    "Box 14: Declarant/Representative": ["Declarant/Representative", "Representative"],
+    "Box 15: Country of Export": ["Country of Export"],
+    "Box 16: Country of origin": ["Country of origin"],
+    "Box 18: Vessel/Flight": ["Vessel", "Flight"],
+    "Box 20: Delivery Terms": ["Delivery Terms"],
+    "Box 22: Currency & Total Amount Invoiced": ["Total Amount Invoiced", "Currency"],
+    "Box 23: Exchange Rate": ["Exchange Rate"],
+    "Box 28: Financial and banking data": ["Financial and banking", "banking data"],
+    "Guarantee LKR": ["Guarantee"],
+    "Box 31: Description": ["Description", "Packages and description"],
+    "Marks & Nos of Packages": ["Marks & Nos"],
+    "Number & Kind": ["Number & Kind"],
+    "Box 33: Commodity (HS) Code": ["Commodity", "HS Code"],
+    "Box 35: Gross Mass (Kg)": ["Gross Mass"],
+    "Box 38: Net Mass (Kg)": ["Net Mass"],
+    "D.Val": ["D.Val"],
+    "D.Qty": ["D.Qty"],
+}
+
+# Token budget for the document text part of the prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("CUSDEC_PROMPT_TOKEN_BUDGET", "1000"))
+# Rough characters-per-token ratio for Gemini on English/numeric text
+CHARS_PER_TOKEN = 4
+# Lines shorter than this are never dropped as "already covered" (too likely to be coincidental)
+MIN_COVERED_LINE_CHARS = 4
+
+LAYOUT_WHITESPACE_RE = re.compile(r"[ \t\u00a0]{2,}")
+
+# Documents packed into one Gemini request (1 = one request per document)
+PACKED_DOCUMENTS_PER_REQUEST = int(os.getenv("CUSDEC_PACK_SIZE", "1"))
+
+PACKED_SECTION_HEADER_RE = re.compile(r"^\s*#{2,}\s*(doc\d+)\s*#*\s*$", re.MULTILINE)
+
+# Field-specific extraction hints: (fields they apply to, instruction)
+FIELD_INSTRUCTIONS = [
+    (["Customs Reference Code E"],
+     "For 'Customs Reference Code E', use the text provided from its approximate region (e.g., CBBE1)."),
+    (["Customs Reference Number"],
+     "For 'Customs Reference Number', extract all reference numbers (e.g., E 72766, E 76315, etc.) and keep the original lines."),
+    (["Declarant's Sequence Number"],
+     "For 'Declarant's Sequence Number', use the text provided from its approximate region (e.g., 2024 #3041)."),
+    (["Marks & Nos of Packages", "Number & Kind", "Box 31: Description"],
+     "For 'Marks & Nos of Packages', 'Number & Kind', and 'Description', extract the relevant text block under Box 31 and split according to the sublabels."),
+]
+
+# Leading bullet points or list markers (-, *, •, etc.) on a reply line
+BULLET_RE = re.compile(r"^[-*•]\s*")
+
+
+def normalize_label(label):
+    """Case- and whitespace-insensitive form of a field label, used as the alias-lookup key."""
+    return " ".join(label.split()).casefold()
+
+
+def _prefix_pattern(alias, display_name):
+    """
+    One compiled pattern for every label prefix a value may repeat ("Box 2:", "Exporter ", ...),
+    longest alternative first so the longest prefix is the one stripped.
+    """
+    prefixes = set()
+    for label in (alias, display_name):
+        for part in [label] + [p for p in re.split(r"[:\s]+", label) if p]:
+            prefixes.update([f"{part}:", f"{part} :", f"{part} "])
+    ordered = sorted(prefixes, key=len, reverse=True)
+    return re.compile("|".join(re.escape(prefix) for prefix in ordered), re.IGNORECASE)
+
+
+def build_line_parser(fields_map):
+    """Alias table {normalized key or display name: (display name, prefix pattern)}, built once."""
+    parser = {}
+    for key, display_name in fields_map.items():
+        for alias in (key, display_name):
+            parser.setdefault(normalize_label(alias), (display_name, _prefix_pattern(alias, display_name)))
+    return parser
+
+
+LINE_PARSER = build_line_parser(COMMON_FIELDS_MAP)
+
+
+def parse_field_lines(text, parser=LINE_PARSER):
+    """Parse "FieldName: FieldValue" reply lines into {display name: value} in one pass."""
+    parsed = {}
+    for line in text.strip().split("\n"):
+        line = BULLET_RE.sub("", line.strip())
+        name, sep, value = line.partition(": ")
+        if not sep:
+            continue
+        entry = parser.get(normalize_label(name))
+        if entry is None:
+            continue
+        display_name, prefix_re = entry
+        value = value.strip()
+        match = prefix_re.match(value)
+        if match:
+            value = value[match.end():].strip()
+        parsed[display_name] = value
+    return parsed
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (no tokenizer round-trip): ~4 characters per token."""
+    return -(-len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def compact_document_text(document_text, fields, covered_snippets=(), token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Shrink the page text sent to Gemini to token_budget:
+      1. collapse layout whitespace and drop blank lines,
+      2. drop lines already contained in the region snippets sent alongside,
+      3. keep lines in order of their distance (in lines) from a label of one of `fields`,
+         until the budget is full, then restore page order.
+    Returns (compacted text, stats dict with tokens before/after/saved).
+    """
+    tokens_before = estimate_tokens(document_text)
+    lines = [LAYOUT_WHITESPACE_RE.sub(" ", line).strip() for line in document_text.splitlines()]
+    lines = [line for line in lines if line]
+
+    covered = " ".join(LAYOUT_WHITESPACE_RE.sub(" ", snippet) for snippet in covered_snippets if snippet)
+    kept = [line for line in lines if len(line) < MIN_COVERED_LINE_CHARS or line not in covered]
+    duplicate_lines = len(lines) - len(kept)
+
+    labels = [label.casefold() for name in fields for label in FIELD_LABELS.get(name, [])]
+    label_rows = [row for row, line in enumerate(kept) if any(label in line.casefold() for label in labels)]
+    if label_rows:
+        distance = [min(abs(row - label_row) for label_row in label_rows) for row in range(len(kept))]
+    else:
+        distance = [0] * len(kept)
+
+    selected = set()
+    used_tokens = 0
+    for row in sorted(range(len(kept)), key=lambda r: (distance[r], r)):
+        cost = estimate_tokens(kept[row]) + 1  # + newline
+        if used_tokens + cost > token_budget:
+            continue
+        selected.add(row)
+        used_tokens += cost
+    compacted = "\n".join(kept[row] for row in sorted(selected))
+
+    tokens_after = estimate_tokens(compacted)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "duplicate_lines_dropped": duplicate_lines,
+        "lines_over_budget": len(kept) - len(selected),
+    }
+    return compacted, stats
+
+
+def build_instruction(fields=None):
+    """
+    The instruction block of the extraction prompt. With fields=None it covers every field and is
+    identical for every document, so it can go into systemInstruction or a cached context; with a
+    list of display names only their hints and names are included.
+    """
+    if fields is None:
+        fields = list(COMMON_FIELDS_MAP.values())
+    field_instructions_prompt = "\n".join(
+        instruction for related_fields, instruction in FIELD_INSTRUCTIONS
+        if any(name in fields for name in related_fields))
+    fields_to_extract_prompt = "\n".join(f"- {name}" for name in fields)
+    if JSON_OUTPUT_ENABLED:
+        output_format_prompt = ("Return a single JSON object matching the response schema. "
+                                "Each property's description is the FieldName it holds.")
+    else:
+        output_format_prompt = 'Return fields in "FieldName: FieldValue" format. Use FieldName exactly as specified below.'
+    return f"""Analyze the following text from the first page of a SRI LANKA CUSTOMS-GOODS DECLARATION (CUSDEC II) document.
+Extract the following specific fields. For each field, look for the associated label and extract the value next to it.
+{field_instructions_prompt}
+{output_format_prompt}
+Common Fields to Extract:
+{fields_to_extract_prompt}
+If a field is not found, indicate '{NOT_FOUND}'."""
+
+
+def build_document_prompt(specific_text_prompt, document_text, fields=None):
+    """
+    Per-document part of the prompt, sent after the instruction block. fields lists the
+    subset asked for when the instruction block covers every field.
+    """
+    fields_prompt = ""
+    if fields is not None:
+        fields_prompt = "Extract only these fields from this document:\n" + "\n".join(f"- {name}" for name in fields) + "\n"
+    return f"""{specific_text_prompt}
+{fields_prompt}Document text:
+{document_text}"""
+
+
+def build_packed_prompt(sections):
+    """
+    Several documents in one prompt. sections is [(doc id, region snippet text, page text, fields)];
+    each document sits between its own delimiters and lists the fields asked of it.
+    """
+    doc_ids = ", ".join(doc_id for doc_id, _, _, _ in sections)
+    if JSON_OUTPUT_ENABLED:
+        answer_format = "Return one JSON object with one property per document id, each holding that document's fields."
+    else:
+        answer_format = ("Start each document's answer with a line \"### <document id>\" followed by its "
+                         "\"FieldName: FieldValue\" lines.")
+    parts = [f"This request contains {len(sections)} separate CUSDEC II documents ({doc_ids}). "
+             f"Extract each document's fields only from its own section. {answer_format}"]
+    for doc_id, specific_text_prompt, document_text, fields in sections:
+        parts.append(f"<<<BEGIN {doc_id}>>>\n"
+                     f"{build_document_prompt(specific_text_prompt, document_text, fields)}\n"
+                     f"<<<END {doc_id}>>>")
+    return "\n".join(parts)
+
+
+def build_packed_response_schema(doc_fields):
+    """
+    Response schema keyed by document id: {doc id: {field-map key: display name}} ->
+    (schema, {doc id: {property name: display name}}).
+    """
+    properties = {}
+    property_maps = {}
+    for doc_id, fields in doc_fields.items():
+        properties[doc_id], property_maps[doc_id] = build_response_schema(fields)
+    schema = {
+        "type": "OBJECT",
+        "properties": properties,
+        "required": list(properties),
+        "propertyOrdering": list(properties),
+    }
+    return schema, property_maps
+
+
+def decode_packed_response(text, property_maps):
+    """
+    Decode a packed JSON reply into {doc id: {display name: value} or None}; None marks a
+    document whose section is missing or malformed.
+    """
+    try:
+        payload = json.loads(text)
+    except (TypeError, ValueError):
+        payload = None
+    if not isinstance(payload, dict):
+        return {doc_id: None for doc_id in property_maps}
+    decoded = {}
+    for doc_id, property_to_display in property_maps.items():
+        section = payload.get(doc_id)
+        decoded[doc_id] = _decode_properties(section, property_to_display) if isinstance(section, dict) else None
+    return decoded
+
+
+def split_packed_text_reply(text, doc_ids):
+    """Split a packed "FieldName: FieldValue" reply at its "### doc id" lines: {doc id: section text or None}."""
+    sections = dict.fromkeys(doc_ids)
+    headers = list(PACKED_SECTION_HEADER_RE.finditer(text or ""))
+    for idx, header in enumerate(headers):
+        end = headers[idx + 1].start() if idx + 1 < len(headers) else len(text)
+        if header.group(1) in sections:
+            sections[header.group(1)] = text[header.end():end].strip()
+    return sections
+
+
+def schema_key(field_key):
+    """Field-map key -> identifier-safe JSON property name, e.g. "Marks & Nos of Packages" -> "Marks_Nos_of_Packages"."""
+    return re.sub(r"[^A-Za-z0-9]+", "_", field_key).strip("_")
+
+
+def build_response_schema(fields):
+    """
+    Build a Gemini responseSchema for {field-map key: display name}.
+    Returns (schema, {property name: display name}).
+    """
+    properties = {}
+    property_to_display = {}
+    for field_key, display_name in fields.items():
+        name = schema_key(field_key)
+        properties[name] = {"type": "STRING", "description": display_name}
+        property_to_display[name] = display_name
+    schema = {
+        "type": "OBJECT",
+        "properties": properties,
+        "required": list(properties),
+        "propertyOrdering": list(properties),
+    }
+    return schema, property_to_display
+
+
+def json_generation_config(schema):
+    return {"responseMimeType": "application/json", "responseSchema": schema}
+
+
+def decode_json_response(text, property_to_display):
+    """
+    Decode a structured reply in one parse. Returns {display name: value}, or None when the
+    text is not a JSON object (the caller then falls back to line parsing).
+    """
+    try:
+        payload = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    return _decode_properties(payload, property_to_display)
+
+
+def _decode_properties(payload, property_to_display):
+    decoded = {}
+    for name, value in payload.items():
+        display_name = property_to_display.get(name)
+        if display_name is None or value is None:
+            continue
+        decoded[display_name] = value.strip() if isinstance(value, str) else json.dumps(value)
+    return decoded
@@ -0,0 +1,131 @@
+"""
+Client-side throttling for Gemini quotas: one token bucket for requests per minute and one for
+input tokens per minute. Calls wait exactly as long as the buckets require before going out,
+instead of going out and coming back with a 429.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("cusdec_app")
+
+# Quotas of the key's tier, e.g. 10 and 250000 on the free tier of gemini-2.5-flash. Unset or 0 disables
+# that bucket: paid tiers allow far more, and a 429 still makes the retry loop back off
+GEMINI_RPM_LIMIT = int(os.getenv("CUSDEC_GEMINI_RPM", "0"))
+GEMINI_TPM_LIMIT = int(os.getenv("CUSDEC_GEMINI_TPM", "0"))
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at capacity per minute. Takers reserve immediately and may drive
+    the level negative; each is told how long to wait for its reservation to be covered, so
+    concurrent callers queue up fairly instead of polling.
+    """
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount):
+        """Take amount now; returns the seconds to wait before it is actually available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            # A single request larger than the whole bucket only has to wait for a full bucket
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def try_reserve(self, amount):
+        """Take amount only if it is available right now."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.level < min(amount, self.capacity):
+                return False
+            self.level -= min(amount, self.capacity)
+            return True
+
+    def adjust(self, amount):
+        """Give back (amount < 0) or charge extra (amount > 0) after the real cost is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+    def drain(self):
+        """The server says the quota is used up: start refilling from empty."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.level, 0.0)
+
+
+class GeminiRateLimiter:
+    """RPM and TPM buckets in front of generateContent, shared by every thread and session."""
+
+    def __init__(self, rpm=GEMINI_RPM_LIMIT, tpm=GEMINI_TPM_LIMIT):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "waits": 0, "wait_seconds": 0.0, "throttled_by_server": 0}
+
+    def acquire(self, estimated_tokens):
+        """Block until one request of estimated_tokens input tokens fits both quotas."""
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        with self._lock:
+            self.stats["calls"] += 1
+            if wait > 0:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += wait
+        if wait > 0:
+            logger.debug(f"Rate limiter: waiting {wait:.2f}s before the next Gemini call")
+            time.sleep(wait)
+
+    def try_acquire(self, estimated_tokens):
+        """Take quota for one request only if neither bucket would make it wait (for optional requests)."""
+        if self.requests and not self.requests.try_reserve(1):
+            return False
+        if self.tokens and not self.tokens.try_reserve(estimated_tokens):
+            if self.requests:
+                self.requests.adjust(-1)
+            return False
+        with self._lock:
+            self.stats["calls"] += 1
+        return True
+
+    def settle(self, estimated_tokens, usage_metadata):
+        """Correct the TPM bucket with the prompt token count the response reports."""
+        if not self.tokens or not usage_metadata:
+            return
+        actual = usage_metadata.get("promptTokenCount")
+        if actual is not None:
+            self.tokens.adjust(actual - estimated_tokens)
+
+    def throttled(self):
+        """A 429 got through anyway (other clients share the quota): empty both buckets."""
+        with self._lock:
+            self.stats["throttled_by_server"] += 1
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                bucket.drain()
+
+    def limits(self):
+        """The configured quotas, e.g. "10 requests/min, 250000 input tokens/min"."""
+        limits = [f"{bucket.capacity:.0f} {unit}/min" for bucket, unit in
+                  ((self.requests, "requests"), (self.tokens, "input tokens")) if bucket]
+        return ", ".join(limits) or "no limit"
+
+    def summary(self):
+        return (f"{self.stats['calls']} calls, {self.stats['waits']} waited "
+                f"({self.stats['wait_seconds']:.1f}s total), {self.stats['throttled_by_server']} server 429s")
+
+
+GEMINI_RATE_LIMITER = GeminiRateLimiter()
@@ -0,0 +1,185 @@
+"""
+Retry policy for Gemini calls: waits guided by the server (Retry-After, RetryInfo.retryDelay)
+with jittered exponential backoff otherwise, a retry budget shared by all requests of one run,
+and a circuit breaker that stops every caller from sleeping through backoff during an outage.
+"""
+import contextvars
+import email.utils
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger("cusdec_app")
+
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("CUSDEC_RETRY_BASE_DELAY", "2"))
+# Never sleep longer than this for one retry; a longer server hint (e.g. daily quota) fails the call instead
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("CUSDEC_RETRY_MAX_DELAY", "60"))
+# Retries allowed per run: this fraction of its requests, but at least RETRY_BUDGET_MIN
+RETRY_BUDGET_RATIO = float(os.getenv("CUSDEC_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = 10
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CUSDEC_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CUSDEC_CIRCUIT_RESET_SECONDS", "30"))
+# A half-open probe that has not reported back after this long (its caller died on an uncaught
+# error) is written off and the next caller probes instead; longer than any one request may take
+CIRCUIT_PROBE_TIMEOUT_SECONDS = 120
+# Requests refused while the circuit is open are re-queued this many times, each waiting this long for it to close
+CIRCUIT_REQUEUE_ROUNDS = 1
+CIRCUIT_REQUEUE_WAIT_SECONDS = 2 * CIRCUIT_RESET_SECONDS
+
+# Status codes worth retrying: quota and transient server-side failures
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_INFO_TYPE = "type.googleapis.com/google.rpc.RetryInfo"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Gemini circuit breaker is open; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _parse_duration(value):
+    """"36s" / "1.5s" (protobuf Duration JSON) -> seconds."""
+    try:
+        return float(str(value).strip().rstrip("s"))
+    except ValueError:
+        return None
+
+
+def server_retry_delay(response):
+    """
+    Seconds the server asks us to wait, from the Retry-After header (seconds or HTTP date) or a
+    RetryInfo detail in the error body; None when it gives no hint.
+    """
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    try:
+        details = (response.json().get("error") or {}).get("details") or []
+    except (ValueError, AttributeError):
+        return None
+    for detail in details:
+        if detail.get("@type") == RETRY_INFO_TYPE and "retryDelay" in detail:
+            return _parse_duration(detail["retryDelay"])
+    return None
+
+
+def retry_delay(attempt, response=None):
+    """
+    (seconds to wait before retry number attempt + 1, True if the server chose it).
+    Server hints get a little jitter on top, so callers told the same delay do not return in
+    lockstep; otherwise full-jitter exponential backoff.
+    """
+    hint = server_retry_delay(response) if response is not None else None
+    if hint is not None:
+        return hint + random.uniform(0, RETRY_BASE_DELAY_SECONDS / 2), True
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt + 1))), False
+
+
+class RetryBudget:
+    """Retries left for one run, shared by all its worker threads."""
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_requests(cls, request_count):
+        return cls(max(RETRY_BUDGET_MIN, math.ceil(RETRY_BUDGET_RATIO * request_count)))
+
+    def try_spend(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.spent += 1
+            return True
+
+
+# The budget of the run the current thread is working for (unset: only per-call max retries apply)
+current_retry_budget = contextvars.ContextVar("current_retry_budget", default=None)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go out. After threshold consecutive failures it opens and calls fail fast for
+    reset_seconds; then one probe call is let through (half-open) and its outcome closes or
+    re-opens the circuit. A probe that never reports back is given up after probe_timeout seconds.
+    """
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS,
+                 probe_timeout=CIRCUIT_PROBE_TIMEOUT_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.probe_timeout = probe_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.probe_started_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if self.probe_in_flight and now - self.probe_started_at >= self.probe_timeout:
+                logger.warning(f"Gemini circuit breaker probe gave no outcome within {self.probe_timeout:.0f}s; "
+                               f"letting another through")
+                self.probe_in_flight = False
+            if now - self.opened_at >= self.reset_seconds and not self.probe_in_flight:
+                self.probe_in_flight = True
+                self.probe_started_at = now
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.probe_in_flight or (self.opened_at is None and self.consecutive_failures >= self.threshold):
+                if self.opened_at is None:
+                    logger.warning(f"Gemini circuit breaker opened after {self.consecutive_failures} failures")
+                self.stats["opened"] += 1
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def release_probe(self):
+        """The probe ended without telling us about Gemini's health (e.g. a 400): let another through."""
+        with self._lock:
+            self.probe_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def summary(self):
+        state = "open" if self.is_open else "closed"
+        return f"{state}, opened {self.stats['opened']} times, {self.stats['rejected']} calls failed fast"
+
+
+GEMINI_CIRCUIT = CircuitBreaker()
@@ -0,0 +1,245 @@
+"""
+Model router: picks the Gemini model for each request from an ordered list, by price, keeping
+to a latency SLO. Rolling latency and error statistics per model demote a model that fails or
+slows down; after a cool-down it gets traffic again and is promoted back if it has recovered.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("cusdec_app")
+
+# Models tried after the primary one (gemini_endpoint), in order of preference
+GEMINI_FALLBACK_MODELS = [m.strip() for m in os.getenv("CUSDEC_GEMINI_FALLBACK_MODELS", "gemini-2.5-pro").split(",")
+                          if m.strip()]
+# A model whose p95 latency goes above this is demoted while a faster one is available
+LATENCY_SLO_SECONDS = float(os.getenv("CUSDEC_LATENCY_SLO_SECONDS", "15"))
+MAX_ERROR_RATE = float(os.getenv("CUSDEC_ROUTER_MAX_ERROR_RATE", "0.3"))
+# Failures in a row that demote a model without waiting for its error rate to catch up
+MAX_CONSECUTIVE_FAILURES = 3
+DEMOTION_SECONDS = float(os.getenv("CUSDEC_ROUTER_DEMOTION_SECONDS", "120"))
+# A model the API does not know stays out of rotation much longer
+MODEL_NOT_FOUND_DEMOTION_SECONDS = 3600
+# Calls remembered per model, and how many are needed before the statistics are trusted
+ROUTER_WINDOW = 50
+ROUTER_MIN_SAMPLES = 5
+# Output tokens assumed per request when comparing prices
+EXPECTED_OUTPUT_TOKENS = 400
+
+# USD per million tokens (input, output, input served from a context cache) and per million tokens
+# per hour of context-cache storage, paid tier; unknown models are priced like gemini-2.5-flash.
+# gemini-2.0-flash-lite has no context caching, so its cached input is priced as plain input.
+# The order is the preference when a model has to stand in for configured ones the key cannot use.
+MODEL_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50, 0.03, 1.00),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.01, 1.00),
+    "gemini-2.5-pro": (1.25, 10.00, 0.125, 4.50),
+    "gemini-2.0-flash": (0.10, 0.40, 0.025, 1.00),
+    "gemini-2.0-flash-lite": (0.075, 0.30, 0.075, 0.0),
+}
+DEFAULT_MODEL_PRICE = MODEL_PRICES["gemini-2.5-flash"]
+
+
+def model_price(model):
+    return MODEL_PRICES.get(model, DEFAULT_MODEL_PRICE)
+
+
+def estimate_cost(model, input_tokens, output_tokens, cached_tokens=0):
+    """USD for one call; cached_tokens of the input_tokens were served from a context cache."""
+    input_price, output_price, cached_price, _ = model_price(model)
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1e6
+
+
+def cache_storage_cost(model, tokens, ttl_seconds):
+    """USD for keeping tokens in a context cache for ttl_seconds."""
+    return tokens * model_price(model)[3] * ttl_seconds / 3600 / 1e6
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class ModelHealth:
+    """Rolling window of one model's calls: (latency seconds, succeeded)."""
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.demoted_until = None
+        self.demotion_reason = ""
+        self.on_probation = False
+        self.consecutive_failures = 0
+        self.calls = 0
+
+    def latencies(self):
+        return [latency for latency, ok in self.samples if ok]
+
+    def p50(self):
+        latencies = self.latencies()
+        return percentile(latencies, 0.5) if latencies else None
+
+    def p95(self):
+        latencies = self.latencies()
+        return percentile(latencies, 0.95) if latencies else None
+
+    def error_rate(self):
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+
+
+class ModelRouter:
+    """
+    Routes each request to the cheapest model that is not demoted; the list order breaks price
+    ties. A model is demoted for DEMOTION_SECONDS when it fails several times in a row, or its
+    error rate or p95 latency over the window breaks the limits. When the cool-down ends it is back on probation: calls go to it
+    again, a failure demotes it straight away, and min_samples good calls promote it back.
+    """
+
+    def __init__(self, models, latency_slo=LATENCY_SLO_SECONDS, max_error_rate=MAX_ERROR_RATE,
+                 demotion_seconds=DEMOTION_SECONDS, min_samples=ROUTER_MIN_SAMPLES):
+        self.models = list(dict.fromkeys(models))
+        self.latency_slo = latency_slo
+        self.max_error_rate = max_error_rate
+        self.demotion_seconds = demotion_seconds
+        self.min_samples = min_samples
+        self.health = {model: ModelHealth() for model in self.models}
+        self._lock = threading.Lock()
+        self.stats = {"demotions": 0, "promotions": 0, "fallback_calls": 0}
+
+    def _by_cost(self, estimated_tokens):
+        return sorted(self.models, key=lambda m: (estimate_cost(m, estimated_tokens, EXPECTED_OUTPUT_TOKENS),
+                                                  self.models.index(m)))
+
+    def _refresh(self, model, now):
+        """End a demotion whose cool-down has passed; its old samples no longer count."""
+        health = self.health[model]
+        if health.demoted_until is not None and now >= health.demoted_until:
+            health.demoted_until = None
+            health.on_probation = True
+            health.samples.clear()
+            logger.info(f"Model router: {model} is back on probation after its cool-down")
+
+    def choose(self, estimated_tokens=0):
+        """(model, reason) for the next request."""
+        now = time.monotonic()
+        with self._lock:
+            ranked = self._by_cost(estimated_tokens)
+            skipped = []
+            for model in ranked:
+                self._refresh(model, now)
+                health = self.health[model]
+                if health.demoted_until is None:
+                    if skipped:
+                        self.stats["fallback_calls"] += 1
+                        return model, f"fallback ({'; '.join(skipped)})"
+                    return model, "cheapest healthy model"
+                skipped.append(f"{model} demoted: {health.demotion_reason}")
+            # Everything is demoted: use the model closest to the end of its cool-down
+            model = min(ranked, key=lambda m: self.health[m].demoted_until)
+            return model, "all models demoted; using the one closest to recovery"
+
+    def hedge_model(self, model, estimated_tokens=0):
+        """Where a hedge for a call to model goes: the next healthy model by price, else model itself."""
+        with self._lock:
+            for other in self._by_cost(estimated_tokens):
+                if other != model and self.health[other].demoted_until is None:
+                    return other
+            return model
+
+    def p95(self, model):
+        """Rolling p95 latency of model, once it has min_samples successful calls; else None."""
+        with self._lock:
+            health = self.health.get(model)
+            if health is None or len(health.latencies()) < self.min_samples:
+                return None
+            return health.p95()
+
+    def record(self, model, latency, ok):
+        """Account one call; demote the model if it now breaks the error-rate or latency limit."""
+        with self._lock:
+            health = self.health.get(model)
+            if health is None:
+                return
+            health.calls += 1
+            health.samples.append((latency, ok))
+            health.consecutive_failures = 0 if ok else health.consecutive_failures + 1
+            if health.demoted_until is not None:
+                return
+            if health.on_probation and not ok and self._has_alternative(model):
+                self._demote(model, "failed again after its cool-down")
+                return
+            if health.consecutive_failures >= MAX_CONSECUTIVE_FAILURES and self._has_alternative(model):
+                self._demote(model, f"{health.consecutive_failures} failures in a row")
+                return
+            if len(health.samples) < self.min_samples:
+                return
+            reason = None
+            if health.error_rate() > self.max_error_rate:
+                reason = f"error rate {health.error_rate():.0%}"
+            elif health.p95() is not None and health.p95() > self.latency_slo:
+                reason = f"p95 {health.p95():.1f}s over the {self.latency_slo:g}s SLO"
+            if reason and self._has_alternative(model):
+                self._demote(model, reason)
+            elif health.on_probation:
+                health.on_probation = False
+                self.stats["promotions"] += 1
+                logger.info(f"Model router: promoted {model} back after {len(health.samples)} good calls")
+
+    def demote(self, model, reason, seconds=None):
+        """Take a model out of rotation now (e.g. the API says it does not exist)."""
+        with self._lock:
+            if model in self.health:
+                self._demote(model, reason, seconds)
+
+    def _demote(self, model, reason, seconds=None):
+        health = self.health[model]
+        health.demoted_until = time.monotonic() + (seconds if seconds is not None else self.demotion_seconds)
+        health.demotion_reason = reason
+        health.on_probation = False
+        self.stats["demotions"] += 1
+        logger.warning(f"Model router: demoted {model} ({reason})")
+
+    def _has_alternative(self, model):
+        return any(other != model and self.health[other].demoted_until is None for other in self.models)
+
+    def is_demoted(self, model):
+        with self._lock:
+            health = self.health.get(model)
+            return health is not None and health.demoted_until is not None
+
+    def fails_over(self, model):
+        """True when model is demoted and another model will take its requests."""
+        with self._lock:
+            health = self.health.get(model)
+            return health is not None and health.demoted_until is not None and self._has_alternative(model)
+
+    def snapshot(self):
+        """Per-model statistics for the log and the UI."""
+        with self._lock:
+            rows = []
+            for model in self.models:
+                health = self.health[model]
+                p50, p95 = health.p50(), health.p95()
+                rows.append({
+                    "model": model,
+                    "calls": health.calls,
+                    "p50_s": round(p50, 2) if p50 is not None else None,
+                    "p95_s": round(p95, 2) if p95 is not None else None,
+                    "error_rate": round(health.error_rate(), 3),
+                    "usd_per_1m_tokens": "{:.3g} / {:.3g}".format(*model_price(model)[:2]),
+                    "demoted": health.demotion_reason if health.demoted_until is not None else "",
+                })
+            return rows
+
+    def summary(self):
+        parts = []
+        for row in self.snapshot():
+            state = f"demoted ({row['demoted']})" if row["demoted"] else "active"
+            parts.append(f"{row['model']} {state}, {row['calls']} calls, p50 {row['p50_s']}s, p95 {row['p95_s']}s, "
+                         f"errors {row['error_rate']:.0%}")
+        return "; ".join(parts) + (f"; {self.stats['demotions']} demotions, {self.stats['promotions']} promotions, "
+                                   f"{self.stats['fallback_calls']} fallback calls")
@@ -0,0 +1,182 @@
+"""
+Streaming extraction: streamGenerateContent replies (server-sent events) are read chunk by chunk
+and the "FieldName: FieldValue" lines or JSON properties are parsed as they complete, so each
+field can be shown before the whole reply is in. A stream that goes quiet for longer than
+STREAM_STALL_SECONDS is abandoned and retried like any other network failure.
+"""
+import contextvars
+import json
+import os
+import time
+
+import requests
+
+from cusdec_prompt import decode_json_response, parse_field_lines
+
+STREAMING_ENABLED = os.getenv("CUSDEC_STREAMING", "0") == "1"
+# Longest gap between two chunks of a stream (the read timeout while streaming)
+STREAM_STALL_SECONDS = float(os.getenv("CUSDEC_STREAM_STALL_SECONDS", "20"))
+STREAM_CONNECT_TIMEOUT_SECONDS = 10
+
+# Called as sink(filename, display name, value) for every field a stream yields, on the worker thread,
+# and as sink(filename, None, None) when a new attempt starts: what earlier attempts streamed is withdrawn
+current_field_sink = contextvars.ContextVar("current_field_sink", default=None)
+
+_JSON_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+class FieldLineStream:
+    """Incremental parse_field_lines: a line is parsed once its newline has arrived."""
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text):
+        """{display name: value} of the lines text completes."""
+        self._pending += text
+        complete, newline, self._pending = self._pending.rpartition("\n")
+        return parse_field_lines(complete) if newline else {}
+
+    def finish(self):
+        pending, self._pending = self._pending, ""
+        return parse_field_lines(pending) if pending.strip() else {}
+
+
+class JsonFieldStream:
+    """
+    Incremental decoder for the flat JSON object a responseSchema asks for: a property is
+    returned as soon as its value has been received in full.
+    """
+
+    def __init__(self, property_to_display):
+        self.property_to_display = property_to_display
+        self._buffer = ""
+        self._pos = 0
+        self._opened = False
+        self._done = False
+
+    def _skip_whitespace(self, pos):
+        while pos < len(self._buffer) and self._buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def feed(self, text):
+        self._buffer += text
+        fields = {}
+        while not self._done:
+            pos = self._skip_whitespace(self._pos)
+            if pos >= len(self._buffer):
+                break
+            char = self._buffer[pos]
+            if not self._opened:
+                # Anything but an object (e.g. a fenced reply) is left to the final decode
+                self._opened, self._done = char == "{", char != "{"
+                self._pos = pos + 1
+                continue
+            if char == ",":
+                self._pos = pos + 1
+                continue
+            if char == "}":
+                self._done = True
+                break
+            try:
+                name, end = _JSON_DECODER.raw_decode(self._buffer, pos)
+                colon = self._skip_whitespace(end)
+                if colon >= len(self._buffer):
+                    break
+                if self._buffer[colon] != ":":
+                    self._done = True
+                    break
+                value, end = _JSON_DECODER.raw_decode(self._buffer, self._skip_whitespace(colon + 1))
+            except ValueError:
+                break  # the value is still arriving
+            if end >= len(self._buffer) and not isinstance(value, (str, list, dict)):
+                break  # a number or literal at the very end may still have digits to come
+            self._pos = end
+            display_name = self.property_to_display.get(name) if isinstance(name, str) else None
+            if display_name is not None and value is not None:
+                fields[display_name] = value.strip() if isinstance(value, str) else json.dumps(value)
+        return fields
+
+    def finish(self):
+        """
+        A reply that did not start as a bare JSON object (e.g. one in a code fence) is decoded
+        whole at the end, as decode_gemini_reply would: JSON first, else "FieldName: FieldValue" lines.
+        """
+        if self._opened:
+            return {}
+        decoded = decode_json_response(self._buffer, self.property_to_display)
+        return decoded if decoded is not None else parse_field_lines(self._buffer)
+
+
+class FieldStreamer:
+    """
+    Turns one attempt's reply text, chunk by chunk, into on_field(display name, value) calls,
+    and notes when the first field arrived.
+    """
+
+    def __init__(self, property_to_display=None, on_field=None):
+        self._parser = JsonFieldStream(property_to_display) if property_to_display else FieldLineStream()
+        self.on_field = on_field
+        self.fields = {}
+        self.first_field_at = None
+
+    def _emit(self, fields):
+        for name, value in fields.items():
+            if self.first_field_at is None:
+                self.first_field_at = time.perf_counter()
+            if self.fields.get(name) != value:
+                self.fields[name] = value
+                if self.on_field:
+                    self.on_field(name, value)
+
+    def feed(self, text):
+        self._emit(self._parser.feed(text))
+
+    def finish(self):
+        self._emit(self._parser.finish())
+
+
+def iter_sse_events(response):
+    """JSON payloads of the "data:" events of a text/event-stream response, as they arrive."""
+    response.encoding = "utf-8"
+    data_lines = []
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif not line and data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
+
+
+def read_stream_reply(response, streamer):
+    """
+    Consume a streamGenerateContent response, feeding each text chunk to streamer, and return
+    the reply assembled as generateContent would have returned it. A stalled or broken stream
+    raises requests.exceptions.RequestException.
+    """
+    texts = []
+    candidate = {"content": {"role": "model", "parts": []}}
+    reply = {"candidates": [candidate]}
+    for event in iter_sse_events(response):
+        if "error" in event:
+            raise requests.exceptions.RequestException(
+                f"Gemini stream failed: {(event['error'] or {}).get('message', event['error'])}")
+        for chunk_candidate in event.get("candidates", [])[:1]:
+            # Thought summaries are not part of the answer
+            text = "".join(part.get("text", "") for part in (chunk_candidate.get("content") or {}).get("parts", [])
+                           if not part.get("thought"))
+            if text:
+                texts.append(text)
+                streamer.feed(text)
+            if chunk_candidate.get("finishReason"):
+                candidate["finishReason"] = chunk_candidate["finishReason"]
+        for key in ("usageMetadata", "modelVersion"):
+            if key in event:
+                reply[key] = event[key]
+    streamer.finish()
+    candidate["content"]["parts"].append({"text": "".join(texts)})
+    return reply
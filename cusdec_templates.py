@@ -0,0 +1,191 @@
+"""
+CUSDEC II layout variants: fingerprint a page by where its static labels sit, and keep
+an auto-calibrated bbox set per fingerprint in a SQLite store that survives restarts.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from cusdec_cache import CACHE_DIR, SqliteConnection, sha256_hex
+
+logger = logging.getLogger("cusdec_app")
+
+# Static labels printed on every CUSDEC II; their positions identify the layout variant
+ANCHOR_LABELS = ("Customs Reference", "Declarant", "Box 31", "Marks & Nos", "D.Val", "D.Qty")
+
+# Anchor positions are rounded to this grid (PDF points) before fingerprinting
+FINGERPRINT_GRID = 10
+
+# At least this many anchors must be found, otherwise the page is treated as unknown
+MIN_ANCHORS = 2
+
+# A layout becomes the reference only once this many pages carrying every anchor agree on where the
+# anchors sit, to within REFERENCE_TOLERANCE points, so one odd page cannot skew every calibration
+REFERENCE_MIN_PAGES = int(os.getenv("CUSDEC_TEMPLATE_REFERENCE_PAGES", "3"))
+REFERENCE_TOLERANCE = 5
+
+UNKNOWN_TEMPLATE = "unknown"
+REFERENCE_ROW = "reference"
+
+TEMPLATE_DB_PATH = os.path.join(CACHE_DIR, "templates.sqlite3")
+
+
+def find_anchor_positions(chars, labels=ANCHOR_LABELS):
+    """Return {label: (x0, top)} of the first occurrence of each label in the page's chars."""
+    starts = []
+    pieces = []
+    for idx, char in enumerate(chars):
+        text = char.get("text") or ""
+        pieces.append(text)
+        starts.extend([idx] * len(text))
+    page_string = "".join(pieces)
+    positions = {}
+    for label in labels:
+        pos = page_string.find(label)
+        if pos >= 0:
+            char = chars[starts[pos]]
+            positions[label] = (round(char["x0"], 1), round(char["top"], 1))
+    return positions
+
+
+def fingerprint(anchors, page_size):
+    """Cheap layout id from the page size and the grid-rounded anchor positions."""
+    if len(anchors) < MIN_ANCHORS:
+        return UNKNOWN_TEMPLATE
+    grid = FINGERPRINT_GRID
+    key = [round(page_size[0]), round(page_size[1])]
+    for label in sorted(anchors):
+        x0, top = anchors[label]
+        key.append((label, int(x0 // grid), int(top // grid)))
+    return sha256_hex(repr(key))[:16]
+
+
+def anchors_agree(anchors, other, tolerance=REFERENCE_TOLERANCE):
+    """True when both pages have the same anchors at positions within tolerance points of each other."""
+    return set(anchors) == set(other) and all(
+        abs(anchors[label][0] - other[label][0]) <= tolerance and abs(anchors[label][1] - other[label][1]) <= tolerance
+        for label in anchors)
+
+
+def calibrate_bbox_set(base_coords, reference_anchors, anchors, page_bbox):
+    """
+    Shift every base bbox by the displacement of the anchor nearest to it on the
+    reference layout. Boxes that would leave the page keep their base coordinates.
+    """
+    shared = [label for label in reference_anchors if label in anchors]
+    if not shared:
+        return dict(base_coords)
+    px0, ptop, px1, pbottom = page_bbox
+    calibrated = {}
+    for box_name, (x0, top, x1, bottom) in base_coords.items():
+        nearest = min(shared, key=lambda label: (reference_anchors[label][0] - x0) ** 2
+                                                + (reference_anchors[label][1] - top) ** 2)
+        dx = anchors[nearest][0] - reference_anchors[nearest][0]
+        dy = anchors[nearest][1] - reference_anchors[nearest][1]
+        shifted = (x0 + dx, top + dy, x1 + dx, bottom + dy)
+        if shifted[0] < px0 or shifted[1] < ptop or shifted[2] > px1 or shifted[3] > pbottom:
+            shifted = (x0, top, x1, bottom)
+        calibrated[box_name] = tuple(round(v, 1) for v in shifted)
+    return calibrated
+
+
+class TemplateStore:
+    """
+    Fingerprint -> calibrated bbox set, held in memory and persisted to SQLite.
+
+    The reference layout, the one the base bbox set is taken to be drawn for, is the first
+    one that REFERENCE_MIN_PAGES pages with every anchor agree on; until then pages get the
+    base bbox set uncalibrated. The candidate pages are counted in SQLite too, so parse workers
+    in separate processes add up to one count. To re-baseline after a bad reference, change
+    CUSDEC_TEMPLATE_BASELINE (part of the base version, so the parse cache starts over too).
+    """
+
+    def __init__(self, db_path=TEMPLATE_DB_PATH):
+        self.db_path = db_path
+        self._templates = {}
+        self._reference = None
+        self._lock = threading.Lock()
+        self._sqlite = SqliteConnection(db_path, [
+            "CREATE TABLE IF NOT EXISTS templates ("
+            "fingerprint TEXT PRIMARY KEY, anchors TEXT NOT NULL, bbox_set TEXT NOT NULL, created REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS reference_candidates ("
+            "reference TEXT NOT NULL, anchors TEXT NOT NULL, seen REAL NOT NULL)",
+        ])
+
+    def _db(self):
+        return self._sqlite.get()
+
+    def _load(self, fingerprint_id):
+        row = self._db().execute("SELECT anchors, bbox_set FROM templates WHERE fingerprint = ?",
+                                 (fingerprint_id,)).fetchone()
+        if row is None:
+            return None
+        return {"anchors": json.loads(row[0]),
+                "bbox_set": {name: tuple(box) for name, box in json.loads(row[1]).items()}}
+
+    def _save(self, fingerprint_id, anchors, bbox_set):
+        db = self._db()
+        # INSERT OR IGNORE + re-read so concurrent parse workers agree on one calibration
+        db.execute("INSERT OR IGNORE INTO templates (fingerprint, anchors, bbox_set, created) VALUES (?, ?, ?, ?)",
+                   (fingerprint_id, json.dumps(anchors), json.dumps(bbox_set), time.time()))
+        db.commit()
+        return self._load(fingerprint_id)
+
+    def _propose_reference(self, reference_id, anchors, base_coords):
+        """Count the page towards a reference; save and return it once enough pages agree, else None."""
+        if len(anchors) < len(ANCHOR_LABELS):
+            return None
+        db = self._db()
+        db.execute("INSERT INTO reference_candidates (reference, anchors, seen) VALUES (?, ?, ?)",
+                   (reference_id, json.dumps(anchors), time.time()))
+        db.commit()
+        candidates = [{k: tuple(v) for k, v in json.loads(row[0]).items()} for row in
+                      db.execute("SELECT anchors FROM reference_candidates WHERE reference = ?", (reference_id,))]
+        if sum(1 for other in candidates if anchors_agree(anchors, other)) < REFERENCE_MIN_PAGES:
+            return None
+        reference = self._save(reference_id, anchors, base_coords)
+        db.execute("DELETE FROM reference_candidates WHERE reference = ?", (reference_id,))
+        db.commit()
+        logger.info(f"Reference CUSDEC layout confirmed by {REFERENCE_MIN_PAGES} agreeing pages")
+        return reference
+
+    def bbox_set_for(self, fingerprint_id, anchors, page_bbox, base_coords, base_version):
+        """
+        Return (bbox set, settled) for a classified page, calibrating and persisting the set on first
+        sight. settled is False when the page got the base bbox set only for want of a confirmed
+        reference (or of the store), so a later parse of it may get other regions.
+        Rows are keyed by base_version too, so editing the base bbox set starts a fresh calibration.
+        """
+        if fingerprint_id == UNKNOWN_TEMPLATE:
+            return base_coords, True
+        row_id = f"{fingerprint_id}@{base_version}"
+        cached = self._templates.get(row_id)
+        if cached is not None:
+            return cached, True
+        with self._lock:
+            try:
+                entry = self._load(row_id)
+                if entry is None:
+                    reference_id = f"{REFERENCE_ROW}@{base_version}"
+                    if self._reference is None or self._reference[0] != reference_id:
+                        reference = self._load(reference_id) or \
+                            self._propose_reference(reference_id, anchors, base_coords)
+                        if reference is None:
+                            # No trusted reference yet: nothing to calibrate against, and nothing is kept
+                            return base_coords, False
+                        self._reference = (reference_id, reference)
+                    reference_anchors = {k: tuple(v) for k, v in self._reference[1]["anchors"].items()}
+                    bbox_set = calibrate_bbox_set(base_coords, reference_anchors, anchors, page_bbox)
+                    entry = self._save(row_id, anchors, bbox_set)
+                    logger.info(f"Calibrated bbox set for new CUSDEC template {fingerprint_id}")
+            except sqlite3.Error as e:
+                logger.warning(f"Template store unavailable, using base bbox set: {e}")
+                return base_coords, False
+            self._templates[row_id] = entry["bbox_set"]
+            return entry["bbox_set"], True
+
+
+TEMPLATE_STORE = TemplateStore()
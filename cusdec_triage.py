@@ -0,0 +1,101 @@
+"""
+Pre-triage for uploaded PDFs: a few-millisecond look at the raw PDF structure with PyPDF2
+that rejects files which could never yield CUSDEC data, before they cost a pdfplumber
+parse or a Gemini call. Raw content-stream bytes are not the text (kerned TJ arrays split
+words, hex strings and font encodings hide them), so the keyword check is only a hint;
+a file is rejected only when it cannot be read at all or its first page shows no text.
+"""
+import io
+import logging
+import re
+import time
+
+from PyPDF2 import PdfReader
+
+logger = logging.getLogger("cusdec_app")
+
+# Upper-cased byte strings expected in the first page's content stream of a CUSDEC II
+CUSDEC_KEYWORDS = (b"CUSDEC", b"GOODS DECLARATION", b"SRI LANKA CUSTOMS", b"CUSTOMS REFERENCE", b"DECLARANT")
+
+TEXT_SHOW_OPERATOR_RE = re.compile(rb"(?:\)|\]|>)\s*(?:Tj|TJ|'|\")")
+LITERAL_STRING_RE = re.compile(rb"\((?:[^()\\]|\\.){3,}\)")
+
+# With at least this many readable literal strings and no keyword, the page probably is not a CUSDEC
+MIN_LITERALS_FOR_KEYWORD_VERDICT = 20
+# Form XObjects nested deeper than this are not searched for text
+MAX_XOBJECT_DEPTH = 4
+
+ROUTE_PROCESS = "process"
+ROUTE_REJECT = "reject"
+
+
+def _first_page_content(page):
+    contents = page.get_contents()
+    return contents.get_data() if contents is not None else b""
+
+
+def _form_xobject_contents(resources, depth=0, seen=None):
+    """Content streams of the Form XObjects in resources, and of the forms they draw in turn."""
+    seen = set() if seen is None else seen
+    if resources is None or depth >= MAX_XOBJECT_DEPTH:
+        return
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return
+    for ref in xobjects.get_object().values():
+        key = (ref.idnum, ref.generation) if hasattr(ref, "idnum") else id(ref)
+        if key in seen:
+            continue
+        seen.add(key)
+        xobject = ref.get_object()
+        if xobject.get("/Subtype") != "/Form":
+            continue
+        yield xobject.get_data()
+        yield from _form_xobject_contents(xobject.get("/Resources"), depth + 1, seen)
+
+
+def triage_pdf(file_bytes):
+    """
+    Return a triage report:
+      route: "process" or "reject"
+      reason: why the file was rejected ("" when routed to processing)
+      page_count, has_text_layer, is_cusdec (True/False, None when the text is not readable raw), elapsed_ms
+    The text layer is looked for in the first page and in the Form XObjects it draws; is_cusdec
+    is a hint from the raw bytes and never rejects a file on its own.
+    Files PyPDF2 cannot read are still routed to processing, so pdfplumber reports the real error.
+    """
+    start = time.perf_counter()
+    report = {"route": ROUTE_PROCESS, "reason": "", "page_count": None, "has_text_layer": None,
+              "is_cusdec": None, "elapsed_ms": 0.0}
+    try:
+        reader = PdfReader(io.BytesIO(file_bytes))
+        if reader.is_encrypted and not reader.decrypt(""):
+            report.update(route=ROUTE_REJECT, reason="PDF is password protected.")
+        else:
+            report["page_count"] = len(reader.pages)
+            if report["page_count"] == 0:
+                report.update(route=ROUTE_REJECT, reason="PDF contains no pages.")
+            else:
+                page = reader.pages[0]
+                content = _first_page_content(page)
+                if not content.strip():
+                    report.update(route=ROUTE_REJECT, reason="First page is empty.")
+                else:
+                    streams = [content]
+                    if not TEXT_SHOW_OPERATOR_RE.search(content):
+                        streams.extend(_form_xobject_contents(page.get("/Resources")))
+                    report["has_text_layer"] = any(TEXT_SHOW_OPERATOR_RE.search(stream) for stream in streams)
+                    if not report["has_text_layer"]:
+                        report.update(route=ROUTE_REJECT,
+                                      reason="First page has no text layer (scanned image?). OCR it before uploading.")
+                    elif any(keyword in stream.upper() for stream in streams for keyword in CUSDEC_KEYWORDS):
+                        report["is_cusdec"] = True
+                    elif (sum(len(LITERAL_STRING_RE.findall(stream)) for stream in streams)
+                          >= MIN_LITERALS_FOR_KEYWORD_VERDICT):
+                        # Plenty of readable raw text and no CUSDEC header in it: the full parse decides
+                        report["is_cusdec"] = False
+    except Exception as e:
+        logger.debug(f"Triage could not read PDF, routing to full parse: {e}")
+
+    report["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return report
@@ -0,0 +1,177 @@
+"""
+Token and cost accounting: each Gemini call's usageMetadata is turned into token counts and an
+estimated cost (cusdec_router.MODEL_PRICES), summed per file and per batch, and appended to a
+SQLite ledger that survives restarts, so prompt size and model choice can be tuned on real data.
+"""
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from cusdec_cache import CACHE_DIR, SqliteConnection
+from cusdec_router import cache_storage_cost, estimate_cost
+
+logger = logging.getLogger("cusdec_app")
+
+USAGE_LEDGER_PATH = os.path.join(CACHE_DIR, "usage_ledger.sqlite3")
+# Share of the price paid for Batch API requests
+BATCH_PRICE_RATIO = 0.5
+# Ledger filename of context-cache creations, which belong to no file
+CONTEXT_CACHE_LEDGER_NAME = "(context cache)"
+
+TOKEN_FIELDS = ("prompt_tokens", "cached_tokens", "output_tokens", "thinking_tokens")
+
+
+def call_usage(model, usage_metadata, price_ratio=1.0):
+    """
+    Token counts and estimated USD of one call from its usageMetadata. Thinking tokens are billed
+    as output; cached prompt tokens at the model's cached-input price.
+    """
+    usage_metadata = usage_metadata or {}
+    usage = {
+        "prompt_tokens": usage_metadata.get("promptTokenCount", 0),
+        "cached_tokens": usage_metadata.get("cachedContentTokenCount", 0),
+        "output_tokens": usage_metadata.get("candidatesTokenCount", 0),
+        "thinking_tokens": usage_metadata.get("thoughtsTokenCount", 0),
+    }
+    cost = estimate_cost(model, usage["prompt_tokens"], usage["output_tokens"] + usage["thinking_tokens"],
+                         usage["cached_tokens"]) * price_ratio
+    usage["cost_usd"] = round(cost, 8)
+    return usage
+
+
+def share_call(call, share):
+    """A call-log entry for a document that had share of a packed request: tokens and cost scaled."""
+    shared = dict(call, share=round(share, 4))
+    for field in TOKEN_FIELDS:
+        if field in call:
+            shared[field] = round(call[field] * share)
+    if "cost_usd" in call:
+        shared["cost_usd"] = round(call["cost_usd"] * share, 8)
+    return shared
+
+
+def sum_usage(calls):
+    """Totals over call-log entries (response-cache hits and failed attempts count zero tokens)."""
+    totals = {"calls": 0, **{field: 0 for field in TOKEN_FIELDS}, "cost_usd": 0.0}
+    for call in calls:
+        if call.get("cache_hit"):
+            continue
+        totals["calls"] += 1
+        for field in TOKEN_FIELDS:
+            totals[field] += call.get(field, 0)
+        totals["cost_usd"] += call.get("cost_usd", 0.0)
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    return totals
+
+
+def format_usage(totals):
+    thinking = f", {totals['thinking_tokens']} thinking" if totals["thinking_tokens"] else ""
+    return (f"{totals['prompt_tokens']} in ({totals['cached_tokens']} cached) / {totals['output_tokens']} out"
+            f"{thinking} tokens, ${totals['cost_usd']:.4f}")
+
+
+class UsageTally:
+    """
+    Call-log entries of hedge losers, by file. A loser finishes on a hedging thread, often after
+    its file was totalled, so entries are added from any thread and readers get copies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def add(self, filename, calls):
+        with self._lock:
+            self._calls.setdefault(filename, []).extend(calls)
+
+    def calls(self, filename):
+        with self._lock:
+            return list(self._calls.get(filename, []))
+
+    def all_calls(self):
+        """[(filename, entry)] over every file."""
+        with self._lock:
+            return [(filename, call) for filename, calls in self._calls.items() for call in calls]
+
+
+# The tally of the files on screen that late entries are added to (unset: the ledger only)
+current_usage_tally = contextvars.ContextVar("current_usage_tally", default=None)
+
+
+class UsageLedger:
+    """
+    Append-only record of every Gemini call, one row per call and file, in SQLite. Context-cache
+    creations are rows of their own, with the cache's TTL and its storage cost.
+    """
+
+    def __init__(self, db_path=USAGE_LEDGER_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._sqlite = SqliteConnection(
+            db_path,
+            ["CREATE TABLE IF NOT EXISTS calls ("
+             "recorded_at REAL NOT NULL, filename TEXT NOT NULL, model TEXT, route TEXT, status TEXT, "
+             "prompt_tokens INTEGER, cached_tokens INTEGER, output_tokens INTEGER, thinking_tokens INTEGER, "
+             "cost_usd REAL, share REAL, ttl_seconds REAL)"],
+            # Ledgers written before context-cache creations were recorded
+            [("calls", "ttl_seconds", "REAL", None)])
+
+    def _db(self):
+        return self._sqlite.get()
+
+    def record(self, filename, calls):
+        """Append a file's call-log entries; response-cache hits are left out."""
+        rows = [(time.time(), filename, call.get("model"), call.get("route"), str(call.get("status")),
+                 *(call.get(field, 0) for field in TOKEN_FIELDS), call.get("cost_usd", 0.0), call.get("share", 1.0),
+                 call.get("ttl_seconds"))
+                for call in calls if not call.get("cache_hit")]
+        if not rows:
+            return
+        with self._lock:
+            try:
+                db = self._db()
+                db.executemany("INSERT INTO calls (recorded_at, filename, model, route, status, prompt_tokens, "
+                               "cached_tokens, output_tokens, thinking_tokens, cost_usd, share, ttl_seconds) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Usage ledger write failed: {e}")
+
+    def totals(self, since=None):
+        """sum_usage-style totals of the ledger, optionally only rows recorded since a timestamp."""
+        with self._lock:
+            try:
+                row = self._db().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(cached_tokens), 0), "
+                    "COALESCE(SUM(output_tokens), 0), COALESCE(SUM(thinking_tokens), 0), COALESCE(SUM(cost_usd), 0) "
+                    "FROM calls WHERE recorded_at >= ?", (since or 0,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Usage ledger read failed: {e}")
+                return None
+        return {"calls": row[0], **dict(zip(TOKEN_FIELDS, row[1:5])), "cost_usd": round(row[5], 6)}
+
+
+USAGE_LEDGER = UsageLedger()
+
+
+def record_late_call(documents, tally, entry):
+    """
+    A hedge loser's call-log entry, charged to each (filename, share) of the request it was sent
+    for, in the ledger and in tally.
+    """
+    for filename, share in documents:
+        shared = share_call(entry, share)
+        USAGE_LEDGER.record(filename, [shared])
+        if tally is not None:
+            tally.add(filename, [shared])
+
+
+def record_cache_creation(model, tokens, ttl_seconds):
+    """A context cache of tokens created for ttl_seconds, in the ledger at its storage cost."""
+    USAGE_LEDGER.record(CONTEXT_CACHE_LEDGER_NAME, [{
+        "model": model, "route": "context cache", "status": 200, "prompt_tokens": tokens,
+        "cost_usd": round(cache_storage_cost(model, tokens, ttl_seconds), 8), "ttl_seconds": ttl_seconds,
+    }])
@@ -0,0 +1,77 @@
+import pytest
+import requests
+
+import cusdec_gemini
+import cusdec_usage
+from cusdec_gemini import ContextCacheManager
+from cusdec_usage import UsageLedger
+
+
+@pytest.fixture(autouse=True)
+def ledger(tmp_path, monkeypatch):
+    ledger = UsageLedger(str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setattr(cusdec_usage, "USAGE_LEDGER", ledger)
+    return ledger
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None, text=""):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = text
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError("no JSON")
+        return self._payload
+
+
+def serve(monkeypatch, replies):
+    """Answer cachedContents POSTs with replies in turn (a RequestException is raised)."""
+    calls = []
+
+    def post(url, **kwargs):
+        calls.append(url)
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(cusdec_gemini.HTTP_SESSION, "post", post)
+    return calls
+
+
+def test_too_small_instruction_falls_back_for_good(monkeypatch):
+    calls = serve(monkeypatch, [FakeResponse(400, text="cached content is too small")])
+    manager = ContextCacheManager("key", "gemini-2.5-flash", mode="cached", base_url="http://standin")
+    assert "systemInstruction" in manager.request_fields("instruction")
+    assert "systemInstruction" in manager.request_fields("instruction")
+    assert len(calls) == 1
+
+
+def test_transient_failures_back_off_and_then_retry(monkeypatch):
+    calls = serve(monkeypatch, [requests.exceptions.ConnectionError("reset"), FakeResponse(503, text="busy"),
+                                FakeResponse(200, text="not json"), FakeResponse(200, {"name": "cachedContents/1"})])
+    clock = [1000.0]
+    monkeypatch.setattr(cusdec_gemini.time, "monotonic", lambda: clock[0])
+    manager = ContextCacheManager("key", "gemini-2.5-flash", mode="cached", base_url="http://standin")
+
+    for waited in (0, 30, 60):
+        clock[0] += waited
+        assert "systemInstruction" in manager.request_fields("instruction")
+        # Within the backoff nothing is sent
+        assert "systemInstruction" in manager.request_fields("instruction")
+    assert len(calls) == 3
+    clock[0] += 120
+    assert manager.request_fields("instruction") == {"cachedContent": "cachedContents/1"}
+    assert len(calls) == 4
+
+
+def test_creation_is_charged_for_its_storage(monkeypatch, ledger):
+    serve(monkeypatch, [FakeResponse(200, {"name": "cachedContents/1", "usageMetadata": {"totalTokenCount": 50_000}})])
+    manager = ContextCacheManager("key", "gemini-2.5-flash", mode="cached", ttl_seconds=3600,
+                                  base_url="http://standin")
+    manager.request_fields("instruction")
+    manager.request_fields("instruction")
+    assert ledger.totals() == {"calls": 1, "prompt_tokens": 50_000, "cached_tokens": 0, "output_tokens": 0,
+                               "thinking_tokens": 0, "cost_usd": 0.05}
@@ -0,0 +1,40 @@
+import contextvars
+import threading
+import time
+
+from cusdec_hedge import Hedger
+
+current_document = contextvars.ContextVar("current_document", default=None)
+
+
+def test_hedged_calls_see_the_callers_context_variables():
+    hedger = Hedger(enabled=True, max_rate=1.0, min_delay=0.05, max_workers=4)
+    seen = {}
+    loser_done = threading.Event()
+
+    def attempt(name, delay):
+        def call():
+            time.sleep(delay)
+            seen[name] = current_document.get()
+            return {"name": name, "ok": True}
+        return call
+
+    def on_loser(attempt):
+        seen["loser"] = attempt["name"]
+        loser_done.set()
+
+    current_document.set("a.pdf")
+    winner = hedger.call(attempt("primary", 0.5), lambda: attempt("hedge", 0.0), 0.05,
+                         lambda result: result["ok"], on_loser)
+
+    assert winner["name"] == "hedge"
+    assert loser_done.wait(2)
+    assert seen == {"primary": "a.pdf", "hedge": "a.pdf", "loser": "primary"}
+    assert hedger.stats["hedge_wins"] == 1
+
+
+def test_no_hedge_when_the_factory_has_no_capacity():
+    hedger = Hedger(enabled=True, max_rate=1.0, min_delay=0.01, max_workers=2)
+    winner = hedger.call(lambda: (time.sleep(0.1), "primary")[1], lambda: None, 0.01, lambda result: True)
+    assert winner == "primary"
+    assert hedger.stats["hedged"] == 0
@@ -0,0 +1,40 @@
+import pytest
+
+from benchmarks.gemini_standin import start_standin
+from cusdec_stream import FieldStreamer, read_stream_reply
+
+pytest.importorskip("httpx")
+from cusdec_http import Http2Session  # noqa: E402
+
+BODY = {"contents": [{"role": "user", "parts": [{"text": "Box 2 Exporter ACME"}]}],
+        "generationConfig": {"responseSchema": {"type": "OBJECT", "properties": {"exporter": {"type": "STRING"}}}}}
+
+
+@pytest.fixture
+def standin():
+    server, base_url = start_standin(prefill_us_per_token=0)
+    yield base_url
+    server.shutdown()
+
+
+def test_stream_over_the_http2_session(standin):
+    session = Http2Session(2)
+    fields = []
+    streamer = FieldStreamer({"exporter": "Box 2: Exporter"}, on_field=lambda name, value: fields.append(name))
+    response = session.post(f"{standin}/models/gemini-2.5-flash:streamGenerateContent", params={"alt": "sse"},
+                            headers={"X-goog-api-key": "standin"}, json=BODY, stream=True, timeout=(5, 5))
+    assert response.status_code == 200
+    with response:
+        reply = read_stream_reply(response, streamer)
+    assert reply["candidates"][0]["content"]["parts"][0]["text"] == '{"exporter": "Not Found"}'
+    assert "usageMetadata" in reply
+    assert fields == ["Box 2: Exporter"]
+
+
+def test_plain_request_over_the_http2_session(standin):
+    session = Http2Session(2)
+    response = session.post(f"{standin}/models/gemini-2.5-flash:generateContent",
+                            headers={"X-goog-api-key": "standin"}, json=BODY, timeout=5)
+    assert response.status_code == 200
+    assert response.json()["candidates"]
+    assert response.text.startswith("{")
@@ -0,0 +1,111 @@
+from cusdec_local import LOCAL_CONFIDENCE_THRESHOLD, confident_fields, extract_fields_locally
+from cusdec_prompt import COMMON_FIELDS_MAP
+
+# CUSDEC II first-page boxes as laid out on the form: (label, x0, top, value lines under the label).
+# Boxes sharing a row have their labels on the same line, so the words right of a label are
+# usually the next box's label, and free-text values run over several lines.
+BOXES = [
+    ("2 Exporter", 20, 40, ["ACME EXPORTS LTD", "12 HARBOUR ROAD", "SHANGHAI CN"]),
+    ("Customs Reference", 320, 40, ["CBBE1 E 71234"]),
+    ("8 Consignee", 20, 90, ["LANKA TRADING PVT LTD", "45 GALLE ROAD", "COLOMBO 03"]),
+    ("9 Person Responsible for Financial Settlement", 320, 90, ["LANKA TRADING PVT LTD"]),
+    ("11 Trading", 20, 140, ["CN"]),
+    ("14 Declarant/Representative", 120, 140, ["CEYLON CLEARING AGENCY", "PO BOX 12"]),
+    ("15 Country of Export", 400, 140, ["CN"]),
+    ("16 Country of origin", 20, 190, ["CN"]),
+    ("18 Vessel/Flight", 200, 190, ["MSC AURORA V.123"]),
+    ("20 Delivery Terms", 420, 190, ["FOB SHANGHAI"]),
+    ("23 Exchange Rate", 20, 240, ["298.50"]),
+    ("28 Financial and banking data", 200, 240, ["LC 4411", "BANK OF CEYLON"]),
+    ("Guarantee LKR", 480, 240, ["0.00"]),
+    ("31 Marks & Nos of Packages", 20, 290, ["ACME 1-10"]),
+    ("Number & Kind", 220, 290, ["10 CARTONS"]),
+    ("Description", 400, 290, ["LAPTOP COMPUTERS", "14 INCH"]),
+    ("35 Gross Mass", 20, 340, ["1,250.5"]),
+    ("38 Net Mass", 200, 340, ["1,100"]),
+]
+
+FREE_TEXT_FIELDS = [
+    "Box 2: Exporter", "Box 8: Consignee", "Box 9: Person Responsible for Financial Settlement",
+    "Box 14: Declarant/Representative", "Box 18: Vessel/Flight", "Box 28: Financial and banking data",
+    "Box 31: Description", "Marks & Nos of Packages", "Number & Kind",
+]
+
+
+def words_for_line(text, top, x0):
+    """Positioned words for one line, [text, x0, top, x1, bottom], about 6 points per character."""
+    words, x = [], x0
+    for token in text.split():
+        words.append([token, x, top, x + 6 * len(token), top + 8])
+        x += 6 * len(token) + 4
+    return words
+
+
+def box_page(boxes=BOXES):
+    words = []
+    for label, x0, top, values in boxes:
+        words += words_for_line(label, top, x0)
+        for row, value in enumerate(values):
+            words += words_for_line(value, top + 12 + 10 * row, x0)
+    lines = {}
+    for word in sorted(words, key=lambda w: (w[2], w[1])):
+        lines.setdefault(word[2], []).append(word[0])
+    return {
+        "document_text": "\n".join(" ".join(line) for line in lines.values()),
+        "specific_box_texts": {
+            "Customs Reference Code E Value": "CBBE1",
+            "Declarant Sequence Number Value": "2024 #3012",
+            "D.Val Value": "12345.00",
+            "D.Qty Value": "100",
+        },
+        "words": words,
+        "page_meta": {},
+    }
+
+
+def test_every_field_is_extracted():
+    assert set(extract_fields_locally(box_page())) == set(COMMON_FIELDS_MAP.values())
+
+
+def test_values_under_their_label_are_confirmed_by_pattern():
+    resolved = confident_fields(extract_fields_locally(box_page()))
+    assert resolved["Box 11: Trading"] == "CN"
+    assert resolved["Box 15: Country of Export"] == "CN"
+    assert resolved["Box 16: Country of origin"] == "CN"
+    assert resolved["Box 20: Delivery Terms"] == "FOB SHANGHAI"
+    assert resolved["Box 23: Exchange Rate"] == "298.50"
+    assert resolved["Guarantee LKR"] == "0.00"
+    assert resolved["Box 35: Gross Mass (Kg)"] == "1,250.5"
+    assert resolved["Box 38: Net Mass (Kg)"] == "1,100"
+
+
+def test_neighbouring_label_is_not_taken_as_the_value():
+    field = extract_fields_locally(box_page())["Box 16: Country of origin"]
+    # "18 Vessel/Flight" is right of the label on its line; the value is under it
+    assert field["value"] == "CN"
+    assert field["rule"] == "geometry:Country of origin:below"
+
+
+def test_free_text_fields_are_left_to_gemini():
+    fields = extract_fields_locally(box_page())
+    resolved = confident_fields(fields)
+    for name in FREE_TEXT_FIELDS:
+        assert name not in resolved
+    # The guess is kept for display but is only the first line of a multi-line box
+    assert fields["Box 2: Exporter"]["value"] == "ACME EXPORTS LTD"
+    assert fields["Box 2: Exporter"]["confidence"] < LOCAL_CONFIDENCE_THRESHOLD
+
+
+def test_unconfirmed_value_stays_below_threshold():
+    boxes = [box if box[0] != "15 Country of Export" else ("15 Country of Export", 400, 140, ["CHINA"])
+             for box in BOXES]
+    fields = extract_fields_locally(box_page(boxes))
+    assert fields["Box 15: Country of Export"]["value"] == "CHINA"
+    assert "Box 15: Country of Export" not in confident_fields(fields)
+
+
+def test_same_line_text_without_words_stays_below_threshold():
+    page = dict(box_page(), words=[], document_text="Exporter: ACME EXPORTS LTD")
+    fields = extract_fields_locally(page)
+    assert fields["Box 2: Exporter"]["value"] == "ACME EXPORTS LTD"
+    assert "Box 2: Exporter" not in confident_fields(fields)
@@ -0,0 +1,114 @@
+import pdfplumber.page
+
+import cusdec_pdf
+from benchmarks.bench_first_page_open import build_synthetic_pdf
+from cusdec_pdf import iter_pages, open_first_page, parse_first_page
+
+
+def count_pages_built(monkeypatch):
+    built = []
+    original = pdfplumber.page.Page.__init__
+
+    def counting_init(self, *args, **kwargs):
+        built.append(kwargs.get("page_number"))
+        original(self, *args, **kwargs)
+
+    monkeypatch.setattr(pdfplumber.page.Page, "__init__", counting_init)
+    return built
+
+
+def test_lazy_open_builds_only_the_first_page(monkeypatch):
+    file_bytes = build_synthetic_pdf(50, lines_per_page=3)
+    built = count_pages_built(monkeypatch)
+    with open_first_page(file_bytes, lazy=True) as (page, page_count):
+        text = page.extract_text()
+    assert page_count == 50
+    assert "page 1 " in text
+    # Opening and closing must not construct the other 49 pages
+    assert built == [1]
+
+
+def test_lazy_and_full_open_agree():
+    file_bytes = build_synthetic_pdf(5, lines_per_page=3)
+    with open_first_page(file_bytes, lazy=True) as (page, page_count):
+        lazy = (page.extract_text(), page.bbox, page_count)
+    with open_first_page(file_bytes, lazy=False) as (page, page_count):
+        full = (page.extract_text(), page.bbox, page_count)
+    assert lazy == full
+
+
+def test_iter_pages_builds_each_page_once(monkeypatch):
+    file_bytes = build_synthetic_pdf(6, lines_per_page=2)
+    built = count_pages_built(monkeypatch)
+    assert [number for number, _ in iter_pages(file_bytes)] == [1, 2, 3, 4, 5, 6]
+    assert built == [1, 2, 3, 4, 5, 6]
+
+
+def test_parse_first_page_of_a_bundle(monkeypatch, tmp_path):
+    monkeypatch.setattr(cusdec_pdf, "TEMPLATE_STORE", cusdec_pdf.TEMPLATE_STORE.__class__(str(tmp_path / "t.db")))
+    parsed = parse_first_page(build_synthetic_pdf(20, lines_per_page=3))
+    assert "page 1 " in parsed["document_text"]
+    assert "page 2 " not in parsed["document_text"]
+
+
+class DoneFuture:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def test_provisional_parse_is_not_cached(monkeypatch, tmp_path):
+    cache = cusdec_pdf.TwoTierCache("parsed_pages", 1 << 20, 1 << 20, cache_dir=str(tmp_path))
+    monkeypatch.setattr(cusdec_pdf, "PARSE_CACHE", cache)
+    page = {"document_text": "", "specific_box_texts": {}, "words": [], "page_meta": {"provisional": True}}
+
+    cusdec_pdf.get_parsed_page("a.pdf", b"a", DoneFuture(page))
+    assert not cache.contains(cusdec_pdf.parse_cache_key(b"a"))
+
+    settled_page = dict(page, page_meta={"provisional": False})
+    cusdec_pdf.get_parsed_page("a.pdf", b"a", DoneFuture(settled_page))
+    assert cache.contains(cusdec_pdf.parse_cache_key(b"a"))
+
+
+def edge_chars(template, bbox):
+    """Chars touching each edge of bbox from outside, and straddling each edge."""
+    x0, top, x1, bottom = bbox
+    width, height = template["x1"] - template["x0"], template["bottom"] - template["top"]
+    mid_x, mid_y = (x0 + x1) / 2, (top + bottom) / 2
+    boxes = [
+        (x1, mid_y, x1 + width, mid_y + height),  # touches the right edge
+        (x0 - width, mid_y, x0, mid_y + height),  # touches the left edge
+        (mid_x, top - height, mid_x + width, top),  # touches the top edge
+        (mid_x, bottom, mid_x + width, bottom + height),  # touches the bottom edge
+        (x1 - width / 2, top + 2, x1 + width / 2, top + 2 + height),  # straddles the right edge
+        (mid_x + width, bottom - height / 2, mid_x + 2 * width, bottom + height / 2),  # straddles the bottom
+    ]
+    chars = []
+    for letter, (cx0, ctop, cx1, cbottom) in zip("RLTBSD", boxes):
+        chars.append(dict(template, text=letter, x0=cx0, x1=cx1, top=ctop, bottom=cbottom,
+                          doctop=ctop, y0=template["y0"], y1=template["y1"]))
+    return chars
+
+
+def test_region_text_matches_pdfplumber_crop():
+    file_bytes = build_synthetic_pdf(1, lines_per_page=60)
+    with open_first_page(file_bytes, lazy=True) as (page, _):
+        chars = list(page.chars)
+        for bbox in cusdec_pdf.SPECIFIC_BOX_COORDS.values():
+            chars += edge_chars(chars[0], bbox)
+        page._objects = dict(page.objects, char=chars)
+        index = cusdec_pdf.CharIndex(page.chars, page.bbox)
+        for name, bbox in cusdec_pdf.SPECIFIC_BOX_COORDS.items():
+            assert index.region_text(bbox) == page.crop(bbox).extract_text(), name
+
+
+def test_parse_pool_workers_parse_like_inline():
+    file_bytes = build_synthetic_pdf(3, lines_per_page=3)
+    pool = cusdec_pdf.start_parse_pool(max_workers=1)
+    try:
+        pooled = pool.submit(cusdec_pdf.parse_pdf_job, "a.pdf", file_bytes).result(timeout=60)
+    finally:
+        pool.shutdown()
+    assert pooled["document_text"] == cusdec_pdf.parse_pdf_job("a.pdf", file_bytes)["document_text"]
@@ -0,0 +1,55 @@
+import cusdec_ratelimit
+from cusdec_ratelimit import GeminiRateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_bucket_blocks_when_empty_and_refills(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cusdec_ratelimit.time, "monotonic", clock.monotonic)
+    bucket = TokenBucket(60)  # one per second
+
+    assert all(bucket.reserve(1) == 0.0 for _ in range(60))
+    # Empty: the next taker has to wait one refill interval, the one after that two
+    assert bucket.reserve(1) == 1.0
+    assert bucket.reserve(1) == 2.0
+    assert not bucket.try_reserve(1)
+
+    clock.now += 3.0
+    assert bucket.try_reserve(1)
+    # A minute later it is full again, and no fuller
+    clock.now += 60.0
+    assert bucket.try_reserve(60)
+    assert not bucket.try_reserve(1)
+
+
+def test_limiter_waits_for_rpm_quota(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cusdec_ratelimit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(cusdec_ratelimit.time, "sleep", clock.sleep)
+    limiter = GeminiRateLimiter(rpm=2, tpm=0)
+
+    limiter.acquire(100)
+    limiter.acquire(100)
+    assert clock.slept == []
+    limiter.acquire(100)
+    assert clock.slept == [30.0]
+    assert limiter.limits() == "2 requests/min"
+
+
+def test_no_limit_by_default():
+    limiter = GeminiRateLimiter(rpm=0, tpm=0)
+    assert limiter.requests is None and limiter.tokens is None
+    assert limiter.limits() == "no limit"
+    assert all(limiter.try_acquire(10 ** 6) for _ in range(1000))
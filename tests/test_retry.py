@@ -0,0 +1,34 @@
+import cusdec_retry
+from cusdec_retry import CircuitBreaker
+
+
+def open_breaker(monkeypatch, clock):
+    monkeypatch.setattr(cusdec_retry.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(threshold=2, reset_seconds=30, probe_timeout=120)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.is_open
+    return breaker
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    clock = [0.0]
+    breaker = open_breaker(monkeypatch, clock)
+    assert not breaker.allow()
+    clock[0] = 30.0
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open and breaker.allow()
+
+
+def test_probe_that_never_reports_back_is_written_off(monkeypatch):
+    clock = [0.0]
+    breaker = open_breaker(monkeypatch, clock)
+    clock[0] = 30.0
+    assert breaker.allow()  # this probe's caller then dies on an uncaught error
+    clock[0] = 149.0
+    assert not breaker.allow()
+    clock[0] = 150.0
+    assert breaker.allow()
+    assert not breaker.allow()
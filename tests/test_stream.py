@@ -0,0 +1,53 @@
+import json
+
+from cusdec_prompt import build_response_schema
+from cusdec_stream import FieldStreamer
+
+FIELDS = {"box_2_exporter": "Box 2: Exporter", "d_val": "D.Val", "box_35_gross_mass": "Box 35: Gross Mass (Kg)"}
+
+
+def chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def stream(streamer, text, size):
+    """Feed text in chunks of size; returns {chunk index: fields emitted by then}."""
+    emitted = []
+    streamer.on_field = lambda name, value: emitted.append((name, value))
+    seen = {}
+    for n, chunk in enumerate(chunks(text, size)):
+        streamer.feed(chunk)
+        seen[n] = dict(emitted)
+    streamer.finish()
+    return dict(emitted), seen
+
+
+def test_split_json_reply_yields_each_property_once_complete():
+    _, property_to_display = build_response_schema(FIELDS)
+    payload = {prop: value for prop, value in zip(property_to_display, ['ACME EXPORTS, "LTD"', "12345.00", "1,250"])}
+    text = json.dumps(payload, indent=1)
+    for size in (1, 3, 7, len(text)):
+        fields, seen = stream(FieldStreamer(property_to_display), text, size)
+        assert fields == {property_to_display[prop]: value for prop, value in payload.items()}
+        # No value is ever emitted half-received
+        for partial_fields in seen.values():
+            for name, value in partial_fields.items():
+                assert value == fields[name]
+
+
+def test_split_line_reply_yields_each_line_once_complete():
+    text = "Box 2: Exporter: ACME EXPORTS LTD\nD.Val: 12345.00\nD.Qty: 100"
+    for size in (1, 4, 9, len(text)):
+        fields, seen = stream(FieldStreamer(), text, size)
+        assert fields == {"Box 2: Exporter": "ACME EXPORTS LTD", "D.Val": "12345.00", "D.Qty": "100"}
+        for partial_fields in seen.values():
+            for name, value in partial_fields.items():
+                assert value == fields[name]
+
+
+def test_line_reply_to_a_json_request_is_parsed_at_the_end():
+    # The model ignored the schema: nothing streams, but finish() parses the lines like decode_gemini_reply
+    _, property_to_display = build_response_schema(FIELDS)
+    fields, seen = stream(FieldStreamer(property_to_display), "D.Val: 12345.00\nBox 2: Exporter: ACME", 4)
+    assert seen[max(seen)] == {}
+    assert fields == {"D.Val": "12345.00", "Box 2: Exporter": "ACME"}
@@ -0,0 +1,61 @@
+from cusdec_templates import ANCHOR_LABELS, REFERENCE_MIN_PAGES, TemplateStore, fingerprint
+
+BASE_COORDS = {"D.Val Value": (450, 500, 550, 530)}
+PAGE_BBOX = (0, 0, 842, 595)
+
+
+def layout(dx=0.0, dy=0.0):
+    return {label: (100.0 + 50 * n + dx, 40.0 + 60 * n + dy) for n, label in enumerate(ANCHOR_LABELS)}
+
+
+def bbox_set(store, anchors):
+    return store.bbox_set_for(fingerprint(anchors, (842, 595)), anchors, PAGE_BBOX, BASE_COORDS, "v1")[0]
+
+
+def settled(store, anchors):
+    return store.bbox_set_for(fingerprint(anchors, (842, 595)), anchors, PAGE_BBOX, BASE_COORDS, "v1")[1]
+
+
+def test_odd_first_page_does_not_become_the_reference(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.sqlite3"))
+    # A shifted one-off page first: with no trusted reference it gets the base boxes
+    assert bbox_set(store, layout(dx=30)) == BASE_COORDS
+    for _ in range(REFERENCE_MIN_PAGES - 1):
+        assert bbox_set(store, layout()) == BASE_COORDS
+    # The agreeing pages make the reference; the shifted layout is now calibrated against it
+    assert bbox_set(store, layout()) == {"D.Val Value": (450, 500, 550, 530)}
+    assert bbox_set(store, layout(dx=30)) == {"D.Val Value": (480, 500, 580, 530)}
+
+
+def test_page_missing_anchors_never_proposes_a_reference(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.sqlite3"))
+    partial = dict(list(layout().items())[:3])
+    for _ in range(REFERENCE_MIN_PAGES + 1):
+        assert bbox_set(store, partial) == BASE_COORDS
+    assert store._load("reference@v1") is None
+
+
+def test_reference_survives_a_restart(tmp_path):
+    path = str(tmp_path / "templates.sqlite3")
+    store = TemplateStore(path)
+    for _ in range(REFERENCE_MIN_PAGES):
+        bbox_set(store, layout())
+    restarted = TemplateStore(path)
+    assert bbox_set(restarted, layout(dy=-10)) == {"D.Val Value": (450, 490, 550, 520)}
+
+
+def test_pages_before_the_reference_are_not_settled(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.sqlite3"))
+    assert [settled(store, layout()) for _ in range(REFERENCE_MIN_PAGES + 1)] == \
+        [False] * (REFERENCE_MIN_PAGES - 1) + [True, True]
+
+
+def test_workers_count_agreeing_pages_together(tmp_path):
+    # One store per parse worker process, all on the same file
+    path = str(tmp_path / "templates.sqlite3")
+    workers = [TemplateStore(path) for _ in range(REFERENCE_MIN_PAGES)]
+    for worker in workers[:-1]:
+        assert not settled(worker, layout())
+    assert settled(workers[-1], layout())
+    assert settled(workers[0], layout(dx=30))
+    assert bbox_set(workers[0], layout(dx=30)) == {"D.Val Value": (480, 500, 580, 530)}
@@ -0,0 +1,77 @@
+import io
+
+import pdfplumber
+
+from cusdec_triage import ROUTE_PROCESS, ROUTE_REJECT, triage_pdf
+
+FONT = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+
+def build_pdf(content, form=None):
+    """A one-page PDF drawing content; form, if given, is the content of Form XObject /X1."""
+    resources = b"<< /Font << /F1 3 0 R >>" + (b" /XObject << /X1 5 0 R >>" if form is not None else b"") + b" >>"
+    objects = [
+        (1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+        (2, b"<< /Type /Pages /Count 1 /Kids [6 0 R] >>"),
+        (3, FONT),
+        (4, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"),
+    ]
+    if form is not None:
+        objects.append((5, b"<< /Type /XObject /Subtype /Form /BBox [0 0 842 595] /Resources << /Font << /F1 3 0 R >> >> "
+                           b"/Length %d >>\nstream\n" % len(form) + form + b"\nendstream"))
+    else:
+        objects.append((5, b"null"))
+    objects.append((6, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 842 595] /Resources " + resources
+                       + b" /Contents 4 0 R >>"))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + body + b"\nendobj\n"
+    xref_pos = len(out)
+    out += b"xref\n0 7\n0000000000 65535 f \n"
+    for obj_id in range(1, 7):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size 7 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % xref_pos
+    return bytes(out)
+
+
+def first_page_text(file_bytes):
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        return pdf.pages[0].extract_text()
+
+
+def test_kerned_header_is_not_rejected():
+    # Kerning splits every word of the header across TJ literals, so no keyword is in the raw bytes
+    lines = [b"BT /F1 8 Tf 30 560 Td [(SRI LANKA CUS)-20(TOMS)] TJ ET",
+             b"BT /F1 8 Tf 30 550 Td [(GOODS DECLA)-20(RATION)] TJ ET"]
+    lines += [b"BT /F1 7 Tf 30 %d Td [(Box %d val)-15(ue here)] TJ ET" % (540 - 9 * i, i) for i in range(20)]
+    file_bytes = build_pdf(b"\n".join(lines))
+
+    report = triage_pdf(file_bytes)
+
+    assert "SRI LANKA CUSTOMS" in first_page_text(file_bytes)
+    assert report["route"] == ROUTE_PROCESS
+    assert report["has_text_layer"] is True
+    assert report["is_cusdec"] is False
+
+
+def test_text_inside_a_form_xobject_is_a_text_layer():
+    file_bytes = build_pdf(b"q /X1 Do Q", form=b"BT /F1 8 Tf 30 560 Td (SRI LANKA CUSTOMS) Tj ET")
+
+    report = triage_pdf(file_bytes)
+
+    assert "SRI LANKA CUSTOMS" in first_page_text(file_bytes)
+    assert report["route"] == ROUTE_PROCESS
+    assert report["has_text_layer"] is True
+    assert report["is_cusdec"] is True
+
+
+def test_page_without_any_text_is_rejected():
+    file_bytes = build_pdf(b"q /X1 Do Q", form=b"0 0 m 100 100 l S")
+
+    report = triage_pdf(file_bytes)
+
+    assert report["route"] == ROUTE_REJECT
+    assert "no text layer" in report["reason"]
@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+
+import cusdec_usage
+from cusdec_usage import UsageLedger, UsageTally, record_late_call, sum_usage
+
+
+def test_late_hedge_loser_is_charged_to_every_document_by_share(tmp_path, monkeypatch):
+    ledger = UsageLedger(str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setattr(cusdec_usage, "USAGE_LEDGER", ledger)
+    tally = UsageTally()
+    loser = {"model": "gemini-2.5-flash", "route": "primary", "status": 200, "prompt_tokens": 1000,
+             "cached_tokens": 0, "output_tokens": 200, "thinking_tokens": 0, "cost_usd": 0.001}
+
+    record_late_call([("a.pdf", 0.75), ("b.pdf", 0.25)], tally, loser)
+
+    assert sum_usage(tally.calls("a.pdf"))["prompt_tokens"] == 750
+    assert sum_usage(tally.calls("b.pdf"))["prompt_tokens"] == 250
+    assert ledger.totals()["prompt_tokens"] == 1000
+    assert ledger.totals()["cost_usd"] == 0.001
+
+
+def test_tally_accepts_entries_from_many_threads():
+    tally = UsageTally()
+    entry = {"prompt_tokens": 1, "cost_usd": 0.0}
+
+    def add():
+        for _ in range(500):
+            tally.add("a.pdf", [entry])
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(tally.calls("a.pdf")) == 4000
+    assert len(tally.all_calls()) == 4000
+
+
+def test_cached_input_is_priced_per_model():
+    usage = {"promptTokenCount": 1_000_000, "cachedContentTokenCount": 1_000_000}
+    assert cusdec_usage.call_usage("gemini-2.5-flash", usage)["cost_usd"] == 0.03
+    assert cusdec_usage.call_usage("gemini-2.5-pro", usage)["cost_usd"] == 0.125
+
+
+def test_context_cache_creation_is_recorded_with_its_storage_cost(tmp_path, monkeypatch):
+    ledger = UsageLedger(str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setattr(cusdec_usage, "USAGE_LEDGER", ledger)
+
+    cusdec_usage.record_cache_creation("gemini-2.5-pro", 200_000, 1800)
+
+    row = ledger._db().execute("SELECT filename, route, prompt_tokens, cost_usd, ttl_seconds FROM calls").fetchone()
+    assert row == (cusdec_usage.CONTEXT_CACHE_LEDGER_NAME, "context cache", 200_000, 0.45, 1800)
+
+
+def test_ledger_from_before_cache_creations_gains_the_ttl_column(tmp_path):
+    path = str(tmp_path / "ledger.sqlite3")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE calls (recorded_at REAL NOT NULL, filename TEXT NOT NULL, model TEXT, route TEXT, "
+                "status TEXT, prompt_tokens INTEGER, cached_tokens INTEGER, output_tokens INTEGER, "
+                "thinking_tokens INTEGER, cost_usd REAL, share REAL)")
+    old.commit()
+    old.close()
+    ledger = UsageLedger(path)
+
+    ledger.record("a.pdf", [{"model": "gemini-2.5-flash", "prompt_tokens": 10, "cost_usd": 0.5}])
+
+    assert ledger.totals() == {"calls": 1, "prompt_tokens": 10, "cached_tokens": 0, "output_tokens": 0,
+                               "thinking_tokens": 0, "cost_usd": 0.5}